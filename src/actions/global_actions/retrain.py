@@ -2,8 +2,6 @@ import logging
 import os
 import logging
 import pickle
-from src.loaders.asnr_dataloader import ASNRGraph
-from src.models.train import train_model
 
 from ..action import GlobalAction
 from ...static import PageState, GRAPH_VERSION_FOLDER, VERSIONS
@@ -25,12 +23,19 @@ class Retrain(GlobalAction):
         # Determine next version id
         graph_folder = os.path.join(GRAPH_VERSION_FOLDER, str(PageState.id))
         os.makedirs(graph_folder, exist_ok=True)
-        next_version = f"v{len(os.listdir(graph_folder))}"
-
-        # Retraining graph
-        features, edgelist, adj, _, _ = ASNRGraph(graph_obj=self.graph_gui.graph.graph).preprocess()
+        next_version = f"v{len([x for x in os.listdir(graph_folder) if x.endswith('.pkl')])}"
+
+        # Retraining graph; the training stack is loaded on first use
+        from src.loaders.asnr_dataloader import ASNRGraph
+        from src.loaders.array_store import array_store
+        from src.models.train import train_model
+        graph = self.graph_gui.graph
+        asnr = ASNRGraph(graph_obj=graph.graph)
+        arrays = array_store.load(graph.graph, PageState.id, PageState.version, graph.source,
+                                  graph.changes_since_load)
+        features, edgelist, adj, _, _ = asnr.preprocess(arrays=arrays)
         try:
-            train_model(PageState.id, next_version, features, edgelist, adj)
+            train_model(PageState.id, next_version, features, edgelist, adj, asnr.schema)
         except:
             return False
 
@@ -1,10 +1,9 @@
 import logging
-import os
-import pickle
 
 from ..action import GlobalAction
 from ...static import PageState, GRAPH_VERSION_FOLDER, VERSIONS
 from ...graph import Graph
+from ...loaders.version_store import version_store
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger("save.action")
@@ -18,7 +17,7 @@ class Save(GlobalAction):
 
     def do(self):
         filepath = PageState.version_path
-        os.makedirs(os.path.split(filepath)[0], exist_ok=True)
-        with open(filepath, "wb") as f:
-            pickle.dump(self.graph.state_dict, f)
+        # Only the changes against the previous version are written, see VersionStore
+        version_store.save(filepath, self.graph.state_dict, default_path=PageState.graph_path,
+                           source=self.graph.source, changes=self.graph.changes_since_load)
         logger.info(f"Graph saved to {filepath}")
@@ -1,7 +1,6 @@
 import traceback
 
 from ..action import GraphAction
-from ...models.inference import get_pred_edges
 from ...static import PageState
 
 
@@ -18,31 +17,36 @@ class Predict(GraphAction):
         if self.success:
             self._edges_were = self.graph_gui.graph.selected_directed_edges
             self._nodes_were = self.graph_gui.graph.selected_nodes
-            self.graph_gui.add_edges(self.directed_edges)
-            self.graph_gui.graph.deselect()
-            self.graph_gui.graph.select(nodes=self.nodes, edges=self.directed_edges)
+            # One change event and one page refresh for all predicted edges
+            with self.graph_gui.batch():
+                self.graph_gui.add_edges(self.directed_edges)
+                self.graph_gui.graph.deselect()
+                self.graph_gui.graph.select(nodes=self.nodes, edges=self.directed_edges)
         return self.success
 
     def undo(self):
         super().undo()
-        self.graph_gui.remove_edges(self.directed_edges)
-        self.graph_gui.graph.deselect()
-        self.graph_gui.graph.select(nodes=self._nodes_were, edges=self._edges_were)
+        with self.graph_gui.batch():
+            self.graph_gui.remove_edges(self.directed_edges)
+            self.graph_gui.graph.deselect()
+            self.graph_gui.graph.select(nodes=self._nodes_were, edges=self._edges_were)
 
     def _get_hanging_new_nodes(self):
         return self.graph_gui.graph.unpredicted_new_node_names
 
     def _predict_edges(self):
-        edges = []
-        for node_name in self.nodes:
-            try:
-                edges.extend(
-                    get_pred_edges(self.graph_gui.graph.graph,
-                                   PageState.id,
-                                   PageState.version,
-                                   node_name))
-            except Exception as e:
-                print(f"Exception occurred: {e}")
-                traceback.print_exc()
-                return None, False
-        return edges, True
+        from ...models.inference import predict_edges  # loads torch on first prediction
+        graph = self.graph_gui.graph
+        try:
+            # One forward pass for all the nodes
+            pred_edges = predict_edges(graph.graph,
+                                       PageState.id,
+                                       PageState.version,
+                                       self.nodes,
+                                       graph.source,
+                                       graph.changes_since_load)
+        except Exception as e:
+            print(f"Exception occurred: {e}")
+            traceback.print_exc()
+            return None, False
+        return [edge for node_name in self.nodes for edge in pred_edges[node_name][0]], True
@@ -1,23 +1,122 @@
 from __future__ import annotations
 
 import os
+import itertools
 import logging
-import pickle
+from contextlib import contextmanager
+from types import MappingProxyType
 import networkx as nx
 from PyQt6.QtCore import QObject, pyqtSignal
 
 from .static import PageState
 from src.loaders.asnr_dataloader import ASNRGraph
+from src.loaders.version_store import version_store
+from src.utils.csr_graph import CSRGraph
+from src.utils.degree_index import DegreeIndex
+from src.utils.graph_diff import GraphDiff, compute_diff, diff_cache
+from src.utils.centrality import DynamicCentrality, MAX_INCREMENTAL_DELTA, compute_centrality, use_approximation
+from src.metric_service import MetricService, PENDING
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger('graph')
 
 
+_graph_ids = itertools.count()
+
+
+def _file_token(filepath):
+    stat = os.stat(filepath)
+    return os.path.abspath(filepath), stat.st_mtime_ns, stat.st_size
+
+
+class MetricCache:
+    """
+    Memoizes derived metrics of a graph until its version changes.
+    """
+
+    def __init__(self):
+        self.version = None
+        self.values = {}
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, version, compute):
+        if version != self.version:
+            self.values = {}
+            self.version = version
+        if key in self.values:
+            self.hits += 1
+        else:
+            self.misses += 1
+            self.values[key] = compute()
+        return self.values[key]
+
+    def has(self, key, version):
+        return version == self.version and key in self.values
+
+    def put(self, key, version, value):
+        # Results of an outdated version are of no use anymore
+        if version == self.version:
+            self.values[key] = value
+
+    def clear(self):
+        self.version = None
+        self.values = {}
+
+    @property
+    def stats(self):
+        return {"hits": self.hits, "misses": self.misses, "version": self.version}
+
+
+def undirected_key(edge):
+    return frozenset((edge[0], edge[1]))
+
+
+class Selection:
+    """
+    Insertion-ordered selection with O(1) membership. Items are indexed by `key`,
+    so e.g. both orientations of an undirected edge map to the same entry.
+    """
+
+    def __init__(self, items=(), key=None):
+        self.key = key if key is not None else (lambda item: item)
+        self._items = {}
+        self.update(items)
+
+    def update(self, items):
+        for item in items:
+            self._items.setdefault(self.key(item), item)
+
+    def toggle(self, item):
+        """Select or unselect `item`, returns whether it is selected afterwards"""
+        key = self.key(item)
+        if key in self._items:
+            del self._items[key]
+            return False
+        self._items[key] = item
+        return True
+
+    def keys(self):
+        return frozenset(self._items.keys())
+
+    def __contains__(self, item):
+        return self.key(item) in self._items
+
+    def __iter__(self):
+        return iter(self._items.values())
+
+    def __len__(self):
+        return len(self._items)
+
+
 class Graph(QObject):
 
     node_selection_changed = pyqtSignal(list, name="node_change")
     edge_selection_changed = pyqtSignal(list, name="edge_change")
     graph_updated = pyqtSignal(name="graph_updated")
+    graph_changed = pyqtSignal(object, name="graph_changed")  # GraphDiff of the (batched) mutation
+    metric_ready = pyqtSignal(str, name="metric_ready")
+    metric_failed = pyqtSignal(str, str, name="metric_failed")  # metric name, error message
 
     # =====================================================
     # Initialisers
@@ -26,12 +125,25 @@ class Graph(QObject):
     def __init__(self, graph: nx.Graph):
         super().__init__()
         self.graph = graph
+        self.version = 0
+        self.source = None  # Identifies the file the graph was read from, see `revision`
+        self._uid = next(_graph_ids)
+        self._metric_cache = MetricCache()
+        self._centrality = DynamicCentrality()
+        self._changes = []  # (version, change) of the latest mutations
+        self._history = []  # every change since the graph was read from `source`
+        self._degree_index = DegreeIndex(graph)
+        self._batch_depth = 0
+        self._batch_changes = []
+        self._batch_signals = {}
+        self.approximate_centrality = None  # None: sampled above APPROX_NODE_THRESHOLD nodes
         self.deselect()
         self.clean_empty_nodes()
-        self._selected_nodes = []
-        self._selected_directed_edges = []
         self.fresh_nodes = []
         self.node_layout = None
+        self._metric_errors = {}  # metric name -> (version, message) of failed computations
+        MetricService.metric_ready.connect(self._on_metric_ready)
+        MetricService.metric_failed.connect(self._on_metric_failed)
 
     @classmethod
     def from_graphml(cls, filepath) -> Graph:
@@ -39,6 +151,7 @@ class Graph(QObject):
         asnr = ASNRGraph(path=filepath)
         # graph_obj = cls(nx.read_graphml(filepath))
         graph_obj = cls(asnr.graph)
+        graph_obj.source = _file_token(filepath)
         return graph_obj
 
     @classmethod
@@ -52,9 +165,9 @@ class Graph(QObject):
     @classmethod
     def from_pkl(cls, filepath) -> Graph:
         logger.info(f"Reading graph {filepath}")
-        with open(filepath, "rb") as f:
-            state_dict = pickle.load(f)
-        return cls.from_state_dict(state_dict)
+        graph_obj = cls.from_state_dict(version_store.load(filepath))
+        graph_obj.source = _file_token(filepath)
+        return graph_obj
 
     @classmethod
     def from_page_info(cls) -> Graph:
@@ -69,40 +182,74 @@ class Graph(QObject):
 
     @property
     def centrality_dict(self) -> dict:
-        return {
-            "betweeness": nx.betweenness_centrality(self.graph),
-            "closeness": nx.closeness_centrality(self.graph),
-            # "eigenvector": nx.eigenvector_centrality(self.graph),
-            "degree": nx.degree_centrality(self.graph)
-        }
+        return self._cached("centrality", self._compute_centrality)[0]
+
+    @property
+    def centrality_error(self):
+        """Estimated error of sampled centralities, None when they are exact"""
+        return self._cached("centrality", self._compute_centrality)[1]
+
+    def available_metrics(self):
+        """
+        Centralities and their errors without blocking: while betweenness and closeness are
+        computed in the background only degree centrality is returned, `metric_ready` follows.
+        """
+        result = self.request_centrality()
+        if result is PENDING:
+            return {"degree": self.degree_centrality}, None
+        return result
+
+    @property
+    def revision(self):
+        """
+        Hashable identity of this graph state within the process, None if it has no stable
+        source. Unedited graphs read from the same file share it; once edited, the state is
+        also told apart by the Graph holding it, as other Graphs number their edits the same.
+        """
+        if self.source is None:
+            return None
+        if self.version == 0:
+            return self.source, self.version
+        return self.source, self.version, self._uid
+
+    @property
+    def metric_cache_stats(self) -> dict:
+        return self._metric_cache.stats
 
     @property
     def selected_nodes(self):
-        return self._selected_nodes
+        return list(self._node_selection)
 
     @property
     def unpredicted_new_node_names(self):
-        degrees = self.degrees
+        degrees = self._degree_index
         return [node for node in self.fresh_nodes if degrees[node] == 0]
 
     @property
     def predicted_new_node_names(self):
-        degrees = self.degrees
+        degrees = self._degree_index
         return [node for node in self.fresh_nodes if degrees[node] != 0]
 
     @property
     def selected_directed_edges(self):
-        return self._selected_directed_edges
+        return list(self._edge_selection)
 
     @selected_nodes.setter
     def selected_nodes(self, value):
-        self._selected_nodes = value
-        self.node_selection_changed.emit(self._selected_nodes)
+        self._node_selection = Selection(value)
+        self._notify("node_selection_changed", self.selected_nodes)
 
     @selected_directed_edges.setter
     def selected_directed_edges(self, value):
-        self._selected_directed_edges = value
-        self.edge_selection_changed.emit(self._selected_directed_edges)
+        self._edge_selection = Selection(value, key=undirected_key)
+        self._notify("edge_selection_changed", self.selected_directed_edges)
+
+    def is_node_selected(self, node_name):
+        return node_name in self._node_selection
+
+    def is_edge_selected(self, edge):
+        # Either orientation of the edge counts
+        return edge in self._edge_selection
 
     @property
     def metrics(self) -> dict:
@@ -128,26 +275,46 @@ class Graph(QObject):
     def undirected_edges(self) -> dict:
         return {k: set(v) for (k, v) in self.directed_edges.items()}
 
+    @property
+    def csr(self) -> CSRGraph:
+        """Array-backed view of the graph, rebuilt lazily after each mutation"""
+        return self._cached("csr", lambda: CSRGraph.from_networkx(self.graph))
+
     @property
     def degrees(self):
-        return dict(self.graph.degree())
+        # Read-only view, kept up to date per edge change by DegreeIndex
+        return MappingProxyType(self._degree_index.degree)
+
+    def degree_of(self, node):
+        return self._degree_index[node]
+
+    @property
+    def degree_centrality(self):
+        degrees = self._degree_index.degree
+        if len(degrees) <= 1:
+            return dict.fromkeys(degrees, 1)
+        scale = 1 / (len(degrees) - 1)
+        return {node: degree * scale for node, degree in degrees.items()}
 
     @property
     def avg_degree(self):
-        degrees = self.degrees
-        return sum(list(degrees.values())) / len(degrees)
+        return self._degree_index.mean
+
+    @property
+    def median_degree(self):
+        return self._degree_index.median
 
     @property
     def min_degree(self):
-        return min(list(self.degrees.values()))
+        return self._degree_index.min
 
     @property
     def max_degree(self):
-        return max(list(self.degrees.values()))
+        return self._degree_index.max
 
     @property
     def hanging_nodes(self):
-        degrees = self.degrees
+        degrees = self._degree_index
         nodes = self.nodes
         return {
             node_name: nodes[node_name] for node_name in self.fresh_nodes if degrees[node_name] == 0
@@ -160,7 +327,7 @@ class Graph(QObject):
 
     @property
     def selected_undirected_edges(self):
-        return [set([edge[0], edge[1]]) for edge in self.selected_directed_edges]
+        return self._edge_selection.keys()
 
     @property
     def state_dict(self):
@@ -182,19 +349,25 @@ class Graph(QObject):
     # Add
 
     def add_nodes(self, nodes):
-        self.graph.add_nodes_from(nodes)
-        # Note: append would not work here, because we need to trigger .setter
-        self.selected_nodes = self._selected_nodes + [name for name, _ in nodes]
-        self.fresh_nodes.extend([name for name, _ in nodes])
-        logger.info(f"New nodes. Selected nodes are {self.selected_nodes}")
-        self.graph_updated.emit()
+        with self.batch():
+            added_nodes = [name for name, _ in nodes if name not in self.graph]
+            self.graph.add_nodes_from(nodes)
+            self._mark_changed(added_nodes=added_nodes)
+            # Note: append would not work here, because we need to trigger .setter
+            self.selected_nodes = self.selected_nodes + [name for name, _ in nodes]
+            self.fresh_nodes.extend([name for name, _ in nodes])
+            logger.info(f"New nodes. Selected nodes are {self.selected_nodes}")
+            self._notify("graph_updated")
 
     def add_edges(self, edges):
-        self.graph.add_edges_from(edges)
-        # Note: append would not work here, because we need to trigger .setter
-        self.selected_directed_edges = self._selected_directed_edges + list(edges)
-        logger.info(f"New edges. Selected edges are {self.selected_directed_edges}")
-        self.graph_updated.emit()
+        with self.batch():
+            added_edges = self._distinct_edges(edges, present=False)
+            self.graph.add_edges_from(edges)
+            self._mark_changed(added_edges=added_edges)
+            # Note: append would not work here, because we need to trigger .setter
+            self.selected_directed_edges = self.selected_directed_edges + list(edges)
+            logger.info(f"New edges. Selected edges are {self.selected_directed_edges}")
+            self._notify("graph_updated")
 
     def add_node(self, node):
         self.add_nodes([node])
@@ -206,19 +379,28 @@ class Graph(QObject):
     def remove_nodes(self, nodes=None):
         if nodes is None or nodes[0] is None:
             nodes = self.selected_nodes
-        self.graph.remove_nodes_from(nodes)
-        self.fresh_nodes = [n for n in self.fresh_nodes if n not in nodes]
-        new_selection = [x for x in self.selected_nodes if x not in nodes]
-        self.selected_nodes = new_selection
-        self.graph_updated.emit()
+        with self.batch():
+            removed_edges = self._incident_edges(nodes)
+            removed_nodes = [node for node in nodes if node in self.graph]
+            self.graph.remove_nodes_from(nodes)
+            self._mark_changed(removed_edges=removed_edges, removed_nodes=removed_nodes)
+            self.fresh_nodes = [n for n in self.fresh_nodes if n not in nodes]
+            removed = set(nodes)
+            new_selection = [x for x in self.selected_nodes if x not in removed]
+            self.selected_nodes = new_selection
+            self._notify("graph_updated")
 
     def remove_edges(self, edges=None):
         if edges is None or edges[0] is None:
             edges = self.selected_directed_edges
-        self.graph.remove_edges_from(self.selected_directed_edges)
-        new_selection = [x for x in self.selected_directed_edges if x not in edges]
-        self.selected_directed_edges = new_selection
-        self.graph_updated.emit()
+        with self.batch():
+            removed_edges = self._distinct_edges(self.selected_directed_edges, present=True)
+            self.graph.remove_edges_from(self.selected_directed_edges)
+            self._mark_changed(removed_edges=removed_edges)
+            removed = Selection(edges, key=undirected_key)
+            new_selection = [x for x in self.selected_directed_edges if x not in removed]
+            self.selected_directed_edges = new_selection
+            self._notify("graph_updated")
 
     def remove_node(self, node=None):
         self.remove_nodes([node])
@@ -226,56 +408,230 @@ class Graph(QObject):
     def remove_edge(self, edge=None):
         self.remove_edges([edge])
 
+    # =====================================================
+    # Metric cache
+    # =====================================================
+
+    def _mark_changed(self, **change):
+        self._degree_index.apply(change)
+        with self.batch():
+            self._batch_changes.append(change)
+
+    def _cached(self, key, compute):
+        if self._batch_changes:
+            # Mid-batch state: computed on the fly, caches are only invalidated when the batch ends
+            return compute()
+        return self._metric_cache.get(key, self.version, compute)
+
+    def _compute_centrality(self, graph=None, version=None, changes=None):
+        if graph is None:
+            graph, version, changes = self.graph, self.version, self._changes
+            if self._batch_changes:
+                return compute_centrality(graph, self.approximate_centrality)
+        if use_approximation(graph, self.approximate_centrality):
+            return compute_centrality(graph, approximate=True)
+
+        betweenness, closeness = self._centrality.sync(graph, version, changes)
+        return {
+            "betweeness": betweenness,
+            "closeness": closeness,
+            # "eigenvector": nx.eigenvector_centrality(self.graph),
+            "degree": nx.degree_centrality(graph)
+        }, None
+
+    # =====================================================
+    # Batched mutations
+    # =====================================================
+
+    @contextmanager
+    def batch(self):
+        """
+        Group several mutations into one change: signals and cache invalidation are deferred
+        to the end of the outermost batch, which bumps the version once, emits each pending
+        signal once and `graph_changed` with the net delta.
+
+            with graph.batch():
+                graph.add_edges(edges)
+                graph.select(nodes=nodes, edges=edges)
+        """
+        self._batch_depth += 1
+        try:
+            yield self
+        finally:
+            self._batch_depth -= 1
+            if self._batch_depth == 0:
+                self._end_batch()
+
+    @property
+    def in_batch(self):
+        return self._batch_depth > 0
+
+    def _notify(self, signal_name, *args):
+        # Within a batch only the latest arguments of each signal are emitted, at the end
+        with self.batch():
+            self._batch_signals[signal_name] = args
+
+    def _end_batch(self):
+        changes, self._batch_changes = self._batch_changes, []
+        signals, self._batch_signals = self._batch_signals, {}
+        if changes:
+            # Every structural change bumps the version, which invalidates cached metrics
+            # and the background jobs computing them. The latest changes are kept so
+            # centralities can be patched instead of recomputed.
+            self.version += 1
+            self._changes.extend((self.version, change) for change in changes)
+            self._history.extend(changes)
+            excess = len(self._changes) - MAX_INCREMENTAL_DELTA
+            if excess > 0:
+                # Versions are dropped as a whole, a partial one could not be replayed
+                cut = self._changes[excess - 1][0]
+                self._changes = [entry for entry in self._changes[excess:] if entry[0] != cut]
+            MetricService.cancel(self._uid)
+
+        for signal_name, args in signals.items():
+            getattr(self, signal_name).emit(*args)
+        if changes:
+            self.graph_changed.emit(self._net_delta(changes))
+
+    @property
+    def changes_since_load(self) -> GraphDiff:
+        """Net structural change since the graph was read from `source`"""
+        return self._net_delta(self._history)
+
+    def _net_delta(self, changes) -> GraphDiff:
+        # Changes undone within the batch (e.g. an edge added and removed again) cancel out
+        edge_key = (lambda edge: edge) if self.graph.is_directed() else undirected_key
+        nodes, edges = {}, {}
+
+        def track(items, key, item, sign):
+            if items.get(key, (None, sign))[1] == -sign:
+                del items[key]
+            else:
+                items[key] = (item, sign)
+
+        for change in changes:
+            for node in change.get("added_nodes", ()):
+                track(nodes, node, node, 1)
+            for edge in change.get("added_edges", ()):
+                track(edges, edge_key(edge), tuple(edge), 1)
+            for edge in change.get("removed_edges", ()):
+                track(edges, edge_key(edge), tuple(edge), -1)
+            for node in change.get("removed_nodes", ()):
+                track(nodes, node, node, -1)
+
+        return GraphDiff(added_nodes=[node for node, sign in nodes.values() if sign > 0],
+                         removed_nodes=[node for node, sign in nodes.values() if sign < 0],
+                         added_edges=[edge for edge, sign in edges.values() if sign > 0],
+                         removed_edges=[edge for edge, sign in edges.values() if sign < 0],
+                         weight_changes={},
+                         attribute_changes={})
+
+    # =====================================================
+    # Background metrics
+    # =====================================================
+
+    @property
+    def snapshot(self) -> nx.Graph:
+        """Copy of the current version for the metric workers, the graph itself may change meanwhile"""
+        return self._cached("snapshot", self.graph.copy)
+
+    def request_metric(self, name, compute):
+        """
+        Cached value of metric `name`, or PENDING after scheduling `compute(snapshot)` on
+        the metric workers. `metric_ready` is emitted with `name` once the value is in.
+        """
+        if self._batch_changes:
+            return PENDING  # nothing is scheduled for a state that is still being edited
+        if self.metric_error(name) is not None:
+            return PENDING  # failed on this version, see metric_error; retried once it changes
+        if self._metric_cache.has(name, self.version):
+            return self._cached(name, None)
+        snapshot = self.snapshot
+        MetricService.request(self._uid, self.version, name, lambda: compute(snapshot))
+        return PENDING
+
+    def request_centrality(self):
+        version, changes = self.version, list(self._changes)
+        return self.request_metric(
+            "centrality", lambda graph: self._compute_centrality(graph, version, changes))
+
+    def metric_error(self, name):
+        """Error message if computing metric `name` failed for this version, else None"""
+        version, message = self._metric_errors.get(name, (None, None))
+        return message if version == self.version else None
+
+    def _on_metric_ready(self, owner, version, name, value):
+        if owner != self._uid or version != self.version:
+            return
+        self._metric_cache.put(name, version, value)
+        self.metric_ready.emit(name)
+
+    def _on_metric_failed(self, owner, version, name, message):
+        if owner != self._uid or version != self.version:
+            return
+        self._metric_errors[name] = (version, message)
+        self.metric_failed.emit(name, message)
+
     # =====================================================
     # Other utilities
     # =====================================================
 
+    def diff_from(self, other) -> GraphDiff:
+        """Everything that changed going from `other` to this graph, cached per pair of revisions"""
+        return diff_cache.get(
+            other.revision, self.revision,
+            lambda: compute_diff(other.csr, self.csr, dict(other.nodes), dict(self.nodes)))
+
     def difference_to(self, other=None):
 
         if other is None:
             return [], []
 
-        this_nodes = set([name for name, _ in self.nodes])
-        other_nodes = set([name for name, _ in other.nodes])
-        new_nodes = list(this_nodes - other_nodes)
-
-        new_edges = set(self.undirected_edges.keys())
-        for edge_name, edge in other.undirected_edges.items():
-            if edge_name in new_edges and edge == self.undirected_edges[edge_name]:
-                # Make sure edge exist with same name and value
-                new_edges.remove(edge_name)
-        new_edges = list(new_edges)
-
-        return new_nodes, new_edges
+        diff = self.diff_from(other)
+        return diff.added_nodes, diff.added_edges
+
+    def _distinct_edges(self, edges, present):
+        # (u, v) of the edges that are (present=True) or are not yet in the graph, each once:
+        # both orientations of an undirected edge, or an edge listed twice, are one change
+        key = (lambda edge: edge) if self.graph.is_directed() else undirected_key
+        seen = set()
+        distinct = []
+        for edge in edges:
+            edge = (edge[0], edge[1])
+            if key(edge) not in seen and self.graph.has_edge(*edge) == present:
+                seen.add(key(edge))
+                distinct.append(edge)
+        return distinct
+
+    def _incident_edges(self, nodes):
+        edges = list(self.graph.edges(nodes))
+        if self.graph.is_directed():
+            # edges() only lists out-edges of directed graphs
+            nodes = set(nodes)
+            edges.extend(edge for edge in self.graph.in_edges(nodes) if edge[0] not in nodes)
+        return edges
 
     def toggle_status_of_node(self, node_name):
-        if node_name in self.selected_nodes:
-            logger.info(f"Node {node_name} unselected.")
-            self._selected_nodes.remove(node_name)
-        else:
+        if self._node_selection.toggle(node_name):
             logger.info(f"Node {node_name} selected.")
-            self._selected_nodes.append(node_name)
-        self.node_selection_changed.emit(self._selected_nodes)
+        else:
+            logger.info(f"Node {node_name} unselected.")
+        self._notify("node_selection_changed", self.selected_nodes)
         logger.info(f"Selected nodes: {self.selected_nodes}")
 
     def toggle_status_of_edge(self, edge):
-        if edge in self.selected_undirected_edges:
-            if edge in self.selected_directed_edges:
-                self._selected_directed_edges.remove(edge)
-            else:
-                self._selected_directed_edges.remove((edge[1], edge[0]))
-            logger.info(f"Edge {edge} unselected.")
-        else:
-            self._selected_directed_edges.append(edge)
+        if self._edge_selection.toggle(edge):
             logger.info(f"Edge {edge} selected.")
-        self.edge_selection_changed.emit(self._selected_directed_edges)
+        else:
+            logger.info(f"Edge {edge} unselected.")
+        self._notify("edge_selection_changed", self.selected_directed_edges)
         logger.info(f"Selected edges: {self.selected_directed_edges}")
 
     def edges_of(self, node):
-        edges = []
-        for edge in self.graph.edges:
-            if edge[0] == node or edge[1] == node:
-                edges.append(edge)
+        csr = self.csr
+        edges = [(node, csr.names[nbr]) for nbr in csr.neighbors(csr.name_to_id[node])]
+        if csr.directed:
+            edges.extend(self.graph.in_edges(node))
         return edges
 
     def select(self, nodes=None, edges=None):
@@ -297,7 +653,10 @@ class Graph(QObject):
         for node, data in self.nodes:
             if len(data.keys()) == 0:
                 remove_arr.append(node)
+        removed_edges = self._incident_edges(remove_arr)
         [self.graph.remove_node(node) for node in remove_arr]
+        if remove_arr:
+            self._mark_changed(removed_edges=removed_edges, removed_nodes=remove_arr)
         return self.graph
 
     def reset(self):
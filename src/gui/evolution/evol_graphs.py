@@ -1,6 +1,6 @@
 import os
-import pickle
 import matplotlib
+import networkx as nx
 from matplotlib.backends.backend_qt5agg import FigureCanvasQTAgg
 from matplotlib.figure import Figure
 
@@ -10,6 +10,8 @@ from PyQt6.QtCore import Qt
 
 from src.static import PageState, GRAPH_VERSION_FOLDER, GRAPH_DATA
 from src.graph import Graph
+from src.loaders.temporal_stack import TemporalStack, snapshot_files
+from src.loaders.version_manifest import version_manifest, SUMMARY, CHANGES
 from src.gui.social_graph.graph import GraphCanvas
 from ..custom_buttons import BlueArrowButton
 
@@ -21,7 +23,12 @@ class GraphEvolution(QWidget):
     def __init__(self, parent):
         super().__init__()
         self.parent = parent
-        self.evolution_id = self.evolutions.index(PageState.version)  # Current evolution index
+        self.stack = self._load_stack()
+        if self.stack is not None:
+            self.evolution_id = [os.path.abspath(x) for x in self.stack.paths].index(
+                os.path.abspath(PageState.graph_path))
+        else:
+            self.evolution_id = self.evolutions.index(PageState.version)  # Current evolution index
 
         # Background utilities
         self.graph_gui = GraphCanvas(parent)
@@ -40,27 +47,64 @@ class GraphEvolution(QWidget):
         # Building up graphical interface on generated information
         self.build_layout()
 
+    def _load_stack(self):
+        """Snapshots of the animal directory, when the original graph is one of several"""
+        if PageState.version != 'default':
+            return None
+        folder = os.path.dirname(PageState.graph_path)
+        if len(snapshot_files(folder, like=PageState.graph_path)) < 2:
+            return None
+        return TemporalStack.from_folder(folder, like=PageState.graph_path)
+
     def _calculate_graph_changes(self):
 
-        graphs = {}
-        animal_folder = os.path.join(GRAPH_VERSION_FOLDER, PageState.id)
-        for evolution in self.evolutions:
-            if evolution == "default":
-                current_file = GRAPH_DATA[PageState.category][PageState.id]["path"]
-                graph = Graph.from_graphml(current_file)
-            else:
-                current_file = os.path.join(animal_folder, evolution + ".pkl")
-                graph = Graph.from_pkl(current_file)
-            graphs[evolution] = graph
-
-        self._avg_degrees = {e: graphs[e].avg_degree for e in self.evolutions}
-        self._avg_coeffs = {e: graphs[e].avg_coeff for e in self.evolutions}
-        self._n_nodes = {e: graphs[e].n_nodes for e in self.evolutions}
+        if self.stack is not None:
+            # Statistics straight from the aligned snapshot arrays
+            stack = self.stack
+            self._avg_degrees = {e: stack.avg_degree(t) for t, e in enumerate(self.evolutions)}
+            self._avg_coeffs = {e: round(nx.average_clustering(stack.graph(t)), 6)
+                                for t, e in enumerate(self.evolutions)}
+            self._n_nodes = {e: stack.n_nodes(t) for t, e in enumerate(self.evolutions)}
+            self.differences = {e: stack.difference(t) for t, e in enumerate(self.evolutions)}
+            return
+
+        # Statistics and changes of saved versions come from the version manifest; graphs are
+        # only loaded for versions it does not cover yet (e.g. saved before it existed)
+        manifest = self.manifest
+        graphs, summaries = {}, {}
+        for i, evolution in enumerate(self.evolutions):
+            path = self._evolution_path(evolution)
+            summary = manifest.summary(evolution, path) or {}
+            if evolution == 'default':
+                summary.update(added_nodes=[], added_edges=[])
+            missing = [key for key in SUMMARY + CHANGES if summary.get(key) is None]
+            if missing:
+                graph = self._evolution_graph(evolution, graphs)
+                summary.update(n_nodes=graph.n_nodes, n_edges=graph.graph.number_of_edges(),
+                               avg_degree=graph.avg_degree, avg_coeff=graph.avg_coeff)
+                if summary["added_nodes"] is None or summary["added_edges"] is None:
+                    prev_graph = self._evolution_graph(self.evolutions[i - 1], graphs)
+                    summary["added_nodes"], summary["added_edges"] = graph.difference_to(prev_graph)
+                manifest.record(evolution, path, **{key: summary[key] for key in missing})
+            summaries[evolution] = summary
+
+        self._avg_degrees = {e: summaries[e]["avg_degree"] for e in self.evolutions}
+        self._avg_coeffs = {e: summaries[e]["avg_coeff"] for e in self.evolutions}
+        self._n_nodes = {e: summaries[e]["n_nodes"] for e in self.evolutions}
 
         # Setting up differences between graphs
-        self.differences = {"default": graphs['default'].difference_to(None)}
-        for prev_evolution, evolution in zip(self.evolutions[:-1], self.evolutions[1:]):
-            self.differences[evolution] = graphs[evolution].difference_to(graphs[prev_evolution])
+        self.differences = {e: (summaries[e]["added_nodes"], summaries[e]["added_edges"]) for e in self.evolutions}
+
+    def _evolution_path(self, evolution):
+        if evolution == "default":
+            return GRAPH_DATA[PageState.category][PageState.id]["path"]
+        return os.path.join(GRAPH_VERSION_FOLDER, PageState.id, evolution + ".pkl")
+
+    def _evolution_graph(self, evolution, graphs):
+        if evolution not in graphs:
+            path = self._evolution_path(evolution)
+            graphs[evolution] = Graph.from_graphml(path) if evolution == "default" else Graph.from_pkl(path)
+        return graphs[evolution]
 
     # ===============================================
     # GUI build up
@@ -183,20 +227,13 @@ class GraphEvolution(QWidget):
     @property
     def evolutions(self):
         """List of evolutions"""
-        if PageState.version == 'default':
-            return ['default']
-        animal_folder = os.path.join(GRAPH_VERSION_FOLDER, PageState.id)
-        versions = [PageState.version]
-        while True:
-            current_file = os.path.join(animal_folder, versions[-1] + ".pkl")
-            with open(current_file, "rb") as f:
-                data = pickle.load(f)
-                prev_version = data['prev_version']
-            versions.append(prev_version)
-            if prev_version == 'default':
-                break
-        versions.reverse()
-        return versions
+        if getattr(self, 'stack', None) is not None:
+            return self.stack.labels
+        return self.manifest.lineage(PageState.version)
+
+    @property
+    def manifest(self):
+        return version_manifest(os.path.join(GRAPH_VERSION_FOLDER, PageState.id))
 
     @property
     def str_statistics(self):
@@ -219,7 +256,9 @@ class GraphEvolution(QWidget):
         animal_folder = os.path.join(GRAPH_VERSION_FOLDER, PageState.id)
 
         # Load graphs
-        if version != 'default' and os.path.exists(animal_folder) and os.listdir(animal_folder):
+        if self.stack is not None:
+            self.graph_gui.graph = Graph.from_graphml(self.stack.paths[self.evolution_id])
+        elif version != 'default' and os.path.exists(animal_folder) and os.listdir(animal_folder):
             file_path = os.path.join(GRAPH_VERSION_FOLDER, PageState.id, version + ".pkl")
             self.graph_gui.graph = Graph.from_pkl(filepath=file_path)
         elif version == 'default':
@@ -2,12 +2,15 @@ from PyQt6 import QtGui, QtWidgets, QtCore
 from PyQt6.QtWidgets import QDialog, QPushButton, QWidget, QVBoxLayout, QHBoxLayout, QLabel, QScrollArea, QTableWidget, QLineEdit, QSizePolicy
 import networkx as nx
 import numpy as np
-from ...utils.analytics_utils import get_correlations_att_edge
+from ...utils.analytics_utils import get_correlations_att_edge, get_path_lengths, get_average_clustering, \
+    get_average_eigenvector_centrality, get_average_pagerank
 import pandas as pd
 from collections import defaultdict
 from textwrap import wrap
-from .modularity import Modularity
+from .modularity import Modularity, girvan_newman_modularity
 from src.gui.social_graph.graph import GraphCanvas
+from src.gui.social_graph.side_bar import PENDING_VALUE, FAILED_VALUE
+from src.metric_service import PENDING
 from mycolorpy import colorlist as mcp
 from ..colors import cmap1, cmap1_str
 
@@ -179,6 +182,13 @@ class FullScreenWidget(QDialog):
         canvas_layout.addWidget(self.canvas)
 
 
+def _correlations(graph, features):
+    try:
+        return get_correlations_att_edge(graph, features)
+    except ValueError:
+        return None  # e.g. all pairs connected, no heatmap then
+
+
 class GraphAnalytics(QWidget):
     """
     Graph analytics page, contains metrics and visualizations
@@ -219,14 +229,43 @@ class GraphAnalytics(QWidget):
         self.attribute_distribution_cont = self.attribute_distribution_cont()
         self.modularity = Modularity(self.graph.graph)
 
-        self.info_tab2 = QLabel(text=f"The optimal number of communities is {self.modularity.subcommunity_n}, " + \
-                                     f"with Modularity = {self.modularity.max_modularity}.\n" + \
-                                          "Nodes are color-coded by community.",
-                                    alignment=QtCore.Qt.AlignmentFlag.AlignCenter)
+        self.info_tab2 = QLabel(text="Detecting communities\u2026",
+                                alignment=QtCore.Qt.AlignmentFlag.AlignCenter)
         self.graph_gui_small = GraphCanvas(self.parent)
-        self.graph_gui_small.node_colors = self.modularity.node_colors
         self.setup_ui()
 
+        # Slow metrics are computed by the metric workers; each one is shown as soon as it is in
+        self.graph.metric_ready.connect(self._on_metric_ready)
+        self.graph.metric_failed.connect(self._on_metric_failed)
+        for name in ["modularity", "correlations"]:
+            if self.graph.metric_error(name) is not None:
+                self._on_metric_failed(name, self.graph.metric_error(name))
+            else:
+                self._on_metric_ready(name)
+
+    def _on_metric_failed(self, name, message):
+        if name == "modularity":
+            self.modularity.set_error(message)
+            self.info_tab2.setText(f"Communities could not be detected: {message}")
+        elif name == "correlations":
+            self.heatmap_plot.setText(f"Attribute correlations could not be computed: {message}")
+        else:
+            self.fill_graph_analytics_table()
+
+    def _on_metric_ready(self, name):
+        if name == "modularity":
+            result = self.graph.request_metric("modularity", girvan_newman_modularity)
+            if result is not PENDING:
+                self.show_modularity(result)
+        elif name == "correlations":
+            features = {node: dict(data) for node, data in self.node_features.items()}
+            result = self.graph.request_metric("correlations",
+                                               lambda graph: _correlations(graph, features))
+            if result is not PENDING:
+                self.show_heatmap(result)
+        else:
+            self.fill_graph_analytics_table()
+
     def is_number(self, s):
         try:
             float(s)
@@ -264,17 +303,14 @@ class GraphAnalytics(QWidget):
                 190 * int(np.ceil(len(self.cont_attribute_labels) / 2)) + 100)
             plots_layout.addWidget(self.attribute_distribution_cont)
 
-        # # Add heatmap
-        try:
-            heatmap_plot = self.heatmap()
-            heatmap_plot.setFixedHeight(500)
-            plots_layout.addWidget(heatmap_plot)
-        except:
-            pass
+        # # Add heatmap, filled in by show_heatmap
+        self.heatmap_plot = QLabel(text="Computing attribute correlations\u2026",
+                                   alignment=QtCore.Qt.AlignmentFlag.AlignCenter)
+        plots_layout.addWidget(self.heatmap_plot)
 
         # add modularity plot
-        self.modularity.bar.setMinimumHeight(400)
-        plots_layout.addWidget(self.modularity.bar)
+        self.modularity.setMinimumHeight(400)
+        plots_layout.addWidget(self.modularity)
 
         self.graphlayout = QVBoxLayout()
 
@@ -289,8 +325,6 @@ class GraphAnalytics(QWidget):
         self.graphlayout.addWidget(self.info_tab2)
 
         self.graph_gui_small.setMinimumHeight(400)
-        self.graph_gui_small.node_colors = self.modularity.node_colors
-        self.graph_gui_small.refresh()
         self.graphlayout.addWidget(self.graph_gui_small)
         self.graphlayout.setSpacing(0)
 
@@ -349,10 +383,27 @@ class GraphAnalytics(QWidget):
         # canvas = FigureCanvasQTAgg(fig)
         return fig
 
-    def heatmap(self):
-        graph = self.parent.graph_page.graph_page.graph.graph
-        node_features = self.parent.graph_page.graph_page.features
-        correlations = get_correlations_att_edge(graph, node_features)
+    def show_modularity(self, result):
+        self.modularity.set_result(result)
+        self.info_tab2.setText(f"The optimal number of communities is {self.modularity.subcommunity_n}, " + \
+                               f"with Modularity = {self.modularity.max_modularity}.\n" + \
+                               "Nodes are color-coded by community.")
+        self.graph_gui_small.node_colors = self.modularity.node_colors
+        self.graph_gui_small.refresh()
+        self.graph_gui_small.draw_idle()
+
+    def show_heatmap(self, correlations):
+        try:
+            heatmap_plot = self.heatmap(correlations)
+            heatmap_plot.setFixedHeight(500)
+        except:
+            self.heatmap_plot.hide()
+            return
+        self.plots_layout.replaceWidget(self.heatmap_plot, heatmap_plot)
+        self.heatmap_plot.deleteLater()
+        self.heatmap_plot = heatmap_plot
+
+    def heatmap(self, correlations):
         fig = Figure(figsize=(7, 5), dpi=100)
         fig.suptitle('Correlation between attributes and edge existence')
         fig.text(
@@ -397,21 +448,36 @@ class GraphAnalytics(QWidget):
 
         return FigureCanvasQTAgg(fig)
 
-    def graph_analytics_table(self):
+    def graph_metrics(self):
         graph = self.parent.graph_page.graph_page.graph.graph
         n = graph.number_of_nodes()
-        try:
-            diam = nx.diameter(graph)
-            avg_sp = round(nx.average_shortest_path_length(graph), 3)
-        except:
-            diam = 'N/A'  # graph disconnected
-            avg_sp = 'N/A'
 
-        try:
-            ev_cent = round(sum([e for _, e in nx.eigenvector_centrality(graph).items()]) / n, 3)
-        except:
-            ev_cent = 'Did not converge'
-        graph_metrics = {
+        # Slow metrics come from the metric workers (and are cached per graph version),
+        # PENDING until they are in
+        def request(name, compute):
+            # FAILED_VALUE once the computation failed, it is not retried for this version
+            value = self.graph.request_metric(name, compute)
+            return FAILED_VALUE if value is PENDING and self.graph.metric_error(name) else value
+
+        diam, avg_sp = PENDING, PENDING
+        path_lengths = request("path_lengths", get_path_lengths)
+        if path_lengths is FAILED_VALUE:
+            diam, avg_sp = FAILED_VALUE, FAILED_VALUE
+        elif path_lengths is not PENDING:
+            diam, avg_sp = path_lengths
+        clustering = request("avg_clustering", get_average_clustering)
+        ev_cent = request("avg_eigenvector", get_average_eigenvector_centrality)
+        pagerank = request("avg_pagerank", get_average_pagerank)
+
+        # Reuse the cached (and, on large graphs, sampled) centralities of the social graph tab
+        result = self.graph.request_centrality()
+        missing = FAILED_VALUE if self.graph.metric_error("centrality") else PENDING
+        approx, average = "", lambda metric: missing
+        if result is not PENDING:
+            centrality, error = result
+            approx = "" if error is None else " (approx.)"
+            average = lambda metric: round(sum(centrality[metric].values()) / n, 3)
+        return {
             'Number of Nodes':
                 graph.number_of_nodes(),
             'Number of Edges':
@@ -423,34 +489,41 @@ class GraphAnalytics(QWidget):
             'Average Degree':
                 round(sum([d for _, d in graph.degree()]) / n, 3),
             'Average Clustering':
-                round(nx.average_clustering(graph), 3),
+                clustering,
             'Average Shortest Path':
                 avg_sp,
-            'Average Betweenness Centrality':
-                round(sum([b for _, b in nx.betweenness_centrality(graph).items()]) / n, 3),
-            'Average Closeness Centrality':
-                round(sum([c for _, c in nx.closeness_centrality(graph).items()]) / n, 3),
+            'Average Betweenness Centrality' + approx:
+                average("betweeness"),
+            'Average Closeness Centrality' + approx:
+                average("closeness"),
             'Average Eigenvector Centrality':
                 ev_cent,
             'Average PageRank':
-                round(sum([p for _, p in nx.pagerank(graph).items()]) / n, 3),
+                pagerank,
             'Average Degree Centrality':
-                round(sum([d for _, d in nx.degree_centrality(graph).items()]) / n, 3)
+                round(sum(self.graph.degree_centrality.values()) / n, 3)
         }
-        table = QTableWidget()
+
+    def graph_analytics_table(self):
+        self.table = QTableWidget()
+        self.table.setColumnCount(2)
+        self.table.setHorizontalHeaderLabels(['Metric', 'Value'])
+        self.table.verticalHeader().setVisible(False)
+        self.fill_graph_analytics_table()
+        return self.table
+
+    def fill_graph_analytics_table(self):
+        graph_metrics = self.graph_metrics()
+        table = self.table
         table.setRowCount(len(graph_metrics))
-        table.setColumnCount(2)
-        table.setHorizontalHeaderLabels(['Metric', 'Value'])
-        table.verticalHeader().setVisible(False)
         # table.setVerticalHeaderLabels(graph_metrics.keys())
         for i, (metric, value) in enumerate(graph_metrics.items()):
+            value = PENDING_VALUE if value is PENDING else value
             table.setItem(i, 0, QtWidgets.QTableWidgetItem(metric))
             table.setItem(i, 1, QtWidgets.QTableWidgetItem(str(value)))
         table.resizeColumnsToContents()
         table.resizeRowsToContents()
 
-        return table
-
     def attribute_distribution_cont(self):
         fig = Figure(figsize=(7, 5), dpi=100)
         node_features = self.parent.graph_page.graph_page.features
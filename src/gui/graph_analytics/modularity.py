@@ -1,4 +1,4 @@
-from PyQt6.QtWidgets import QWidget
+from PyQt6.QtWidgets import QWidget, QVBoxLayout, QLabel
 from PyQt6.QtCore import *
 from PyQt6.QtGui import *
 
@@ -21,7 +21,23 @@ from mycolorpy import colorlist as mcp
 
 
 
+def girvan_newman_modularity(graph):
+    # Modularity of every Girvan-Newman split and the best split, runs on the metric workers
+    if graph.number_of_edges() == 0:
+        # Nothing to split, and modularity is undefined without edges
+        raise ValueError("the graph has no edges")
+    communities = list(nx.community.girvan_newman(graph))
+    start = len(communities[0])
+    x_vals = [start + k for k in range(len(communities))]
+    y_vals = [nx.community.modularity(graph, community) for community in communities]
+    return x_vals, y_vals, communities[int(np.argmax(y_vals))]
+
+
 class Modularity(QWidget):
+    """
+    Modularity bar plot; shows a placeholder until `set_result` receives the output of
+    `girvan_newman_modularity`, which is computed in the background.
+    """
 
     def __init__(self, graph):
         super(Modularity, self).__init__()
@@ -29,28 +45,31 @@ class Modularity(QWidget):
         self.max_id, self.max_modularity = -1, -1
         self.subcommunity_n = -1 
         self.graph = graph
-        communities = list(nx.community.girvan_newman(self.graph))
-        self.bar = self.get_bar(communities)
-        if self.max_id != -1:
-            community = communities[self.max_id]
-            self.node_colors = self.create_community_node_colors(self.graph, community)
+        self.node_colors = None
+
+        self.layout = QVBoxLayout(self)
+        self.layout.setContentsMargins(0, 0, 0, 0)
+        self.bar = QLabel("Detecting communities\u2026", alignment=Qt.AlignmentFlag.AlignCenter)
+        self.layout.addWidget(self.bar)
 
+    def set_result(self, result):
+        x_vals, y_vals, community = result
+        self.layout.removeWidget(self.bar)
+        self.bar.deleteLater()
+        self.bar = self.get_bar(x_vals, y_vals)
+        self.layout.addWidget(self.bar)
+        self.node_colors = self.create_community_node_colors(self.graph, community)
 
-    
-    def get_bar(self, communities):
+    def set_error(self, message):
+        self.bar.setText(f"Communities could not be detected: {message}")
+
+    def get_bar(self, x_vals, y_vals):
         fig, ax  = plt.subplots()
 
         fig.suptitle('Modularity for Different No. of Communities')
        
         rescale = lambda y: (y - np.min(y)) / (np.max(y) - np.min(y))
 
-        x_vals, y_vals = [], []
-        start = len(communities[0])
-        for k in range(len(communities)):
-            y_vals.append(nx.community.modularity(self.graph, communities[k]))
-            x_vals.append(start+k)
-        
-        
         self.max_id = np.argmax(y_vals)
         self.max_modularity = round(np.max(y_vals),6)
         bar = ax.bar(x_vals, y_vals, color=cmap1(rescale(y_vals)))
@@ -4,7 +4,6 @@ from PyQt6.QtWidgets import QLabel, QSizePolicy, QPushButton
 from PyQt6.QtCore import Qt
 import os
 
-from .main_window import MainWindow
 from .custom_buttons import MediumGreenButton
 from ..static import (
     GRAPH_DATA,
@@ -269,7 +268,9 @@ class LandingPage(QtWidgets.QWidget):
             PageState.clear()
             self.main_window.close()
 
-        # Create new window and hide this one
+        # Create new window and hide this one. The dashboard (and with it networkx, matplotlib
+        # and netgraph) is only imported here, so the landing page shows up right away
+        from .main_window import MainWindow
         PageState.select_id(category, page_id)
         PageState.select_version(page_version)
         self.main_window = MainWindow()
@@ -3,7 +3,6 @@ from PyQt6 import QtWidgets
 from PyQt6.QtWidgets import QMainWindow, QTabWidget, QWidget
 from PyQt6.QtGui import QGuiApplication
 
-from src.gui.graph_analytics.graph_analytics import GraphAnalytics
 from .social_graph import GraphPage
 from .faq import FAQPage
 from .welcome_window import WelcomeScreen
@@ -61,6 +60,11 @@ class MainWindow(QMainWindow):
 
     def updateGraphTab(self):
         self.tabs.removeTab(1)
+        if self.graph_analytics is not None:
+            # Stops the old page from receiving background metric results
+            self.graph_analytics.deleteLater()
+        # pandas and scipy.stats are only needed once the analytics tab is opened
+        from src.gui.graph_analytics.graph_analytics import GraphAnalytics
         self.graph_analytics = GraphAnalytics(self)
         self.tabs.insertTab(1, self.graph_analytics, "Graph Analytics")  # <--- add tab
 
@@ -2,6 +2,7 @@ import networkx as nx
 import matplotlib
 from matplotlib import pyplot as plt
 import math
+from contextlib import contextmanager
 from copy import deepcopy
 
 matplotlib.use("Qt5Agg")
@@ -14,6 +15,7 @@ from src.graph import Graph
 
 # SHADES = plt.get_cmap("Pastel1")
 from ..colors import cmap1
+from .side_bar import PENDING_VALUE, FAILED_VALUE
 
 
 class GraphCanvas(FigureCanvasQTAgg):
@@ -31,18 +33,38 @@ class GraphCanvas(FigureCanvasQTAgg):
         self.setParent(parent)
         self.ax = self.figure.add_subplot(111)
 
+        self._shown_nodes = {}  # info page -> node it currently shows
+        self._refresh_pending = False
         self.graph = Graph.from_page_info()
         self.mpl_connect('button_release_event', self.onclick)
         self.mpl_connect('motion_notify_event', self.on_hover)
         self.refresh()
 
+    @property
+    def graph(self):
+        return self._graph
+
+    @graph.setter
+    def graph(self, value):
+        if hasattr(self, "_graph"):
+            self._graph.metric_ready.disconnect(self._on_metric_ready)
+            self._graph.metric_failed.disconnect(self._on_metric_failed)
+        self._graph = value
+        # Centralities are computed in the background and filled in once they arrive
+        self._graph.metric_ready.connect(self._on_metric_ready)
+        self._graph.metric_failed.connect(self._on_metric_failed)
+
     @property
     def features(self):
         return self.graph.features
 
     @property
     def metrics(self):
-        return self.graph.metrics
+        return self.graph.available_metrics()[0]
+
+    @property
+    def metric_errors(self):
+        return self.graph.available_metrics()[1]
 
     @property
     def node_colors(self):
@@ -51,10 +73,9 @@ class GraphCanvas(FigureCanvasQTAgg):
                                                vmax=self.graph.max_degree,
                                                clip=True)
             mapper = matplotlib.cm.ScalarMappable(norm=norm, cmap=cmap1)
-            colors = {}
-            for node, degree in self.graph.degrees.items():
-                colors[node] = mapper.to_rgba(degree)
-            return colors
+            degrees = self.graph.degrees
+            rgba = mapper.to_rgba(list(degrees.values()))
+            return dict(zip(degrees.keys(), map(tuple, rgba)))
         else:
             return self._node_colors
 
@@ -65,8 +86,8 @@ class GraphCanvas(FigureCanvasQTAgg):
     @property
     def node_sizes(self):
         sizes = {}
-        predicted = self.graph.predicted_new_node_names
-        unpredicted = self.graph.unpredicted_new_node_names
+        predicted = set(self.graph.predicted_new_node_names)
+        unpredicted = set(self.graph.unpredicted_new_node_names)
         for node_name, _ in self.graph.nodes:
             if node_name in predicted:
                 sizes[node_name] = 5
@@ -79,8 +100,8 @@ class GraphCanvas(FigureCanvasQTAgg):
     @property
     def node_shapes(self):
         shapes = {}
-        predicted = self.graph.predicted_new_node_names
-        unpredicted = self.graph.unpredicted_new_node_names
+        predicted = set(self.graph.predicted_new_node_names)
+        unpredicted = set(self.graph.unpredicted_new_node_names)
         for node_name, _ in self.graph.nodes:
             if node_name in predicted:
                 shapes[node_name] = "s"
@@ -94,8 +115,7 @@ class GraphCanvas(FigureCanvasQTAgg):
     def edge_colors(self):
         edge_colors = {}
         for directed_edge in self.graph.directed_edges:
-            undirected_edge = set(directed_edge)
-            color = 'blue' if undirected_edge in self.graph.selected_undirected_edges else 'gray'
+            color = 'blue' if self.graph.is_edge_selected(directed_edge) else 'gray'
             edge_colors[directed_edge] = f"tab:{color}"
         return edge_colors
 
@@ -104,7 +124,7 @@ class GraphCanvas(FigureCanvasQTAgg):
         width = {}
         for node_name, node in self.graph.nodes:
             width[node_name] = self.highligh_node_width \
-                               if node_name in self.graph.selected_nodes \
+                               if self.graph.is_node_selected(node_name) \
                                else self.normal_node_width
         return width
 
@@ -112,9 +132,8 @@ class GraphCanvas(FigureCanvasQTAgg):
     def edge_width(self):
         width = {}
         for edge in self.graph.directed_edges:
-            undirected_edge = set(edge)
             width[edge] = self.highligh_edge_width \
-                          if undirected_edge in self.graph.selected_undirected_edges \
+                          if self.graph.is_edge_selected(edge) \
                           else self.normal_edge_width
         return width
 
@@ -137,10 +156,25 @@ class GraphCanvas(FigureCanvasQTAgg):
                                               ax=self.ax)
         self.graph.node_layout = deepcopy(self.plot_instance.node_positions)
 
+    @contextmanager
+    def batch(self):
+        """Several graph edits with a single page refresh at the end, see Graph.batch"""
+        with self.graph.batch():
+            yield self
+        if self._refresh_pending and not self.graph.in_batch:
+            self._refresh_pending = False
+            self.parent.graph_page.refresh()
+
+    def _refresh_page(self):
+        if self.graph.in_batch:
+            self._refresh_pending = True
+        else:
+            self.parent.graph_page.refresh()
+
     def add_nodes(self, new_nodes, refresh=True):
         self.graph.add_nodes(new_nodes)
         if refresh:
-            self.parent.graph_page.refresh()
+            self._refresh_page()
 
     def add_node(self, new_node, refresh=True):
         self.add_nodes([new_node], refresh)
@@ -148,17 +182,15 @@ class GraphCanvas(FigureCanvasQTAgg):
     def add_edges(self, new_edges, refresh=True):
         self.graph.add_edges(new_edges)
         if refresh:
-            self.parent.graph_page.refresh()
+            self._refresh_page()
 
     def add_edge(self, new_edge, refresh=True):
         self.add_edges([new_edge], refresh)
-        if refresh:
-            self.parent.graph_page.refresh()
 
     def remove_nodes(self, new_nodes, refresh=True):
         self.graph.remove_nodes(new_nodes)
         if refresh:
-            self.parent.graph_page.refresh()
+            self._refresh_page()
 
     def remove_node(self, new_node, refresh=True):
         self.remove_nodes([new_node], refresh)
@@ -166,12 +198,10 @@ class GraphCanvas(FigureCanvasQTAgg):
     def remove_edges(self, new_edges, refresh=True):
         self.graph.remove_edges(new_edges)
         if refresh:
-            self.parent.graph_page.refresh()
+            self._refresh_page()
 
     def remove_edge(self, new_edge, refresh=True):
         self.remove_edges([new_edge], refresh)
-        if refresh:
-            self.parent.graph_page.refresh()
 
     def onclick(self, event):
         if event.xdata is not None:
@@ -180,7 +210,7 @@ class GraphCanvas(FigureCanvasQTAgg):
             if is_hovering and not was_dragged:
                 # Click
                 self.parent.graph_page.right_page.show()
-                self.parent.graph_page.right_page.update(node_name, self.features, self.metrics)
+                self._show_node(self.parent.graph_page.right_page, node_name)
                 self.parent.graph_page.graph_page.graph.toggle_status_of_node(node_name)
                 self.parent.graph_page.refresh()
             elif is_hovering and was_dragged:
@@ -201,10 +231,28 @@ class GraphCanvas(FigureCanvasQTAgg):
             is_hovering = False
 
         if is_hovering:
-            self.parent.graph_page.left_page.update(node_name, self.features, self.metrics)
+            self._show_node(self.parent.graph_page.left_page, node_name)
         else:
+            self._shown_nodes.pop(self.parent.graph_page.left_page, None)
             self.parent.graph_page.left_page.update("")
 
+    def _show_node(self, page, node_name):
+        metrics, errors = self.graph.available_metrics()
+        missing = FAILED_VALUE if self.graph.metric_error("centrality") is not None else PENDING_VALUE
+        page.update(node_name, self.features, metrics, errors, missing=missing)
+        self._shown_nodes[page] = node_name
+
+    def _on_metric_failed(self, name, message):
+        # The centralities still missing are shown as unavailable instead of pending
+        self._on_metric_ready(name)
+
+    def _on_metric_ready(self, name):
+        if name != "centrality":
+            return
+        for page, node_name in list(self._shown_nodes.items()):
+            if node_name in self.graph.graph:
+                self._show_node(page, node_name)
+
     def get_closest_node(self, x, y):
         # Loop over all nodes, select the one closest to click
         closest_node = None
@@ -3,6 +3,12 @@ from PyQt6.QtCore import *
 from PyQt6.QtGui import *
 
 from src.utils.common import swap_dict_keys
+from src.utils.centrality import CENTRALITY_METRICS
+
+# Shown for metrics that are still being computed
+PENDING_VALUE = "\u2026"
+# Shown for metrics whose computation failed
+FAILED_VALUE = "n/a"
 
 
 class NodeInfoPage(QWidget):
@@ -13,7 +19,7 @@ class NodeInfoPage(QWidget):
         self.WIDTH = 210
         self.CELL_HEIGHT = 30
         self.FEATURES = None
-        self.METRICS = None  # None == select all
+        self.METRICS = CENTRALITY_METRICS
 
         self.features = features
         self.metrics = swap_dict_keys(metrics)
@@ -73,22 +79,33 @@ class NodeInfoPage(QWidget):
 
         return table
 
-    def update(self, node_name, features=None, metrics=None):
+    def update(self, node_name, features=None, metrics=None, errors=None, missing=PENDING_VALUE):
 
         if node_name:
             self.must_be_visible = True
             self.features = features
             self.metrics = swap_dict_keys(metrics)
+            self._update_metric_title(errors)
             self._update_table(self.feature_table, self.features[node_name], node_name=node_name)
-            self._update_table(self.metric_table, self.metrics[node_name])
-
-    def _update_table(self, table, data, node_name=None):
+            self._update_table(self.metric_table, self.metrics[node_name], missing=missing)
+
+    def _update_metric_title(self, errors):
+        # Sampled centralities on large graphs are labelled as such, with their error bound
+        if errors is None:
+            self.metric_title_label.setText("Centrality Metrics")
+            self.metric_title_label.setToolTip("")
+        else:
+            self.metric_title_label.setText("Centrality Metrics (approx.)")
+            self.metric_title_label.setToolTip("\n".join(
+                f"{metric}: \u00b1{error:.3f}" for metric, error in errors.items()))
+
+    def _update_table(self, table, data, node_name=None, missing=""):
         for row in range(table.rowCount()):
             key_item = table.item(row, 0)
             if node_name and key_item.text().lower() == "name":
                 value = node_name
             else:
-                value = data.get(key_item.text(), "")
+                value = data.get(key_item.text(), missing)
             value = f"{value:.2f}" if isinstance(value, float) else value
             item = QTableWidgetItem(str(value))
             table.setItem(row, 1, item)
\ No newline at end of file
@@ -0,0 +1,334 @@
+import os
+import json
+import shutil
+import logging
+
+import numpy as np
+import networkx as nx
+import scipy.sparse as sp
+
+from src.loaders.feature_schema import FeatureSchema
+from src.utils.graph_diff import GraphDiff
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger('array_store')
+
+ARRAY_STORE_FOLDER = "./results/cache/arrays/"
+# Bump when the stored arrays change, e.g. when preprocess encodes features differently
+STORE_FORMAT = 2
+
+_FILES = ["names", "indptr", "indices", "data", "features"]
+_NO_CHANGES = GraphDiff([], [], [], [], {}, {})
+
+
+class GraphArrays:
+    """
+    Model inputs of a saved graph version: node names, CSR adjacency (as nx.adjacency_matrix
+    builds it) and the feature matrix encoded with `schema`, `fitted` when the schema was
+    fitted on these nodes. The arrays are memory-mapped copy-on-write, so processes opening
+    the same version share their pages.
+    """
+
+    def __init__(self, names, adj, features, schema, directed, fitted=False):
+        self.names = names
+        self.adj = adj
+        self.features = features
+        self.schema = schema
+        self.directed = directed
+        self.fitted = fitted
+
+    @classmethod
+    def open(cls, folder):
+        with open(os.path.join(folder, "meta.json")) as f:
+            meta = json.load(f)
+        arrays = {name: np.load(os.path.join(folder, name + ".npy"), mmap_mode="c") for name in _FILES}
+        n = len(arrays["names"])
+        adj = sp.csr_array((arrays["data"], arrays["indices"], arrays["indptr"]), shape=(n, n), copy=False)
+        return cls(arrays["names"], adj, arrays["features"], FeatureSchema(meta["schema"]), meta["directed"],
+                   meta["fitted"]), meta
+
+    @property
+    def n_nodes(self):
+        return len(self.names)
+
+    @property
+    def node_dict(self):
+        return {name: i for i, name in enumerate(self.names.tolist())}
+
+    def write(self, folder, source):
+        """Write the arrays to `folder`, replacing what is there; False if they cannot be stored"""
+        names = np.asarray(self.names)
+        if names.dtype.kind != "U":
+            return False  # Only string node names are stored without pickling
+        tmp_folder = f"{folder.rstrip(os.sep)}.{os.getpid()}.tmp"
+        shutil.rmtree(tmp_folder, ignore_errors=True)
+        os.makedirs(tmp_folder)
+        arrays = {"names": names, "indptr": self.adj.indptr, "indices": self.adj.indices,
+                  "data": self.adj.data, "features": np.ascontiguousarray(self.features)}
+        for name, array in arrays.items():
+            np.save(os.path.join(tmp_folder, name + ".npy"), array)
+        with open(os.path.join(tmp_folder, "meta.json"), "w") as f:
+            json.dump({"format": STORE_FORMAT, "source": list(source), "directed": self.directed,
+                       "schema": self.schema.columns, "fitted": self.fitted}, f)
+        shutil.rmtree(folder, ignore_errors=True)
+        os.replace(tmp_folder, folder)
+        return True
+
+    # =====================================================
+    # Edits
+    # =====================================================
+
+    def extended(self, graph, changes, schema=None):
+        """
+        Arrays of `graph`, which is this version plus `changes` (GraphDiff): added nodes get
+        rows and columns at the end (their networkx order), edge changes are applied to the
+        adjacency. Without `schema` the features are those of the schema fitted on `graph`,
+        which is the fitted one of this version as long as the added nodes bring no new
+        attribute or category. None if that is not possible, e.g. when nodes were removed.
+        """
+        if changes.removed_nodes or changes.weight_changes or changes.attribute_changes:
+            return None
+        names = list(graph)
+        n0 = self.n_nodes
+        if len(names) != n0 + len(changes.added_nodes) or names[:n0] != self.names.tolist():
+            return None
+        fitted = schema is None
+        if fitted:
+            if not self.fitted or not self.schema.covers(graph.nodes[name] for name in names[n0:]):
+                return None  # fitting on the new nodes too gives another schema
+            schema = self.schema
+
+        if schema == self.schema:
+            features = self.features
+            if changes.added_nodes:
+                added = schema.transform([graph.nodes[name] for name in names[n0:]])
+                features = np.concatenate([features, added])
+        else:
+            # Stored for another schema: only the features are encoded again
+            features = schema.transform([data for _, data in graph.nodes(data=True)])
+
+        node_dict = dict(zip(names, range(len(names))))
+        adj = _resized(self.adj, len(names))
+        weights = [graph[u][v].get("weight", 1) for u, v in changes.added_edges]
+        adj = _add_edges(adj, node_dict, changes.added_edges, weights, self.directed)
+        if changes.removed_edges:
+            removed = [(node_dict[u], node_dict[v]) for u, v in changes.removed_edges]
+            old = [-self.adj[i, j] for i, j in removed]
+            adj = _add_edges(adj, None, removed, old, self.directed)
+        return GraphArrays(np.array(names), adj, features, schema, self.directed, fitted)
+
+    def reverted(self, changes):
+        """
+        Arrays before `changes` (GraphDiff) were made, None when that cannot be told from the
+        arrays (removed nodes or edges, whose data is gone)
+        """
+        if changes.removed_nodes or changes.removed_edges or changes.weight_changes or changes.attribute_changes:
+            return None
+        n0 = self.n_nodes - len(changes.added_nodes)
+        names = self.names[:n0]
+        if set(self.names[n0:].tolist()) != set(changes.added_nodes):
+            return None
+        node_dict = dict(zip(self.names.tolist(), range(self.n_nodes)))
+        edges = [(node_dict[u], node_dict[v]) for u, v in changes.added_edges]
+        kept = [(i, j) for i, j in edges if i < n0 and j < n0]
+        adj = _add_edges(self.adj, None, kept, [-self.adj[i, j] for i, j in kept], self.directed)
+        adj = sp.csr_array(adj[:n0, :n0])
+        return GraphArrays(names, adj, self.features[:n0], self.schema, self.directed, self.fitted)
+
+
+def file_token(path):
+    """Identity of the file a version was read from, as Graph.source"""
+    stat = os.stat(path)
+    return os.path.abspath(path), stat.st_mtime_ns, stat.st_size
+
+
+def _resized(adj, n):
+    adj = sp.csr_array(adj, copy=False)
+    indptr = np.concatenate([adj.indptr, np.full(n - adj.shape[0], adj.indptr[-1], dtype=adj.indptr.dtype)])
+    return sp.csr_array((adj.data, adj.indices, indptr), shape=(n, n), copy=False)
+
+
+def _add_edges(adj, node_dict, edges, weights, directed):
+    # adj plus `weights` on the (u, v) entries, and (v, u) ones for undirected graphs
+    if not edges:
+        return adj
+    if node_dict is not None:
+        edges = [(node_dict[u], node_dict[v]) for u, v in edges]
+    rows, cols = np.array(edges, dtype=np.int64).reshape(-1, 2).T
+    weights = np.asarray(weights)
+    weights = weights.astype(np.result_type(adj.dtype, weights.dtype))
+    if not directed:
+        back = rows != cols
+        rows, cols, weights = (np.concatenate([rows, cols[back]]), np.concatenate([cols, rows[back]]),
+                               np.concatenate([weights, weights[back]]))
+    delta = sp.csr_array((weights, (rows, cols)), shape=adj.shape)
+    result = sp.csr_array(adj + delta)
+    result.eliminate_zeros()
+    result.sort_indices()
+    return result
+
+
+def build_arrays(graph: nx.Graph, schema: FeatureSchema = None) -> GraphArrays:
+    """Arrays of a networkx graph, encoded like ASNRGraph.preprocess does"""
+    names = list(graph.nodes)
+    records = [data for _, data in graph.nodes(data=True)]
+    fitted = schema is None
+    if fitted:
+        schema, features = FeatureSchema.fit_transform(records)
+    else:
+        features = schema.transform(records)
+    adj = nx.adjacency_matrix(graph)
+    adj.sort_indices()
+    return GraphArrays(np.array(names) if names else np.array([], dtype=str), adj, features, schema,
+                       graph.is_directed(), fitted)
+
+
+class ArrayStore:
+    """
+    GraphArrays of saved graph versions on disk, one folder per (animal, version) under
+    results/cache/arrays/, valid as long as the file they were built from is unchanged.
+
+    Entries are written from whatever graph was at hand the first time a version was used:
+    the loaded version itself, or the edited graph with its edits reverted. Later opens map the
+    arrays instead of encoding the graph again, and edits (e.g. the nodes to predict edges for)
+    are applied on top.
+    """
+
+    def __init__(self, folder=ARRAY_STORE_FOLDER):
+        self.folder = folder
+        self.hits = 0
+        self.misses = 0
+
+    def entry_folder(self, animal, version):
+        return os.path.join(self.folder, str(animal), str(version))
+
+    def open(self, animal, version, source):
+        """Stored arrays of the version read from `source` (path, mtime, size), or None"""
+        folder = self.entry_folder(animal, version)
+        try:
+            arrays, meta = GraphArrays.open(folder)
+        except (OSError, ValueError, KeyError):
+            return None
+        if meta.get("format") != STORE_FORMAT or meta.get("source") != list(source):
+            return None
+        return arrays
+
+    def load(self, graph, animal, version, source, changes=None, schema=None) -> GraphArrays:
+        """
+        Arrays of `graph`: the version read from `source` plus `changes` (GraphDiff of its
+        edits since, None for no edits). Features are encoded with `schema`, or with the schema
+        fitted on `graph` when None.
+        """
+        edited = changes is not None and not changes.is_empty
+        stored = self.open(animal, version, source) if source is not None else None
+        arrays = None
+        if stored is not None and (schema is not None or stored.fitted):
+            if edited or (schema is not None and schema != stored.schema):
+                arrays = stored.extended(graph, changes if edited else _NO_CHANGES, schema)
+            else:
+                arrays = stored
+        if arrays is not None:
+            self.hits += 1
+        else:
+            self.misses += 1
+            arrays = build_arrays(graph, schema)
+        if source is not None and (stored is None or stored.schema != arrays.schema or
+                                   stored.fitted != arrays.fitted):
+            # Kept for the next time, with the features encoded like this time
+            base = self._base(arrays, graph, changes) if edited else arrays
+            if base is not None and (stored is None or stored.schema != base.schema or
+                                     stored.fitted != base.fitted):
+                self._write(base, animal, version, source)
+        return arrays
+
+    @staticmethod
+    def _base(arrays, graph, changes):
+        # Arrays of the version itself: a schema fitted on the edited graph is fitted again on
+        # the nodes of the version, whose entry must not depend on the edits
+        base = arrays.reverted(changes)
+        if base is not None and base.fitted:
+            base.schema, base.features = FeatureSchema.fit_transform(
+                [graph.nodes[name] for name in base.names.tolist()])
+        return base
+
+    def _write(self, arrays, animal, version, source):
+        try:
+            if arrays.write(self.entry_folder(animal, version), source):
+                logger.info(f"Stored the arrays of {animal} {version}")
+        except OSError as e:
+            logger.warning(f"Could not store the arrays of {animal} {version}: {e}")
+
+
+array_store = ArrayStore()
+
+
+if __name__ == "__main__":
+    # Usage: python -m src.loaders.array_store [n_nodes] [n_edges]
+    # Encodes a graph from networkx as preprocess did, then opens it from the store with a few
+    # predicted-for nodes added, and checks both give the same model inputs, with the model's
+    # schema and with the one fitted on the graph (models saved without a schema). Then stores
+    # a version first used with a new category added and checks the entry is fitted on the
+    # version only.
+    import sys
+    import tempfile
+    import time
+
+    n_nodes = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    n_edges = int(sys.argv[2]) if len(sys.argv) > 2 else 200000
+    rng = np.random.RandomState(42)
+    graph = nx.gnm_random_graph(n_nodes, n_edges, seed=42)
+    graph = nx.relabel_nodes(graph, {i: f"animal{i}" for i in graph})
+    for node in graph:
+        graph.nodes[node].update(sex=str(rng.choice(["f", "m"])), group=f"g{rng.randint(30)}",
+                                 age=float(rng.randint(1, 20)))
+    for u, v in graph.edges:
+        graph[u][v]["weight"] = float(rng.rand())
+    path = os.path.join(tempfile.mkdtemp(), "colony.graphml")
+    with open(path, "w") as f:
+        f.write("stand-in for the version file")
+    source = file_token(path)
+    store = ArrayStore(tempfile.mkdtemp())
+
+    start = time.perf_counter()
+    arrays = store.load(graph, "colony", "v0", source)
+    t_first = time.perf_counter() - start
+    schema = arrays.schema
+
+    # The user adds animals and an edge, and removes one, before predicting
+    added_nodes = [f"new{i}" for i in range(3)]
+    graph.add_nodes_from((name, {"sex": "f", "group": "g1", "age": 1.}) for name in added_nodes)
+    graph.add_edge("new0", "animal1", weight=1.)
+    graph.add_edge("animal2", "animal3")
+    removed = next(iter(graph.edges("animal4")))
+    graph.remove_edge(*removed)
+    changes = GraphDiff(added_nodes, [], [("new0", "animal1"), ("animal2", "animal3")], [removed], {}, {})
+
+    start = time.perf_counter()
+    expected = build_arrays(graph, schema)
+    t_build = time.perf_counter() - start
+    start = time.perf_counter()
+    arrays = store.load(graph, "colony", "v0", source, changes, schema)
+    t_store = time.perf_counter() - start
+    fitted = store.load(graph, "colony", "v0", source, changes)
+
+    assert store.hits == 2
+    for arrays in [arrays, fitted]:
+        assert arrays.names.tolist() == expected.names.tolist()
+        assert arrays.schema == expected.schema and np.array_equal(arrays.features, expected.features)
+        assert (arrays.adj != expected.adj).nnz == 0 and arrays.adj.dtype == expected.adj.dtype
+
+    # Reverting needs the removed edge back
+    graph.add_edge(*removed)
+    graph.add_node("new3", sex="f", group="unseen", age=1.)
+    changes = GraphDiff(added_nodes + ["new3"], [], changes.added_edges, [], {}, {})
+    store = ArrayStore(tempfile.mkdtemp())
+    store.load(graph, "colony", "v0", source, changes)
+    graph.remove_nodes_from(changes.added_nodes)
+    graph.remove_edge("animal2", "animal3")
+    stored = store.open("colony", "v0", source)
+    assert stored.schema == schema and np.array_equal(stored.features, build_arrays(graph).features)
+
+    print(f"{n_nodes} nodes / {n_edges} edges")
+    print(f"first use (encode + store)  {t_first * 1e3:7.1f}ms")
+    print(f"encode from networkx        {t_build * 1e3:7.1f}ms")
+    print(f"open from the store + edits {t_store * 1e3:7.1f}ms")
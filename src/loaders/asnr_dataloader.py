@@ -1,13 +1,24 @@
+import logging
 from collections import defaultdict
+from functools import cached_property
 
 import networkx as nx
-import torch
 import numpy as np
-from sklearn import preprocessing
 
 from matplotlib import cm, colors
 import matplotlib.pyplot as plt
 
+from src.utils.centrality import compute_centrality
+from src.loaders.parse_cache import parse_cache
+from src.loaders.graphml_stream import stream_graphml, UnsupportedGraphML
+from src.loaders.feature_schema import FeatureSchema
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger('asnr_dataloader')
+
+# Ceiling in bytes for the columns of a GraphML file being streamed in, None for no limit
+MAX_PARSE_MEMORY = None
+
 shades = plt.get_cmap("Pastel1")
 random_state = np.random.RandomState(42)
 
@@ -21,36 +32,57 @@ def name_2_id(g):
     return node_dict
 
 
+def clean_node_data(data):
+    # False for nodes to remove; otherwise drops their id-like attribute in place
+    if len(data.keys()) in  [0,1]:
+        return False # Remove nodes with no keys or 1 key
+    vals = data.values()
+    if any(isinstance(val, str) and len(val.strip()) == 0 for val in vals):
+        return False # Remove nodes with empty strings 
+    elif any(isinstance(val, str) and val == "-" for val in vals):
+        return False # some strings have useless spl char, "-"
+    elif "tag_id" in data.keys():
+        data.pop("tag_id",None)
+    elif "node" in data.keys():
+        data.pop("node",None)
+        # g = g.remove_attribute(tnode=node, attr='tag_id')
+    return True
+
+
 def clean_nodes(g):
-    remove_arr = []
-    for node, data in g.nodes(data=True):   
-        if len(data.keys()) in  [0,1]:
-            remove_arr.append(node) # Remove nodes with no keys or 1 key
-        else:
-            vals = data.values()
-            if any(isinstance(val, str) and len(val.strip()) == 0 for val in vals):
-                remove_arr.append(node) # Remove nodes with empty strings 
-            elif any(isinstance(val, str) and val == "-" for val in vals):
-                remove_arr.append(node) # some strings have useless spl char, "-"
-            elif "tag_id" in data.keys():
-                g.nodes[node].pop("tag_id",None)
-            elif "node" in data.keys():
-                g.nodes[node].pop("node",None)
-                # g = g.remove_attribute(tnode=node, attr='tag_id')
-            
+    remove_arr = [node for node, data in g.nodes(data=True) if not clean_node_data(data)]
     [g.remove_node(node) for node in remove_arr]
     return g
 
 
+def stream_asnr_graph(path, max_memory=None, progress=None):
+    # Parse cache arrays of the cleaned graph, streamed from the XML; None if only networkx reads it
+    if max_memory is None:
+        max_memory = MAX_PARSE_MEMORY
+    try:
+        return stream_graphml(path, node_filter=clean_node_data, max_memory=max_memory, progress=progress)
+    except UnsupportedGraphML as e:
+        logger.info(f"Reading {path} with networkx: {e}")
+        return None
+
+
+def read_asnr_graph(path, max_memory=None, progress=None):
+    # Cleaned graph of an ASNR GraphML file; the XML is only parsed once per file content
+    return parse_cache.load(path, lambda: clean_nodes(nx.read_graphml(path)),
+                            lambda: stream_asnr_graph(path, max_memory, progress))
+
+
 class ASNRGraph:
     def __init__(self, path=None, graph_obj=None) -> None:
         if graph_obj is None:
-            self.graph = clean_nodes(nx.read_graphml(path))
+            self.graph = read_asnr_graph(path)
         else:
             self.graph = graph_obj
-        self.colors, self.centrality = self._init_colors()
+        # colors and centrality are computed on first access only; loading, prediction
+        # and training never use them
 
-    def _init_colors(self):
+    @cached_property
+    def colors(self):
         g = self.graph
         edge_color, node_color = dict(), dict()
 
@@ -64,66 +96,39 @@ class ASNRGraph:
 
         for node, degree in g.degree():
             node_color[node] = mapper.to_rgba(degree)
-        color_dict = {"node": node_color, "edge": edge_color}
-        centrality_dict = {
-            "betweeness": nx.betweenness_centrality(g),
-            "closeness": nx.closeness_centrality(g),
-            # "eigenvector": nx.eigenvector_centrality(g), # NOTE: Some graphs in the dataset don't converge and cause an error
-            "degree": nx.degree_centrality(g),
-        }
-        return color_dict, centrality_dict
-
-    def preprocess(self):
-        node_dict = name_2_id(self.graph)
-
-        # 3. Encode the string names  by label encoders
-        keys2val_str = defaultdict(lambda: {"list": []})
-        for node, data in self.graph.nodes(data=True):
-            for key, val in data.items():
-                keys2val_str[key]["list"].append(val)
-
-        # 3.1 Declare Label Encoder objects
-        for key, value in keys2val_str.items():
-            le = preprocessing.LabelEncoder()
-            list_of_vals = list(set(value["list"]))
-            le.fit(list_of_vals)
-            keys2val_str[key]["le"] = le
-
-        # print(keys2val_str)
-        ## 4. Collating node features ###
-        nodes_size = len(node_dict)
-
-        for node, data in self.graph.nodes(data=True):
-            feat_size = len([value for _, value in data.items()])
-            break
-
-        feat = torch.zeros(nodes_size, feat_size)
-
-        i = 0
-        for node, data in self.graph.nodes(data=True):
-            f = []
-            for key, val in data.items():
-                if isinstance(val, str):
-                    le = keys2val_str[key]["le"]
-                    f.append(le.transform([data[key]])[0])
-                else:
-                    f.append(val)
-            f = torch.Tensor(f)
-            feat[i] = f
-            i += 1
-
-        ## 5. Collating edge features ###
-        edgelist = torch.zeros(self.graph.number_of_edges(), 2)
-
-        i = 0
-        for u, v, data in self.graph.edges(data=True):
-            edgelist[i] = torch.Tensor([node_dict[u], node_dict[v]])
-            i += 1
-        adj = nx.adjacency_matrix(self.graph)
-
-        features = {}
-        for node, data in self.graph.nodes(data=True):
-            features[node] = data
+        return {"node": node_color, "edge": edge_color}
+
+    @cached_property
+    def centrality(self):
+        centrality_dict, _ = compute_centrality(self.graph)
+        return centrality_dict
+
+    def preprocess(self, schema: FeatureSchema = None, arrays=None):
+        """
+        Feature matrix, edge index, adjacency, node ids and node data of the graph.
+
+        Node attributes are encoded column-wise with `schema`, or with a schema fitted on this
+        graph (kept as self.schema, to be saved with a model trained on these features).
+        `arrays` (GraphArrays of this graph, e.g. from the array store) skips the encoding.
+        """
+        # Only training and prediction get here; loading a graph does not import torch
+        import torch
+        import scipy.sparse as sp
+        from src.loaders.array_store import build_arrays
+
+        if arrays is None:
+            arrays = build_arrays(self.graph, schema)
+        self.schema = arrays.schema
+        names = arrays.names.tolist()
+        node_dict = {name: i for i, name in enumerate(names)}
+        feat = torch.from_numpy(np.ascontiguousarray(arrays.features))
+
+        ## Edges, straight from the CSR arrays of the adjacency ###
+        adj = arrays.adj
+        entries = adj.tocoo() if arrays.directed else sp.triu(adj, format="coo")
+        edgelist = torch.from_numpy(np.stack([entries.row, entries.col], axis=1).astype(np.float32))
+
+        features = dict(self.graph.nodes(data=True))
         return feat, edgelist, adj, node_dict, features
 
     def graph(self):
@@ -0,0 +1,283 @@
+import os
+import glob
+import logging
+import pickle
+from collections import defaultdict
+from collections.abc import Mapping
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger('dataset_catalog')
+
+MANIFEST_VERSION = 1
+
+
+def parse_readme(path):
+    metadata = defaultdict(lambda: "n/a")
+    with open(path, "r") as file:
+        # Skip first 2 lines
+        for _ in range(2):
+            next(file)
+        for line in file:
+            data = line.split("|")
+            if len(data) == 2:
+                k, v = data
+                metadata[k.strip()] = v.strip()
+    return metadata
+
+
+def _mtime(path):
+    try:
+        return os.stat(path).st_mtime_ns
+    except OSError:
+        return None
+
+
+class DatasetCatalog:
+    """
+    Networks listed in the datasets file, with their README metadata and saved versions.
+
+    Nothing is scanned up front: the listing comes from a manifest cache while the datasets
+    file keeps its mtime, README metadata is parsed on first access per animal (and kept in
+    the manifest, keyed by the README mtime), and version folders are listed on first access.
+    """
+
+    def __init__(self, datasets_file, version_folder, manifest_path):
+        self.datasets_file = datasets_file
+        self.version_folder = version_folder
+        self.manifest_path = manifest_path
+        self._manifest = None
+        self._animals = None
+        self._versions = {}
+        self.graph_data = _GraphData(self)
+        self.versions = _Versions(self)
+
+    # =====================================================
+    # Manifest
+    # =====================================================
+
+    @property
+    def manifest(self):
+        if self._manifest is None:
+            self._manifest = self._load_manifest()
+        return self._manifest
+
+    def _load_manifest(self):
+        list_mtime = _mtime(self.datasets_file)
+        try:
+            with open(self.manifest_path, "rb") as f:
+                manifest = pickle.load(f)
+            if manifest["version"] == MANIFEST_VERSION and manifest["list_mtime"] == list_mtime:
+                return manifest
+            logger.info("Datasets changed, rebuilding the catalog manifest")
+        except (OSError, EOFError, KeyError, pickle.UnpicklingError):
+            logger.info("No catalog manifest yet, building it")
+
+        with open(self.datasets_file) as f:
+            paths = [x.strip() for x in f.readlines() if x.strip()]
+        entries = {}
+        for path in paths:
+            category, name, _ = path.split("/")[3:]
+            entries.setdefault(category, {})[name] = path
+        manifest = {"version": MANIFEST_VERSION, "list_mtime": list_mtime, "entries": entries, "metadata": {}}
+        self._save_manifest(manifest)
+        return manifest
+
+    def _save_manifest(self, manifest):
+        try:
+            os.makedirs(os.path.dirname(self.manifest_path), exist_ok=True)
+            tmp_path = self.manifest_path + ".tmp"
+            with open(tmp_path, "wb") as f:
+                pickle.dump(manifest, f)
+            os.replace(tmp_path, self.manifest_path)
+        except OSError as e:
+            logger.warning(f"Could not write the catalog manifest: {e}")
+
+    # =====================================================
+    # Lookups
+    # =====================================================
+
+    @property
+    def categories(self):
+        return self.manifest["entries"]
+
+    @property
+    def animals(self):
+        if self._animals is None:
+            self._animals = {name: category for category, names in self.categories.items() for name in names}
+        return self._animals
+
+    def path(self, category, name):
+        return self.categories[category][name]
+
+    def metadata(self, category, name):
+        """README metadata of the animal, parsed once and then served from the manifest"""
+        cached = self.manifest["metadata"].get(name)
+        if cached is not None:
+            readme, readme_mtime, metadata = cached
+            if _mtime(readme) == readme_mtime:
+                return _as_metadata(metadata)
+
+        folder = os.path.join(*self.path(category, name).split("/")[:-1])
+        readme = glob.glob(os.path.join(folder, "*.md"))[0]
+        metadata = parse_readme(readme)
+        self.manifest["metadata"][name] = (readme, _mtime(readme), dict(metadata))
+        self._save_manifest(self.manifest)
+        return metadata
+
+    def versions_of(self, animal):
+        """Saved versions of the animal, listed on first access; the list is updated in place"""
+        if animal not in self._versions:
+            versions = ["default"]
+            animal_folder = os.path.join(self.version_folder, animal)
+            if os.path.isdir(animal_folder):
+                filenames = [x for x in os.listdir(animal_folder) if x.endswith(".pkl")]
+                filenames.sort()
+                versions.extend([x[:-4] for x in filenames])  # removing .pkl
+            self._versions[animal] = versions
+        return self._versions[animal]
+
+
+def _as_metadata(metadata):
+    result = defaultdict(lambda: "n/a")
+    result.update(metadata)
+    return result
+
+
+class _GraphData(Mapping):
+    # category -> animal -> {"path", "title", "metadata"}, as the eager GRAPH_DATA table was
+
+    def __init__(self, catalog):
+        self.catalog = catalog
+
+    def __getitem__(self, category):
+        if category not in self.catalog.categories:
+            raise KeyError(category)
+        return _CategoryData(self.catalog, category)
+
+    def __iter__(self):
+        return iter(self.catalog.categories)
+
+    def __len__(self):
+        return len(self.catalog.categories)
+
+
+class _CategoryData(Mapping):
+
+    def __init__(self, catalog, category):
+        self.catalog = catalog
+        self.category = category
+
+    def __getitem__(self, name):
+        path = self.catalog.categories[self.category][name]
+        return _LazyEntry(self.catalog, self.category, name, path)
+
+    def __iter__(self):
+        return iter(self.catalog.categories[self.category])
+
+    def __len__(self):
+        return len(self.catalog.categories[self.category])
+
+
+class _LazyEntry(Mapping):
+    # Metadata is only parsed when it is looked up
+
+    def __init__(self, catalog, category, name, path):
+        self.catalog = catalog
+        self.category = category
+        self.name = name
+        self.path = path
+
+    def __getitem__(self, key):
+        if key == "path":
+            return self.path
+        if key == "title":
+            return "Placeholder " + self.name
+        if key == "metadata":
+            return self.catalog.metadata(self.category, self.name)
+        raise KeyError(key)
+
+    def __iter__(self):
+        return iter(("path", "title", "metadata"))
+
+    def __len__(self):
+        return 3
+
+
+class _Versions(Mapping):
+    # animal -> list of versions, as the eager VERSIONS table was
+
+    def __init__(self, catalog):
+        self.catalog = catalog
+
+    def __getitem__(self, animal):
+        if animal not in self.catalog.animals:
+            raise KeyError(animal)
+        return self.catalog.versions_of(animal)
+
+    def __iter__(self):
+        return iter(self.catalog.animals)
+
+    def __len__(self):
+        return len(self.catalog.animals)
+
+
+if __name__ == "__main__":
+    # Usage: python -m src.loaders.dataset_catalog [n_networks]
+    # Startup cost of the dataset table for a synthetic list of networks: the former eager
+    # scan, a cold catalog (no manifest) and a warm one, each up to what the landing page
+    # reads (categories, animals, versions of the first animal) plus the metadata of one
+    # selected animal.
+    import sys
+    import tempfile
+    import time
+
+    n_networks = int(sys.argv[1]) if len(sys.argv) > 1 else 500
+    root = tempfile.mkdtemp()
+    paths = []
+    for i in range(n_networks):
+        category, name = f"Category{i % 7}", f"animal{i}_association_weighted"
+        folder = os.path.join(root, "asnr", "Networks", category, name)
+        os.makedirs(folder)
+        with open(os.path.join(folder, "README.md"), "w") as f:
+            f.write("| | |\n|---|---|\n")
+            f.writelines(f"{key} | value {i}\n" for key in ["Species", "Taxonomic class", "Population type",
+                                                             "Data collection technique", "Citation"])
+        paths.append(f"./asnr/Networks/{category}/{name}/{name}.graphml")
+    os.chdir(root)
+    with open("final_datasets.txt", "w") as f:
+        f.write("\n".join(paths))
+
+    def landing_page(graph_data, versions):
+        categories = sorted(graph_data.keys())
+        animals = sorted(graph_data[categories[0]].keys())
+        list(versions.keys()), versions[animals[0]]
+        return graph_data[categories[0]][animals[0]]["metadata"]["Species"]
+
+    start = time.perf_counter()
+    eager = defaultdict(dict)
+    for path in paths:
+        category, name, _ = path.split("/")[3:]
+        eager[category][name] = {
+            "path": path,
+            "metadata": parse_readme(glob.glob(os.path.join(*path.split("/")[:-1], "*.md"))[0])
+        }
+    eager_versions = {}
+    for names in eager.values():
+        for name in names:
+            eager_versions[name] = ["default"]
+            if os.path.isdir(os.path.join("versions", name)):
+                eager_versions[name].extend(os.listdir(os.path.join("versions", name)))
+    landing_page(eager, eager_versions)
+    t_eager = time.perf_counter() - start
+
+    timings = []
+    for _ in range(2):
+        start = time.perf_counter()
+        catalog = DatasetCatalog("final_datasets.txt", "versions", "cache/datasets_manifest.pkl")
+        landing_page(catalog.graph_data, catalog.versions)
+        timings.append(time.perf_counter() - start)
+
+    print(f"{n_networks} networks")
+    print(f"Eager scan:   {t_eager * 1e3:.1f}ms")
+    print(f"Cold catalog: {timings[0] * 1e3:.1f}ms")
+    print(f"Warm catalog: {timings[1] * 1e3:.1f}ms")
@@ -0,0 +1,389 @@
+import os
+import json
+import logging
+from array import array
+from functools import lru_cache
+from xml.etree.ElementTree import iterparse
+
+import numpy as np
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger('graphml_stream')
+
+NS_GRAPHML = "{http://graphml.graphdrawing.org/xmlns}"
+PROGRESS_EVERY = 10000  # elements between progress callbacks and memory checks
+
+# GraphML attr.type -> python type and array typecode, as networkx reads them
+_TYPES = {
+    "string": (str, None), "yfiles": (str, None),
+    "int": (int, "q"), "integer": (int, "q"), "long": (int, "q"),
+    "float": (float, "d"), "double": (float, "d"),
+    "boolean": (bool, "b"),
+}
+_BOOLS = {"true": True, "false": False, "0": False, "1": True}
+_OBJECT_BYTES = 120  # rough cost of a str object plus its dict entry
+
+
+class UnsupportedGraphML(Exception):
+    """Content the streaming loader does not handle (parallel edges, hyperedges, yfiles, ...)"""
+
+
+class MemoryLimitExceeded(MemoryError):
+    pass
+
+
+# =====================================================
+# Column buffers
+# =====================================================
+
+class _Column:
+    # Values of one attribute: the rows holding it and the values, in compact arrays.
+    # Strings are interned, so repeated categories cost 4 bytes per value.
+
+    def __init__(self, python_type, typecode):
+        self.python_type = python_type
+        self.rows = array("q")
+        self.values = array(typecode or "i")
+        self.strings = {} if typecode is None else None
+        self.string_bytes = 0
+
+    def append(self, row, value):
+        self.rows.append(row)
+        if self.strings is not None:
+            code = self.strings.get(value)
+            if code is None:
+                code = self.strings[value] = len(self.strings)
+                self.string_bytes += len(value) + _OBJECT_BYTES
+            value = code
+        self.values.append(value)
+
+    @property
+    def nbytes(self):
+        return self.rows.itemsize * len(self.rows) + self.values.itemsize * len(self.values) + self.string_bytes
+
+    def finish(self, new_rows, n):
+        """Presence mask over the n final rows and the values in final row order"""
+        rows = new_rows[np.frombuffer(self.rows, dtype=np.int64)] if len(self.rows) else np.empty(0, np.int64)
+        values = np.frombuffer(self.values, dtype=self.values.typecode) if len(self.values) else \
+            np.empty(0, dtype=self.values.typecode)
+        keep = rows >= 0
+        rows, values = rows[keep], values[keep]
+        order = np.argsort(rows, kind="stable")
+        present = np.zeros(n, dtype=bool)
+        present[rows] = True
+        values = values[order]
+        if self.strings is not None:
+            values = np.array(list(self.strings), dtype=str)[values] if len(values) else np.empty(0, dtype=str)
+        elif self.python_type is bool:
+            values = values.astype(bool)
+        return present, values
+
+
+class _Records:
+    # Attribute dicts of nodes or edges, stored column-wise like the parse cache does
+
+    def __init__(self):
+        self.columns = {}
+        self.orders = {(): 0}
+        self.order_ids = array("i")
+
+    def append(self, row, record, types):
+        while len(self.order_ids) <= row:
+            self.order_ids.append(0)
+        self.order_ids[row] = self.orders.setdefault(tuple(record), len(self.orders))
+        for key, value in record.items():
+            column = self.columns.get(key)
+            if column is None:
+                column = self.columns[key] = _Column(*types[key])
+            elif column.python_type is not types[key][0]:
+                raise UnsupportedGraphML(f"attribute {key} declared with two types")
+            column.append(row, value)
+
+    @property
+    def nbytes(self):
+        return self.order_ids.itemsize * len(self.order_ids) + sum(c.nbytes for c in self.columns.values())
+
+    def finish(self, prefix, new_rows, n, arrays):
+        """Write the records in the parse cache layout; returns the keys and key orders"""
+        order_ids = np.zeros(len(new_rows), dtype=np.int32)
+        order_ids[:len(self.order_ids)] = np.frombuffer(self.order_ids, dtype=np.int32)
+        kept = new_rows >= 0
+        final = np.zeros(n, dtype=np.int32)
+        final[new_rows[kept]] = order_ids[kept]
+        arrays[f"{prefix}orders"] = final
+
+        keys = list(self.columns)
+        for k, key in enumerate(keys):
+            present, values = self.columns[key].finish(new_rows, n)
+            arrays[f"{prefix}{k}_present"] = present
+            arrays[f"{prefix}{k}"] = values
+            if self.columns[key].strings is not None:
+                arrays[f"{prefix}{k}_types"] = np.zeros(len(values), dtype=np.int8)
+        return keys, [list(order) for order in self.orders]
+
+
+# =====================================================
+# Streaming reader
+# =====================================================
+
+@lru_cache(maxsize=None)
+def _local(tag):
+    # Tag name in the GraphML namespace (or without namespace), None for foreign tags
+    if tag.startswith(NS_GRAPHML):
+        return tag[len(NS_GRAPHML):]
+    return None if tag.startswith("{") else tag
+
+
+def stream_graphml(path, node_filter=None, max_memory=None, progress=None) -> dict:
+    """
+    Read a GraphML file element by element into the columnar arrays of the parse cache
+    (see parse_cache.encode_graph), without building the XML tree or a networkx graph.
+
+    The result decodes to the same graph as nx.read_graphml, with the same node and
+    adjacency order. `node_filter(data)` may edit a node's attribute dict in place and
+    returns False to drop the node and its edges (like clean_nodes). Parsed elements are
+    released as soon as they are read, so memory is bounded by the compact columns;
+    MemoryLimitExceeded is raised once they would outgrow `max_memory` bytes.
+    `progress(bytes_read, total_bytes, n_nodes, n_edges)` is called while reading.
+
+    Raises UnsupportedGraphML for content networkx reads differently (e.g. parallel
+    edges make a multigraph); callers fall back to nx.read_graphml.
+    """
+    total_bytes = os.path.getsize(path)
+    keys, defaults = {}, {}
+    names, name_to_id = [], {}
+    declared = array("q")  # declaration rank of each node id, -1 if only referenced by edges
+    node_records, edge_records = _Records(), _Records()
+    node_types, edge_types = {}, {}
+    src, dst = array("q"), array("q")
+    graph_data, directed = {}, None
+    name_bytes = [0]
+
+    def node_id(name):
+        i = name_to_id.get(name)
+        if i is None:
+            i = name_to_id[name] = len(names)
+            names.append(name)
+            declared.append(-1)
+            name_bytes[0] += len(name) + _OBJECT_BYTES
+        return i
+
+    def decode(element, types):
+        data = {}
+        for data_element in element:
+            if _local(data_element.tag) != "data":
+                if _local(data_element.tag) is not None:
+                    raise UnsupportedGraphML(f"<{_local(data_element.tag)}> inside <{_local(element.tag)}>")
+                continue
+            key = keys.get(data_element.get("key"))
+            if key is None:
+                raise UnsupportedGraphML(f"no key {data_element.get('key')}")
+            if len(data_element):
+                raise UnsupportedGraphML("yfiles data")
+            text = data_element.text
+            if text is not None:
+                name, python_type = key["name"], key["type"][0]
+                data[name] = _BOOLS[text.lower()] if python_type is bool else python_type(text)
+                types[name] = key["type"]
+        return data
+
+    def memory():
+        return node_records.nbytes + edge_records.nbytes + 8 * (len(src) + len(dst) + len(declared)) + name_bytes[0]
+
+    n_declared, depth, n_elements = 0, 0, 0
+    with open(path, "rb") as f:
+        graph_element = None
+        for event, element in iterparse(f, events=("start", "end")):
+            tag = _local(element.tag)
+            if event == "start":
+                depth += 1
+                if tag == "graph":
+                    if graph_element is not None:
+                        raise UnsupportedGraphML("nested graphs")
+                    graph_element = element
+                    directed = element.get("edgedefault") == "directed"
+                elif tag == "hyperedge":
+                    raise UnsupportedGraphML("hyperedges")
+                continue
+
+            depth -= 1
+            if tag == "key":
+                attr_type = element.get("attr.type") or "string"
+                if element.get("yfiles.type") is not None or attr_type not in _TYPES:
+                    raise UnsupportedGraphML(f"key type {attr_type}")
+                if element.get("attr.name") is None:
+                    raise UnsupportedGraphML(f"unnamed key {element.get('id')}")
+                key = keys[element.get("id")] = {
+                    "name": element.get("attr.name"), "type": _TYPES[attr_type], "for": element.get("for")}
+                default = element.find(f"{NS_GRAPHML}default")
+                if default is None:
+                    default = element.find("default")
+                if default is not None:
+                    python_type = key["type"][0]
+                    defaults[element.get("id")] = (_BOOLS[default.text.lower()] if python_type is bool
+                                                   else python_type(default.text))
+            elif tag == "node" and graph_element is not None:
+                if element.attrib.get("yfiles.foldertype") == "group":
+                    raise UnsupportedGraphML("yfiles groups")
+                i = node_id(element.get("id"))
+                if declared[i] >= 0:
+                    raise UnsupportedGraphML(f"node {element.get('id')} declared twice")
+                declared[i] = n_declared
+                n_declared += 1
+                data = decode(element, node_types)
+                if node_filter is None or node_filter(data) is not False:
+                    node_records.append(i, data, node_types)
+                else:
+                    declared[i] = -2 - declared[i]  # dropped, rank kept for the edge order
+                graph_element.remove(element)
+            elif tag == "edge" and graph_element is not None:
+                edge_directed = element.get("directed")
+                if edge_directed is not None and (edge_directed == "true") != directed:
+                    raise UnsupportedGraphML("mixed directed and undirected edges")
+                u, v = node_id(element.get("source")), node_id(element.get("target"))
+                data = decode(element, edge_types)
+                if element.get("id"):
+                    data["id"] = element.get("id")
+                    edge_types["id"] = (str, None)
+                edge_records.append(len(src), data, edge_types)
+                src.append(u)
+                dst.append(v)
+                graph_element.remove(element)
+            elif tag == "graph":
+                graph_data = decode(element, {})
+                break  # networkx only reads the first graph
+            elif tag == "graphml":
+                break
+            else:
+                continue
+
+            n_elements += 1
+            if n_elements % PROGRESS_EVERY == 0:
+                if max_memory is not None and memory() > max_memory:
+                    raise MemoryLimitExceeded(f"{path}: more than {max_memory} bytes after "
+                                              f"{len(names)} nodes and {len(src)} edges")
+                if progress is not None:
+                    progress(f.tell(), total_bytes, len(names), len(src))
+
+    if graph_element is None:
+        raise UnsupportedGraphML("no graph")
+    graph = {
+        "node_default": {keys[k]["name"]: v for k, v in defaults.items() if keys[k]["for"] == "node"},
+        "edge_default": {keys[k]["name"]: v for k, v in defaults.items() if keys[k]["for"] == "edge"},
+        **graph_data,
+    }
+    arrays = _finish(names, np.frombuffer(declared, dtype=np.int64) if len(declared) else np.empty(0, np.int64),
+                     n_declared, node_records, edge_records, src, dst, directed, graph, node_filter)
+    if max_memory is not None and memory() > max_memory:
+        raise MemoryLimitExceeded(f"{path}: more than {max_memory} bytes")
+    if progress is not None:
+        progress(total_bytes, total_bytes, len(names), len(src))
+    return arrays
+
+
+def _finish(names, declared, n_declared, node_records, edge_records, src, dst, directed, graph, node_filter):
+    # Node positions as networkx orders them: declared nodes first, then nodes only seen in edges
+    n_all = len(names)
+    referenced = declared == -1
+    rank = np.where(declared >= 0, declared, -2 - declared)
+    rank[referenced] = n_declared + np.arange(int(referenced.sum()))
+    keep = (declared >= 0) | referenced
+    for i in np.flatnonzero(referenced).tolist():
+        data = {}
+        if node_filter is None or node_filter(data) is not False:
+            node_records.append(i, data, {})
+        else:
+            keep[i] = False
+
+    src = np.frombuffer(src, dtype=np.int64) if len(src) else np.empty(0, np.int64)
+    dst = np.frombuffer(dst, dtype=np.int64) if len(dst) else np.empty(0, np.int64)
+    first, second = rank[src], rank[dst]
+    if not directed:
+        first, second = np.minimum(first, second), np.maximum(first, second)
+    pair_keys = first * n_all + second
+    if len(np.unique(pair_keys)) < len(pair_keys):
+        raise UnsupportedGraphML("parallel edges")
+
+    # Edges in the order networkx adds them when turning its multigraph into a graph:
+    # by the position of the endpoint reached first, then in file order
+    edge_order = np.lexsort((np.arange(len(src)), first))
+    swap = rank[src] > rank[dst] if not directed else np.zeros(len(src), dtype=bool)
+    new_src, new_dst = np.where(swap, dst, src)[edge_order], np.where(swap, src, dst)[edge_order]
+
+    by_rank = np.argsort(rank, kind="stable")
+    kept_ids = by_rank[keep[by_rank]]
+    new_nodes = np.full(n_all, -1, dtype=np.int64)
+    new_nodes[kept_ids] = np.arange(len(kept_ids))
+
+    edge_kept = keep[new_src] & keep[new_dst]
+    new_edges = np.full(len(src), -1, dtype=np.int64)
+    new_edges[edge_order[edge_kept]] = np.arange(int(edge_kept.sum()))
+
+    arrays = {"names": np.array([names[i] for i in kept_ids.tolist()], dtype=str)}
+    node_keys, node_orders = node_records.finish("node_", new_nodes, len(kept_ids), arrays)
+    arrays["src"] = new_nodes[new_src[edge_kept]].astype(np.int32)
+    arrays["dst"] = new_nodes[new_dst[edge_kept]].astype(np.int32)
+    edge_keys, edge_orders = edge_records.finish("edge_", new_edges, int(edge_kept.sum()), arrays)
+    header = {
+        "directed": bool(directed),
+        "graph": graph,
+        "node_keys": node_keys,
+        "node_orders": node_orders,
+        "edge_keys": edge_keys,
+        "edge_orders": edge_orders,
+    }
+    arrays["header"] = np.array(json.dumps(header))
+    return arrays
+
+
+if __name__ == "__main__":
+    # Usage: python -m src.loaders.graphml_stream [n_nodes] [n_edges]
+    # Peak traced memory and time of nx.read_graphml against the streaming loader on a
+    # synthetic attributed network, and the memory ceiling kicking in.
+    import sys
+    import tempfile
+    import time
+    import tracemalloc
+
+    import networkx as nx
+
+    from src.loaders.parse_cache import decode_graph
+
+    n_nodes = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    n_edges = int(sys.argv[2]) if len(sys.argv) > 2 else 200000
+    rng = np.random.RandomState(42)
+    graph = nx.gnm_random_graph(n_nodes, n_edges, seed=42)
+    for node in graph:
+        graph.nodes[node].update(sex=str(rng.choice(["f", "m"])), age=float(rng.randint(1, 20)),
+                                 colony=f"colony{rng.randint(50)}")
+    for u, v in graph.edges:
+        graph.edges[u, v]["weight"] = float(rng.rand())
+    path = os.path.join(tempfile.mkdtemp(), "network.graphml")
+    nx.write_graphml(graph, path)
+    del graph
+    print(f"{n_nodes} nodes, {n_edges} edges, {os.path.getsize(path) / 2 ** 20:.1f}MB of GraphML")
+
+    def measure(read):
+        tracemalloc.start()
+        start = time.perf_counter()
+        result = read()
+        elapsed = time.perf_counter() - start
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        return result, elapsed, peak
+
+    reference, t_nx, peak_nx = measure(lambda: nx.read_graphml(path))
+    arrays, t_stream, peak_stream = measure(lambda: stream_graphml(path))
+    stored = sum(a.nbytes for a in arrays.values())
+    assert list(decode_graph(arrays).edges(data=True)) == list(reference.edges(data=True))
+    print(f"nx.read_graphml: {t_nx:.2f}s, peak {peak_nx / 2 ** 20:.0f}MB")
+    print(f"stream_graphml:  {t_stream:.2f}s, peak {peak_stream / 2 ** 20:.0f}MB "
+          f"({stored / 2 ** 20:.1f}MB of arrays)")
+
+    updates = []
+    stream_graphml(path, progress=lambda read, total, *_: updates.append(read / total))
+    print(f"{len(updates)} progress updates, last at {updates[-1]:.0%}")
+    try:
+        stream_graphml(path, max_memory=stored // 4)
+    except MemoryLimitExceeded as e:
+        print(f"Ceiling of {stored // 4} bytes: {e}")
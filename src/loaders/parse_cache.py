@@ -0,0 +1,281 @@
+import os
+import json
+import hashlib
+import logging
+import pickle
+
+import numpy as np
+import networkx as nx
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger('parse_cache')
+
+PARSE_CACHE_FOLDER = "./results/cache/graphml/"
+# Bump when the cached content changes, e.g. when clean_nodes removes different nodes
+CACHE_FORMAT = 1
+
+# Type codes of attribute values; columns with a single type are stored as a typed array
+_TYPES = {str: 0, int: 1, float: 2, bool: 3}
+_CASTS = {0: str, 1: int, 2: float, 3: lambda value: value == "True"}
+
+
+class _Unsupported(Exception):
+    pass
+
+
+def file_digest(path, chunk_size=1 << 20):
+    digest = hashlib.sha1()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+# =====================================================
+# Columnar encoding
+# =====================================================
+
+def _encode_records(prefix, records, arrays):
+    """
+    Store a list of attribute dicts column-wise: per key a value array and a presence mask,
+    plus per record an index into the distinct key orders, so dicts are rebuilt identically.
+    """
+    orders, order_ids = {}, np.empty(len(records), dtype=np.int32)
+    columns = {}
+    for i, record in enumerate(records):
+        order_ids[i] = orders.setdefault(tuple(record.keys()), len(orders))
+        for key, value in record.items():
+            if type(value) not in _TYPES or not isinstance(key, str):
+                raise _Unsupported(f"{key}: {type(value)}")
+            columns.setdefault(key, {})[i] = value
+
+    arrays[f"{prefix}orders"] = order_ids
+    keys = list(columns)
+    for k, key in enumerate(keys):
+        values = columns[key]
+        present = np.zeros(len(records), dtype=bool)
+        present[list(values)] = True
+        types = {type(value) for value in values.values()}
+        arrays[f"{prefix}{k}_present"] = present
+        if len(types) == 1 and types != {str}:
+            arrays[f"{prefix}{k}"] = np.array(list(values.values()))
+        else:
+            # Strings, or mixed types: text plus a type code per value
+            arrays[f"{prefix}{k}"] = np.array([v if isinstance(v, str) else repr(v) for v in values.values()],
+                                              dtype=str)
+            arrays[f"{prefix}{k}_types"] = np.array([_TYPES[type(v)] for v in values.values()], dtype=np.int8)
+    return keys, [list(order) for order in orders]
+
+
+def _decode_records(prefix, keys, orders, arrays, n):
+    columns = []
+    for k in range(len(keys)):
+        present = arrays[f"{prefix}{k}_present"]
+        values = arrays[f"{prefix}{k}"].tolist()
+        if f"{prefix}{k}_types" in arrays:
+            values = [_CASTS[t](v) for t, v in zip(arrays[f"{prefix}{k}_types"].tolist(), values)]
+        column = [None] * n
+        for i, value in zip(np.flatnonzero(present).tolist(), values):
+            column[i] = value
+        columns.append(column)
+
+    key_index = {key: k for k, key in enumerate(keys)}
+    orders = [[(key, columns[key_index[key]]) for key in order] for order in orders]
+    return [{key: column[i] for key, column in orders[order_id]}
+            for i, order_id in enumerate(arrays[f"{prefix}orders"].tolist())]
+
+
+def encode_graph(graph: nx.Graph) -> dict:
+    """Arrays of a networkx graph: node names, int32 edge endpoints and columnar attributes"""
+    if graph.is_multigraph():
+        raise _Unsupported("multigraph")
+    names = list(graph.nodes)
+    if not all(isinstance(name, str) for name in names):
+        raise _Unsupported("non-string node ids")
+    name_to_id = {name: i for i, name in enumerate(names)}
+
+    arrays = {"names": np.array(names, dtype=str)}
+    node_keys, node_orders = _encode_records("node_", [data for _, data in graph.nodes(data=True)], arrays)
+    edges = list(graph.edges(data=True))
+    arrays["src"] = np.fromiter((name_to_id[u] for u, _, _ in edges), dtype=np.int32, count=len(edges))
+    arrays["dst"] = np.fromiter((name_to_id[v] for _, v, _ in edges), dtype=np.int32, count=len(edges))
+    edge_keys, edge_orders = _encode_records("edge_", [data for _, _, data in edges], arrays)
+
+    header = {
+        "directed": graph.is_directed(),
+        "graph": graph.graph,
+        "node_keys": node_keys,
+        "node_orders": node_orders,
+        "edge_keys": edge_keys,
+        "edge_orders": edge_orders,
+    }
+    try:
+        arrays["header"] = np.array(json.dumps(header))
+    except TypeError as e:
+        raise _Unsupported(e)
+    return arrays
+
+
+def decode_graph(arrays) -> nx.Graph:
+    header = json.loads(arrays["header"].item())
+    names = arrays["names"].tolist()
+    graph = nx.DiGraph() if header["directed"] else nx.Graph()
+    graph.graph.update(header["graph"])
+
+    node_data = _decode_records("node_", header["node_keys"], header["node_orders"], arrays, len(names))
+    graph.add_nodes_from(zip(names, node_data))
+    src, dst = arrays["src"].tolist(), arrays["dst"].tolist()
+    edge_data = _decode_records("edge_", header["edge_keys"], header["edge_orders"], arrays, len(src))
+    graph.add_edges_from((names[u], names[v], data) for u, v, data in zip(src, dst, edge_data))
+    return graph
+
+
+# =====================================================
+# Cache
+# =====================================================
+
+class GraphParseCache:
+    """
+    On-disk cache of parsed (and cleaned) graph files.
+
+    Entries are keyed by the content hash of the source file. An index maps each source path
+    to its last seen (size, mtime, hash), so unchanged files are not even re-hashed, while a
+    touched but identical file still hits the cache after hashing.
+    """
+
+    def __init__(self, folder=PARSE_CACHE_FOLDER):
+        self.folder = folder
+        self.index_path = os.path.join(folder, "index.pkl")
+        self._index = None
+        self.hits = 0
+        self.misses = 0
+
+    @property
+    def index(self):
+        if self._index is None:
+            try:
+                with open(self.index_path, "rb") as f:
+                    self._index = pickle.load(f)
+            except (OSError, EOFError, pickle.UnpicklingError):
+                self._index = {}
+        return self._index
+
+    def digest(self, path):
+        stat = os.stat(path)
+        path = os.path.abspath(path)
+        entry = self.index.get(path)
+        if entry is not None and entry[:2] == (stat.st_size, stat.st_mtime_ns):
+            return entry[2]
+        digest = file_digest(path)
+        self.index[path] = (stat.st_size, stat.st_mtime_ns, digest)
+        self._save_index()
+        return digest
+
+    def entry_path(self, digest):
+        return os.path.join(self.folder, f"{digest}_v{CACHE_FORMAT}.npz")
+
+    def load(self, path, parse, parse_arrays=None) -> nx.Graph:
+        """
+        The graph stored for the content of `path`, or `parse()` which is then stored.
+
+        `parse_arrays()`, if given, is tried before `parse()`: it reads the file straight
+        into the stored arrays (see encode_graph), or returns None to fall back to `parse()`.
+        """
+        arrays, graph = self._load(path, parse, parse_arrays, decode=True)
+        return graph
+
+    def load_arrays(self, path, parse, parse_arrays=None):
+        """Like load, but (stored arrays, None), or (None, graph) if the graph cannot be stored"""
+        arrays, graph = self._load(path, parse, parse_arrays, decode=False)
+        return arrays, graph if arrays is None else None
+
+    def _load(self, path, parse, parse_arrays, decode):
+        # (arrays, graph); the graph is only built if `decode` or when networkx parsed the file
+        try:
+            entry_path = self.entry_path(self.digest(path))
+        except OSError:
+            entry_path = None
+
+        if entry_path is not None and os.path.isfile(entry_path):
+            try:
+                with np.load(entry_path, allow_pickle=False) as arrays:
+                    arrays = dict(arrays)
+                if decode:
+                    graph = decode_graph(arrays)
+                else:
+                    graph = None
+                    json.loads(arrays["header"].item())  # fails on damaged entries, like decoding
+                self.hits += 1
+                return arrays, graph
+            except (OSError, ValueError, KeyError) as e:
+                logger.warning(f"Dropping unreadable parse cache entry {entry_path}: {e}")
+
+        self.misses += 1
+        graph = None
+        arrays = parse_arrays() if parse_arrays is not None else None
+        if arrays is not None and decode:
+            graph = decode_graph(arrays)
+        elif arrays is None:
+            graph = parse()
+            try:
+                arrays = encode_graph(graph)
+            except _Unsupported as e:
+                logger.info(f"Not caching {path}: unsupported content ({e})")
+        if entry_path is not None and arrays is not None:
+            try:
+                os.makedirs(self.folder, exist_ok=True)
+                # Per-process temporary file: several ingestion workers may store the same entry
+                tmp_path = f"{entry_path}.{os.getpid()}.tmp.npz"
+                np.savez(tmp_path, **arrays)
+                os.replace(tmp_path, entry_path)
+            except OSError as e:
+                logger.warning(f"Could not write parse cache entry for {path}: {e}")
+        return arrays, graph
+
+    def _save_index(self):
+        try:
+            os.makedirs(self.folder, exist_ok=True)
+            tmp_path = f"{self.index_path}.{os.getpid()}.tmp"
+            with open(tmp_path, "wb") as f:
+                pickle.dump(self._index, f)
+            os.replace(tmp_path, self.index_path)
+        except OSError as e:
+            logger.warning(f"Could not write the parse cache index: {e}")
+
+
+parse_cache = GraphParseCache()
+
+
+if __name__ == "__main__":
+    # Usage: python -m src.loaders.parse_cache
+    # Cold XML parse (+ clean_nodes) against cached loads for every network in final_datasets.txt
+    import tempfile
+    import time
+
+    from src.loaders.asnr_dataloader import clean_nodes, stream_asnr_graph
+
+    def same_graph(a, b):
+        return (list(a.nodes(data=True)) == list(b.nodes(data=True)) and
+                {frozenset(e[:2]): e[2] for e in a.edges(data=True)} ==
+                {frozenset(e[:2]): e[2] for e in b.edges(data=True)})
+
+    with open("datasets/final_datasets.txt") as f:
+        paths = [x.strip() for x in f.readlines() if x.strip()]
+
+    cache = GraphParseCache(tempfile.mkdtemp())
+    total_xml, total_cached = 0., 0.
+    print(f"{'network':<45} {'nodes':>6} {'edges':>7} {'xml+store':>9} {'cached':>9}")
+    for path in paths:
+        start = time.perf_counter()
+        graph = cache.load(path, lambda: clean_nodes(nx.read_graphml(path)), lambda: stream_asnr_graph(path))
+        t_xml = time.perf_counter() - start
+
+        start = time.perf_counter()
+        cached = cache.load(path, lambda: clean_nodes(nx.read_graphml(path)))
+        t_cached = time.perf_counter() - start
+
+        assert same_graph(graph, cached), path
+        total_xml, total_cached = total_xml + t_xml, total_cached + t_cached
+        print(f"{path.split('/')[4]:<45} {graph.number_of_nodes():>6} {graph.number_of_edges():>7} "
+              f"{t_xml * 1e3:>7.1f}ms {t_cached * 1e3:>7.1f}ms")
+    print(f"{'total':<60} {total_xml * 1e3:>7.1f}ms {total_cached * 1e3:>7.1f}ms")
@@ -0,0 +1,224 @@
+import os
+import re
+import json
+import logging
+from concurrent.futures import ProcessPoolExecutor
+from itertools import repeat
+
+import numpy as np
+import networkx as nx
+
+from src.loaders.parse_cache import GraphParseCache, parse_cache, decode_graph
+from src.loaders.asnr_dataloader import clean_nodes, stream_asnr_graph
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger('temporal_stack')
+
+MAX_WORKERS = os.cpu_count() or 1
+
+
+def _natural_key(name):
+    # "day2" before "day10"
+    return [int(part) if part.isdigit() else part.lower() for part in re.split(r"(\d+)", name)]
+
+
+def _series_key(name):
+    # File name with its last number masked: "col1_day01" and "col1_day02" are one series
+    return re.sub(r"\d+(?=\D*$)", "#", name)
+
+
+def snapshot_files(folder, like=None):
+    """
+    GraphML snapshots of an animal directory, in natural file name order; only those of the
+    series of the file `like` (same name up to its last number) if given
+    """
+    try:
+        names = [x for x in os.listdir(folder) if x.endswith(".graphml")]
+    except OSError:
+        return []
+    if like is not None:
+        names = [x for x in names if _series_key(x) == _series_key(os.path.basename(like))]
+    names.sort(key=_natural_key)
+    return [os.path.join(folder, x) for x in names]
+
+
+def _ingest(path, cache_folder):
+    # Worker: the parse cache arrays of one snapshot, or its graph if it cannot be stored as
+    # arrays, plus the cache index entry so the parent learns the file hash
+    cache = parse_cache if cache_folder == parse_cache.folder else GraphParseCache(cache_folder)
+    arrays, graph = cache.load_arrays(path, lambda: clean_nodes(nx.read_graphml(path)),
+                                      lambda: stream_asnr_graph(path))
+    return arrays if arrays is not None else graph, cache.index.get(os.path.abspath(path))
+
+
+class TemporalStack:
+    """
+    Every GraphML snapshot of an animal directory, ordered in time, with node identities
+    aligned across snapshots.
+
+    Each distinct node identity (the node name, or the `align_on` attribute where nodes have
+    it) gets a global id; node_ids[t] maps the nodes of snapshot t to them and presence[t]
+    marks which global nodes snapshot t holds. Snapshots are kept as parse cache arrays and
+    only turned into networkx graphs when browsed.
+    """
+
+    def __init__(self, paths, snapshots, align_on=None):
+        self.paths = list(paths)
+        self.labels = [os.path.splitext(os.path.basename(path))[0] for path in self.paths]
+        self._snapshots = snapshots
+        self._graphs = {}
+        self.align_on = align_on
+
+        index = {}
+        self.node_ids, self.local_names = [], []
+        for t in range(len(self)):
+            names = self._names(t)
+            identities = names if align_on is None else \
+                [self.graph(t).nodes[name].get(align_on, name) for name in names]
+            self.node_ids.append(np.fromiter((index.setdefault(x, len(index)) for x in identities),
+                                             dtype=np.int32, count=len(identities)))
+            self.local_names.append(names)
+        self.identities = list(index)
+        self.presence = np.zeros((len(self), len(index)), dtype=bool)
+        for t, ids in enumerate(self.node_ids):
+            self.presence[t, ids] = True
+
+    @classmethod
+    def from_folder(cls, folder, align_on=None, max_workers=MAX_WORKERS, cache=None, like=None):
+        """Ingest the snapshots of `folder` through the parse cache, one worker process per file"""
+        cache = parse_cache if cache is None else cache
+        paths = snapshot_files(folder, like)
+        if len(paths) > 1 and max_workers > 1:
+            with ProcessPoolExecutor(max_workers=min(max_workers, len(paths))) as executor:
+                results = list(executor.map(_ingest, paths, repeat(cache.folder)))
+            # The workers hashed the files; keep their index entries for the next load
+            cache.index.update((os.path.abspath(path), entry)
+                               for path, (_, entry) in zip(paths, results) if entry is not None)
+            cache._save_index()
+        else:
+            results = [_ingest(path, cache.folder) for path in paths]
+        logger.info(f"Ingested {len(paths)} snapshots of {folder}")
+        return cls(paths, [snapshot for snapshot, _ in results], align_on)
+
+    # =====================================================
+    # Snapshots
+    # =====================================================
+
+    def __len__(self):
+        return len(self.paths)
+
+    def graph(self, t) -> nx.Graph:
+        """Cleaned networkx graph of snapshot t (shared, copy before editing)"""
+        if t not in self._graphs:
+            snapshot = self._snapshots[t]
+            self._graphs[t] = snapshot if isinstance(snapshot, nx.Graph) else decode_graph(snapshot)
+        return self._graphs[t]
+
+    def _names(self, t):
+        snapshot = self._snapshots[t]
+        if isinstance(snapshot, nx.Graph):
+            return list(snapshot.nodes)
+        return snapshot["names"].tolist()
+
+    def _directed(self, t):
+        snapshot = self._snapshots[t]
+        if isinstance(snapshot, nx.Graph):
+            return snapshot.is_directed()
+        return bool(json.loads(snapshot["header"].item())["directed"])
+
+    def edges(self, t):
+        """(m, 2) array of the edges of snapshot t in global node ids"""
+        snapshot = self._snapshots[t]
+        if isinstance(snapshot, nx.Graph):
+            local = {name: i for i, name in enumerate(self.local_names[t])}
+            pairs = np.array([(local[u], local[v]) for u, v in snapshot.edges], dtype=np.int64).reshape(-1, 2)
+        else:
+            pairs = np.stack([snapshot["src"], snapshot["dst"]], axis=1).astype(np.int64)
+        return self.node_ids[t][pairs] if len(pairs) else pairs
+
+    def edge_keys(self, t):
+        # Sorted int64 keys of the edges, endpoint order ignored for undirected snapshots
+        edges = self.edges(t).astype(np.int64)
+        if not self._directed(t):
+            edges = np.sort(edges, axis=1)
+        return np.unique(edges[:, 0] * len(self.identities) + edges[:, 1])
+
+    def n_nodes(self, t):
+        return len(self.local_names[t])
+
+    def n_edges(self, t):
+        return len(self.edges(t))
+
+    def avg_degree(self, t):
+        """Mean degree, counted like networkx (self-loops twice, in + out when directed)"""
+        n = self.n_nodes(t)
+        return 2 * self.n_edges(t) / n if n else 0.
+
+    def difference(self, t):
+        """
+        (nodes, edges) of snapshot t that are new since snapshot t - 1, as names of snapshot
+        t, like Graph.difference_to; nothing is new in the first snapshot
+        """
+        if t == 0:
+            return [], []
+        names = np.full(len(self.identities), None, dtype=object)
+        names[self.node_ids[t]] = self.local_names[t]
+
+        new_nodes = self.presence[t] & ~self.presence[t - 1]
+        edges = self.edges(t)
+        keys = edges.min(axis=1) * len(self.identities) + edges.max(axis=1) if not self._directed(t) else \
+            edges[:, 0] * len(self.identities) + edges[:, 1]
+        new_edges = edges[~np.isin(keys, self.edge_keys(t - 1))] if len(edges) else edges
+        return names[new_nodes].tolist(), [(names[u], names[v]) for u, v in new_edges.tolist()]
+
+
+if __name__ == "__main__":
+    # Usage: python -m src.loaders.temporal_stack [n_snapshots] [n_nodes] [n_edges]
+    # Ingests a synthetic animal directory of drifting snapshots sequentially and with the
+    # process pool (both on a cold parse cache), then checks the alignment.
+    import shutil
+    import sys
+    import tempfile
+    import time
+
+    n_snapshots = int(sys.argv[1]) if len(sys.argv) > 1 else 6
+    n_nodes = int(sys.argv[2]) if len(sys.argv) > 2 else 3000
+    n_edges = int(sys.argv[3]) if len(sys.argv) > 3 else 30000
+    rng = np.random.RandomState(42)
+    folder = tempfile.mkdtemp()
+    for t in range(n_snapshots):
+        # Each snapshot drops some animals and adds new ones
+        graph = nx.gnm_random_graph(n_nodes, n_edges, seed=t)
+        graph = nx.relabel_nodes(graph, {i: f"animal{i + t * n_nodes // 10}" for i in graph})
+        for node in graph:
+            graph.nodes[node].update(sex=str(rng.choice(["f", "m"])), age=float(rng.randint(1, 20)))
+        nx.write_graphml(graph, os.path.join(folder, f"colony_day{t + 1}.graphml"))
+
+    timings = {}
+    for mode, workers in [("sequential", 1), ("process pool", MAX_WORKERS)]:
+        cache_folder = tempfile.mkdtemp()
+        start = time.perf_counter()
+        stack = TemporalStack.from_folder(folder, max_workers=workers, cache=GraphParseCache(cache_folder))
+        timings[mode] = time.perf_counter() - start
+        shutil.rmtree(cache_folder)
+
+    cache_folder = tempfile.mkdtemp()
+    slowest = 0.
+    for path in snapshot_files(folder):
+        start = time.perf_counter()
+        _ingest(path, cache_folder)
+        slowest = max(slowest, time.perf_counter() - start)
+    start = time.perf_counter()
+    TemporalStack.from_folder(folder, cache=GraphParseCache(cache_folder))
+    timings["warm cache"] = time.perf_counter() - start
+
+    print(f"{n_snapshots} snapshots of {n_nodes} nodes / {n_edges} edges, {MAX_WORKERS} cpus")
+    for mode, elapsed in timings.items():
+        print(f"{mode:<13} {elapsed:.2f}s")
+    print(f"slowest file  {slowest:.2f}s")
+
+    assert stack.labels == [f"colony_day{t + 1}" for t in range(n_snapshots)]
+    assert len(stack.identities) == n_nodes + (n_snapshots - 1) * (n_nodes // 10)
+    nodes, edges = stack.difference(1)
+    assert len(nodes) == n_nodes // 10
+    print(f"day2: {len(nodes)} new animals, {len(edges)} new edges")
@@ -0,0 +1,164 @@
+import os
+import time
+import logging
+import pickle
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger('version_manifest')
+
+# Not a .pkl file: those are the versions themselves
+MANIFEST_NAME = "manifest.pickle"
+MANIFEST_FORMAT = 1
+
+# Summary fields of an entry, filled when a version is saved or on first use
+SUMMARY = ["n_nodes", "n_edges", "avg_degree", "avg_coeff"]
+CHANGES = ["added_nodes", "added_edges"]
+
+
+def _token(path):
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return stat.st_mtime_ns, stat.st_size
+
+
+class VersionManifest:
+    """
+    Lineage and summary of the saved versions of one animal, kept in a small file next to them
+    (results/graphs/<animal>/manifest.pickle), so that listing the evolution of a version or
+    plotting its statistics does not unpickle any graph.
+
+    Per version: prev_version / prev_path, save time, storage (kind, depth, base), node and
+    edge counts, mean degree and clustering, and the nodes and edges added since prev_version.
+    An entry is only trusted while its file keeps the mtime and size it was recorded with;
+    otherwise it is rebuilt from the header of the version file. The "default" entry describes
+    the original GraphML file.
+    """
+
+    def __init__(self, folder):
+        self.folder = folder
+        self.path = os.path.join(folder, MANIFEST_NAME)
+        self._entries = None
+
+    @property
+    def entries(self):
+        if self._entries is None:
+            self._entries = self._load()
+        return self._entries
+
+    def _load(self):
+        try:
+            with open(self.path, "rb") as f:
+                manifest = pickle.load(f)
+            if manifest["format"] == MANIFEST_FORMAT:
+                return manifest["entries"]
+        except (OSError, EOFError, KeyError, pickle.UnpicklingError):
+            pass
+        return {}
+
+    def _save(self):
+        try:
+            os.makedirs(self.folder, exist_ok=True)
+            tmp_path = f"{self.path}.{os.getpid()}.tmp"
+            with open(tmp_path, "wb") as f:
+                pickle.dump({"format": MANIFEST_FORMAT, "entries": self.entries}, f)
+            os.replace(tmp_path, self.path)
+        except OSError as e:
+            logger.warning(f"Could not write the version manifest {self.path}: {e}")
+
+    def version_path(self, version):
+        return os.path.join(self.folder, version + ".pkl")
+
+    # =====================================================
+    # Queries
+    # =====================================================
+
+    def entry(self, version, path=None):
+        """
+        Manifest entry of `version` (saved at `path`, by default <folder>/<version>.pkl), or None
+        if there is no such file
+        """
+        path = os.path.normpath(self.version_path(version) if path is None else path)
+        token = _token(path)
+        if token is None:
+            return None
+        entry = self.entries.get(version)
+        if entry is not None and entry["path"] == path and entry["token"] == token:
+            return entry
+        return self._rebuild(version, path, token)
+
+    def _rebuild(self, version, path, token):
+        # Versions saved by the version store start with a small header; earlier ones are a
+        # whole state_dict, read once here
+        entry = {"path": path, "token": token, "saved_at": token[0] / 1e9}
+        if not path.endswith(".pkl"):
+            # The original GraphML file: nothing to read, its summary is recorded on first use
+            self.entries[version] = entry
+            return entry
+        logger.info(f"Indexing version {path}")
+        try:
+            with open(path, "rb") as f:
+                header = pickle.load(f)
+        except (OSError, EOFError, pickle.UnpicklingError) as e:
+            logger.warning(f"Could not read version {path}: {e}")
+            return None
+        entry.update({key: header.get(key) for key in ["prev_version", "prev_path", "kind", "depth", "base"]})
+        graph = header.get("graph")
+        if graph is not None:
+            n_nodes, n_edges = graph.number_of_nodes(), graph.number_of_edges()
+            entry.update(kind="full", depth=0, n_nodes=n_nodes, n_edges=n_edges,
+                         avg_degree=2 * n_edges / n_nodes if n_nodes else 0.)
+        self.entries[version] = entry
+        self._save()
+        return entry
+
+    def lineage(self, version):
+        """Versions from "default" up to `version`, following prev_version"""
+        versions = [version]
+        while versions[-1] != "default":
+            entry = self.entry(versions[-1])
+            prev_version = entry["prev_version"] if entry is not None else None
+            if prev_version is None or prev_version in versions:
+                logger.warning(f"Lineage of {version} stops at {versions[-1]}")
+                break
+            versions.append(prev_version)
+        versions.reverse()
+        return versions
+
+    def summary(self, version, path=None):
+        """The summary and changes recorded for `version`, None for those still unknown"""
+        entry = self.entry(version, path)
+        if entry is None:
+            return None
+        return {key: entry.get(key) for key in SUMMARY + CHANGES}
+
+    # =====================================================
+    # Updates
+    # =====================================================
+
+    def record(self, version, path=None, reset=False, **fields):
+        """
+        Record fields of `version` as its file is now, e.g. after computing its metrics;
+        `reset` drops what was known about the version before, for a version just saved
+        """
+        path = os.path.normpath(self.version_path(version) if path is None else path)
+        token = _token(path)
+        entry = self.entries.get(version)
+        if reset or entry is None or entry["path"] != path:
+            entry = {"path": path, "saved_at": time.time()}
+        entry.update(fields, token=token)
+        self.entries[version] = entry
+        self._save()
+        return entry
+
+
+_manifests = {}
+
+
+def version_manifest(folder) -> VersionManifest:
+    """Shared manifest of a version folder"""
+    key = os.path.abspath(folder)
+    if key not in _manifests:
+        _manifests[key] = VersionManifest(folder)
+    return _manifests[key]
@@ -0,0 +1,478 @@
+import os
+import logging
+import pickle
+from collections import OrderedDict
+
+import numpy as np
+
+from src.loaders.asnr_dataloader import read_asnr_graph
+from src.loaders.version_manifest import version_manifest
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger('version_store')
+
+# A version is written in full once this many deltas separate it from a full state,
+# which bounds the number of deltas applied to reconstruct any version
+SNAPSHOT_INTERVAL = 8
+STORE_FORMAT = 1
+
+
+# =====================================================
+# Deltas
+# =====================================================
+
+_NO_POSITION = (np.nan, np.nan)
+
+
+def _same_position(a, b):
+    return a is b or (a is not None and b is not None and np.array_equal(a, b))
+
+
+def _first_seen(seen, u, v):
+    # Undirected edges show up from both ends
+    key = frozenset((u, v))
+    if key in seen:
+        return False
+    seen.add(key)
+    return True
+
+
+def _node_delta(old, new):
+    # (added nodes and nodes whose attributes changed with their full attributes, removed nodes)
+    old_nodes, new_nodes = old._node, new._node
+    return ({node: dict(data) for node, data in new_nodes.items() if old_nodes.get(node) != data},
+            [node for node in old_nodes if node not in new_nodes])
+
+
+def graph_delta(old, new):
+    """Nodes, edges and attributes that changed going from graph `old` to graph `new`"""
+    nodes, removed_nodes = _node_delta(old, new)
+
+    # Neighborhoods are compared whole (at C speed); only the nodes whose neighbors or edge
+    # data differ are looked at edge by edge. Edges of removed nodes go with the nodes.
+    old_adj, new_adj = old._adj, new._adj
+    directed = new.is_directed()
+    edges, removed_edges, seen = [], [], set()
+    for u, nbrs in new_adj.items():
+        old_nbrs = old_adj.get(u)
+        if old_nbrs == nbrs:
+            continue
+        old_nbrs = old_nbrs or {}
+        for v, data in nbrs.items():
+            if old_nbrs.get(v) != data and (directed or _first_seen(seen, u, v)):
+                edges.append((u, v, dict(data)))
+        removed_edges.extend((u, v) for v in old_nbrs if v not in nbrs)
+    return {
+        "nodes": nodes,
+        "removed_nodes": removed_nodes,
+        "edges": edges,
+        "removed_edges": removed_edges,
+        "graph": dict(new.graph) if new.graph != old.graph else None,
+    }
+
+
+def history_delta(old, new, changes):
+    """
+    graph_delta(old, new) when `new` is `old` plus `changes` (GraphDiff of the structural edits,
+    as Graph.changes_since_load): only the edges of the changes are looked at. Node attributes
+    are still compared whole, pages convert them in place without recording it.
+    """
+    nodes, removed_nodes = _node_delta(old, new)
+    new_nodes = new._node
+    edges = [(u, v, dict(new[u][v])) for u, v in changes.added_edges if new.has_edge(u, v)]
+    # Edges of removed nodes go with the nodes
+    removed_edges = [(u, v) for u, v in changes.removed_edges if u in new_nodes and v in new_nodes]
+    return {
+        "nodes": nodes,
+        "removed_nodes": removed_nodes,
+        "edges": edges,
+        "removed_edges": removed_edges,
+        "graph": dict(new.graph) if new.graph != old.graph else None,
+    }
+
+
+def apply_graph_delta(graph, delta):
+    """Apply a graph_delta in place"""
+    graph.remove_nodes_from(delta["removed_nodes"])
+    graph.remove_edges_from(delta["removed_edges"])
+    for node, data in delta["nodes"].items():
+        if node in graph:
+            graph.nodes[node].clear()
+        graph.add_node(node, **data)
+    for u, v, data in delta["edges"]:
+        if graph.has_edge(u, v):
+            graph[u][v].clear()
+        graph.add_edge(u, v, **data)
+    if delta["graph"] is not None:
+        graph.graph.clear()
+        graph.graph.update(delta["graph"])
+    return graph
+
+
+def layout_delta(old, new):
+    if new is None or old is None or isinstance(old, str) or isinstance(new, str):
+        return {"full": new}
+    nodes = list(new)
+    try:
+        # All positions compared at once; nodes without an old position never match
+        before = np.array([old.get(node, _NO_POSITION) for node in nodes], dtype=np.float64)
+        after = np.array([new[node] for node in nodes], dtype=np.float64)
+        moved = [nodes[i] for i in np.flatnonzero(~(before == after).all(axis=1))]
+    except (TypeError, ValueError, np.AxisError):
+        moved = [node for node in nodes if not _same_position(old.get(node), new[node])]
+    return {
+        "positions": {node: new[node] for node in moved},
+        "removed": [node for node in old if node not in new],
+    }
+
+
+def apply_layout_delta(layout, delta):
+    if "full" in delta:
+        return delta["full"]
+    layout = dict(layout)
+    for node in delta["removed"]:
+        layout.pop(node, None)
+    layout.update(delta["positions"])
+    return layout
+
+
+# =====================================================
+# Store
+# =====================================================
+
+class VersionStore:
+    """
+    Saved graph versions, one file per version as before (results/graphs/<animal>/<version>.pkl).
+
+    A file holds a small header pickle followed by the payload pickle. Most versions only store
+    the delta of nodes, edges, attributes and layout against their `prev_version`; every
+    SNAPSHOT_INTERVAL deltas the whole state is written instead, so reconstructing a version
+    applies at most that many deltas on top of a full state (or of the original GraphML).
+    Files written before the store (a bare state_dict pickle) read as full states.
+
+    Recently reconstructed states are kept in memory, so saving the version being edited only
+    diffs it against its already loaded parent. When the graph was read from that parent, the
+    delta comes from the edits it recorded since instead, without comparing the edges.
+    """
+
+    def __init__(self, maxsize=4):
+        self.maxsize = maxsize
+        self._states = OrderedDict()  # (path, mtime, size) -> (header, graph, node_layout)
+
+    # =====================================================
+    # Reading
+    # =====================================================
+
+    @staticmethod
+    def read_header(path):
+        """Header of a version file, without reading the graph payload of stored versions"""
+        with open(path, "rb") as f:
+            header = pickle.load(f)
+        return _as_header(header)
+
+    @staticmethod
+    def _read(path):
+        with open(path, "rb") as f:
+            header = pickle.load(f)
+            if isinstance(header, dict) and header.get("store_format") == STORE_FORMAT:
+                return header, pickle.load(f)
+        return _as_header(header), header
+
+    def load(self, path):
+        """state_dict of the version saved at `path`; the graph is the caller's to edit"""
+        header, graph, layout = self._state(path)
+        return {
+            "graph": graph.copy(),
+            "node_layout": dict(layout) if isinstance(layout, dict) else layout,
+            "prev_version": header["prev_version"],
+            "prev_path": header["prev_path"],
+        }
+
+    def _state(self, path):
+        # (header, graph, node_layout) of a version file, shared with the in-memory cache.
+        # The deltas back to the closest full or cached state are applied to a single copy.
+        chain, seen = [], set()
+        while True:
+            key = _file_key(path)
+            if key in self._states:
+                self._states.move_to_end(key)
+                state = self._states[key]
+                break
+            if key[0] in seen:
+                raise ValueError(f"Version lineage of {path} loops")
+            seen.add(key[0])
+            header, payload = self._read(path)
+            if header["kind"] == "full":
+                state = self._put(key, (header, payload["graph"], payload.get("node_layout")))
+                break
+            chain.append((key, header, payload))
+            base_path = _base_path(path, header["base"])
+            if base_path.endswith(".graphml"):
+                state = self._base_state(path, header["base"])
+                break
+            path = base_path
+
+        if not chain:
+            return state
+        _, graph, layout = state
+        graph = graph.copy()
+        for _, _, payload in reversed(chain):
+            apply_graph_delta(graph, payload["graph"])
+            layout = apply_layout_delta(layout, payload["node_layout"])
+        key, header, _ = chain[0]
+        return self._put(key, (header, graph, layout))
+
+    def _put(self, key, state):
+        self._states[key] = state
+        while len(self._states) > self.maxsize:
+            self._states.popitem(last=False)
+        return state
+
+    def _base_state(self, path, base):
+        base_path = _base_path(path, base)
+        if base_path.endswith(".graphml"):
+            key = _file_key(base_path)
+            if key in self._states:
+                self._states.move_to_end(key)
+                return self._states[key]
+            return self._put(key, (None, read_asnr_graph(base_path), None))
+        return self._state(base_path)
+
+    # =====================================================
+    # Writing
+    # =====================================================
+
+    def save(self, path, state_dict, default_path=None, source=None, changes=None):
+        """
+        Save a Graph.state_dict at `path`: as a delta against its prev_version when that one
+        can be read (the original GraphML at `default_path` for the "default" version), in full
+        every SNAPSHOT_INTERVAL deltas or when there is no parent. `source` and `changes` are
+        Graph.source and Graph.changes_since_load: when the graph was read from the parent,
+        the delta is built from its changes.
+        """
+        base, depth = self._parent(path, state_dict.get("prev_version"), default_path)
+        header = {
+            "store_format": STORE_FORMAT,
+            "prev_version": state_dict.get("prev_version"),
+            "prev_path": state_dict.get("prev_path"),
+            "base": None,
+            "depth": 0,
+            "kind": "full",
+        }
+        graph = state_dict["graph"]
+        delta, added = None, ([], [])
+        if base is not None:
+            _, base_graph, base_layout = self._base_state(path, base)
+            if changes is not None and source is not None and _file_key(_base_path(path, base)) == tuple(source):
+                delta = history_delta(base_graph, graph, changes)
+            else:
+                delta = graph_delta(base_graph, graph)
+            added = ([node for node in delta["nodes"] if node not in base_graph],
+                     [(u, v) for u, v, _ in delta["edges"] if not base_graph.has_edge(u, v)])
+        if delta is not None and depth < SNAPSHOT_INTERVAL:
+            header.update(base=base, depth=depth + 1, kind="delta")
+            payload = {"graph": delta, "node_layout": layout_delta(base_layout, state_dict["node_layout"])}
+        else:
+            payload = {"graph": graph, "node_layout": state_dict["node_layout"]}
+
+        self._detach_dependents(path)
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, "wb") as f:
+            pickle.dump(header, f)
+            pickle.dump(payload, f)
+        os.replace(tmp_path, path)
+        logger.info(f"Saved {header['kind']} version {path} (depth {header['depth']})")
+
+        # Lineage and summary, so browsing versions does not read them back
+        n_nodes, n_edges = graph.number_of_nodes(), graph.number_of_edges()
+        folder, name = os.path.split(path)
+        version_manifest(folder).record(
+            name[:-len(".pkl")], path, reset=True, prev_version=header["prev_version"], prev_path=header["prev_path"],
+            kind=header["kind"], depth=header["depth"], base=header["base"], n_nodes=n_nodes, n_edges=n_edges,
+            avg_degree=2 * n_edges / n_nodes if n_nodes else 0., added_nodes=added[0], added_edges=added[1])
+        return header
+
+    def _parent(self, path, prev_version, default_path):
+        # (base of the delta, depth of the base), or (None, 0) for a full save
+        if prev_version is None:
+            return None, 0
+        if prev_version == "default":
+            if default_path is None or not os.path.isfile(default_path):
+                return None, 0
+            return default_path, 0
+        prev_file = prev_version + ".pkl"
+        prev_path = os.path.join(os.path.dirname(path), prev_file)
+        if os.path.abspath(prev_path) == os.path.abspath(path) or not os.path.isfile(prev_path):
+            return None, 0
+        try:
+            return prev_file, self.read_header(prev_path)["depth"]
+        except (OSError, EOFError, pickle.UnpicklingError) as e:
+            logger.warning(f"Saving {path} in full, its parent is unreadable: {e}")
+            return None, 0
+
+    def _detach_dependents(self, path):
+        # Versions stored as deltas of `path` are rewritten in full before `path` changes
+        folder, name = os.path.split(path)
+        if not os.path.isfile(path):
+            return
+        for file in sorted(os.listdir(folder)):
+            other = os.path.join(folder, file)
+            if not file.endswith(".pkl") or file == name:
+                continue
+            try:
+                header = self.read_header(other)
+            except (OSError, EOFError, pickle.UnpicklingError):
+                continue
+            if header.get("base") == name:
+                _, graph, layout = self._state(other)
+                header = dict(header, store_format=STORE_FORMAT, base=None, depth=0, kind="full")
+                tmp_path = f"{other}.{os.getpid()}.tmp"
+                with open(tmp_path, "wb") as f:
+                    pickle.dump(header, f)
+                    pickle.dump({"graph": graph, "node_layout": layout}, f)
+                os.replace(tmp_path, other)
+                version_manifest(folder).record(file[:-len(".pkl")], other, kind="full", depth=0, base=None)
+                logger.info(f"Rewrote {other} in full, its base {path} is being overwritten")
+        # Depths of the descendants are now overestimated at worst, which only makes them
+        # snapshot earlier
+
+    def clear(self):
+        self._states.clear()
+
+
+def _as_header(header):
+    if isinstance(header, dict) and header.get("store_format") == STORE_FORMAT:
+        return header
+    # Whole state_dict pickled by earlier saves
+    return {"store_format": None, "kind": "full", "base": None, "depth": 0,
+            "prev_version": header.get("prev_version"), "prev_path": header.get("prev_path")}
+
+
+def _file_key(path):
+    stat = os.stat(path)
+    return os.path.abspath(path), stat.st_mtime_ns, stat.st_size
+
+
+def _base_path(path, base):
+    # Versions are stored relative to their folder, the original GraphML as given
+    if base.endswith(".graphml"):
+        return base
+    return os.path.join(os.path.dirname(path), base)
+
+
+version_store = VersionStore()
+
+
+if __name__ == "__main__":
+    # Usage: python -m src.loaders.version_store [n_versions] [n_nodes] [n_edges]
+    # Saves a lineage of edited versions as whole-graph pickles and through the store, with the
+    # deltas found by comparing the graphs and built from the recorded edits, then checks every
+    # reconstructed version against the graph that was saved.
+    import shutil
+    import sys
+    import tempfile
+    import time
+
+    import networkx as nx
+
+    from src.utils.graph_diff import GraphDiff
+
+    n_versions = int(sys.argv[1]) if len(sys.argv) > 1 else 30
+    n_nodes = int(sys.argv[2]) if len(sys.argv) > 2 else 5000
+    n_edges = int(sys.argv[3]) if len(sys.argv) > 3 else 50000
+    rng = np.random.RandomState(42)
+    folder = tempfile.mkdtemp()
+
+    graph = nx.gnm_random_graph(n_nodes, n_edges, seed=42)
+    graph = nx.relabel_nodes(graph, {i: f"animal{i}" for i in graph})
+    for node in graph:
+        graph.nodes[node].update(sex=str(rng.choice(["f", "m"])), age=float(rng.randint(1, 20)))
+    for u, v in graph.edges:
+        graph[u][v]["weight"] = float(rng.rand())
+    default_path = os.path.join(folder, "colony.graphml")
+    nx.write_graphml(graph, default_path)
+    graph = read_asnr_graph(default_path)
+    layout = {node: rng.rand(2) for node in graph}
+
+    modes = ["pickle", "diff", "history"]
+    stores = {mode: VersionStore() for mode in modes[1:]}
+    for mode in stores:
+        os.makedirs(os.path.join(folder, mode))
+    expected, sizes, timings = {}, dict.fromkeys(modes, 0), {mode: [] for mode in modes}
+    prev_version = "default"
+    for k in range(n_versions):
+        # An editing session: a few new animals with their edges, a removal and moved nodes,
+        # recorded as Graph.changes_since_load gives them
+        names = list(graph)
+        removed = names[rng.randint(len(names))]
+        changes = GraphDiff([], [removed], [], [(removed, v) for v in graph[removed]], {}, {})
+        for i in range(3):
+            new = f"v{k}_{i}"
+            other = names[rng.randint(len(names))]
+            graph.add_node(new, sex="f", age=1.)
+            layout[new] = rng.rand(2)
+            if other != removed:
+                graph.add_edge(new, other, weight=1.)
+                changes.added_edges.append((new, other))
+            changes.added_nodes.append(new)
+        graph.remove_node(removed)
+        layout = {node: layout[node] for node in graph}
+        for node in rng.choice(list(graph), 10, replace=False):
+            layout[node] = rng.rand(2)
+
+        version = f"v{k}"
+        state_dict = {"graph": graph, "node_layout": layout, "prev_version": prev_version,
+                      "prev_path": os.path.join(folder, prev_version + ".pkl")}
+        start = time.perf_counter()
+        with open(os.path.join(folder, f"{version}_whole.pickle"), "wb") as f:
+            pickle.dump(state_dict, f)
+        timings["pickle"].append(time.perf_counter() - start)
+        sizes["pickle"] += os.path.getsize(os.path.join(folder, f"{version}_whole.pickle"))
+
+        for mode, store in stores.items():
+            path = os.path.join(folder, mode, version + ".pkl")
+            # The version being edited was loaded before, so its state is in memory
+            source = _file_key(default_path if k == 0 else os.path.join(folder, mode, prev_version + ".pkl"))
+            if k == 0:
+                store._base_state(path, default_path)
+            else:
+                store.load(source[0])
+            start = time.perf_counter()
+            if mode == "history":
+                store.save(path, state_dict, default_path, source, changes)
+            else:
+                store.save(path, state_dict, default_path)
+            timings[mode].append(time.perf_counter() - start)
+            sizes[mode] += os.path.getsize(path)
+        expected[version] = (graph.copy(), dict(layout))
+        prev_version = version
+
+    print(f"{n_versions} versions of a {n_nodes} nodes / {n_edges} edges graph")
+    for mode in modes:
+        print(f"{mode:<7} save median {np.median(timings[mode]) * 1e3:6.1f}ms, "
+              f"max {max(timings[mode]) * 1e3:6.1f}ms, {sizes[mode] / 2 ** 20:6.1f}MB in total")
+
+    cold = VersionStore()
+    for mode in stores:
+        slowest = 0.
+        for version, (graph, layout) in expected.items():
+            cold.clear()
+            start = time.perf_counter()
+            state = cold.load(os.path.join(folder, mode, version + ".pkl"))
+            slowest = max(slowest, time.perf_counter() - start)
+            assert list(state["graph"].nodes(data=True)) == list(graph.nodes(data=True)), version
+            assert {frozenset(e[:2]): e[2] for e in state["graph"].edges(data=True)} == \
+                   {frozenset(e[:2]): e[2] for e in graph.edges(data=True)}, version
+            assert state["node_layout"].keys() == layout.keys()
+            assert all(np.array_equal(state["node_layout"][n], layout[n]) for n in layout), version
+        print(f"{mode:<7} slowest cold reconstruction {slowest * 1e3:.1f}ms (at most {SNAPSHOT_INTERVAL} deltas)")
+
+    # Overwriting a version keeps the versions stored as its deltas readable
+    graph, layout = expected["v1"]
+    stores["diff"].save(os.path.join(folder, "diff", "v0.pkl"), {"graph": nx.Graph(), "node_layout": {},
+                        "prev_version": "default", "prev_path": None}, default_path)
+    cold.clear()
+    assert cold.read_header(os.path.join(folder, "diff", "v1.pkl"))["kind"] == "full"
+    assert nx.utils.graphs_equal(cold.load(os.path.join(folder, "diff", "v1.pkl"))["graph"], graph)
+    shutil.rmtree(folder)
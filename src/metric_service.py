@@ -0,0 +1,86 @@
+import logging
+import threading
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+
+from PyQt6.QtCore import QObject, pyqtSignal
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger('metric_service')
+
+MAX_WORKERS = 2
+
+# Returned in place of a metric that is still being computed
+PENDING = object()
+
+
+class _MetricService(QObject):
+    """
+    Runs metric computations off the GUI thread.
+
+    Jobs are keyed by (owner, metric name) and tagged with the owner's graph version:
+    requesting a job that is already in flight for the same version is a no-op, and
+    requesting it for a newer version supersedes the old one. Superseded jobs are cancelled
+    if they have not started yet, otherwise their result is dropped.
+
+    Results are emitted with `metric_ready(owner, version, name, value)` from the worker
+    thread; Qt queues the signal, so receivers living in the GUI thread handle it there.
+    """
+
+    metric_ready = pyqtSignal(object, object, str, object, name="metric_ready")
+    metric_failed = pyqtSignal(object, object, str, str, name="metric_failed")
+
+    def __init__(self, max_workers=MAX_WORKERS):
+        super().__init__()
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="metrics")
+        self._jobs = {}
+        self._lock = threading.Lock()
+
+    def request(self, owner, version, name, job):
+        """Schedule `job()` for metric `name` of `owner` at `version`, unless it is already running"""
+        key = (owner, name)
+        with self._lock:
+            running = self._jobs.get(key)
+            if running is not None and running[0] == version:
+                return running[1]
+            future = self._executor.submit(job)
+            self._jobs[key] = (version, future)
+        # Cancelling runs the done callbacks right away, so it happens outside the lock
+        if running is not None:
+            running[1].cancel()
+            logger.info(f"Superseded {name} job for version {running[0]}")
+        future.add_done_callback(lambda f: self._finished(key, version, f))
+        return future
+
+    def cancel(self, owner, name=None):
+        """Cancel the jobs of `owner` (only `name` if given), e.g. after its graph changed"""
+        with self._lock:
+            keys = [key for key in self._jobs if key[0] == owner and (name is None or key[1] == name)]
+            cancelled = [self._jobs.pop(key)[1] for key in keys]
+        for future in cancelled:
+            future.cancel()
+
+    @property
+    def n_running(self):
+        return len(self._jobs)
+
+    def _finished(self, key, version, future):
+        with self._lock:
+            running = self._jobs.get(key)
+            if running is None or running[1] is not future:
+                return  # superseded or cancelled, nobody is waiting for this result
+            del self._jobs[key]
+        if future.cancelled():
+            return
+
+        owner, name = key
+        error = future.exception()
+        if error is not None:
+            logger.error(f"Computing {name} failed: {error}")
+            traceback.print_exception(error)
+            self.metric_failed.emit(owner, version, name, str(error))
+        else:
+            self.metric_ready.emit(owner, version, name, future.result())
+
+
+MetricService = _MetricService()
@@ -0,0 +1,113 @@
+import logging
+
+import numpy as np
+
+from src.utils.gae_utils import row_tiles
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger('ann_index')
+
+# Cells probed per query by default: more cells are closer to exact scoring, fewer are faster
+ANN_PROBES = 8
+
+
+class IVFIndex:
+    """
+    Inverted file index over node embeddings for inner product search. The embeddings are
+    clustered with k-means (sqrt(n) cells by default) and a query only scores the nodes of the
+    `n_probe` cells whose centroids have the highest inner product with it.
+
+    Built on the mu of one model version; rows changed by later edits are moved to their
+    nearest cell with update(), the centroids stay as built.
+    """
+
+    def __init__(self, vectors, n_cells=None, n_iter=10, sample=256, seed=0):
+        n = len(vectors)
+        self.n_cells = max(1, min(n, n_cells or int(np.sqrt(n))))
+        rng = np.random.RandomState(seed)
+        # k-means on a sample of `sample` points per cell, then every row is assigned
+        train = vectors[np.sort(rng.choice(n, min(n, sample * self.n_cells), replace=False))]
+        self.centroids = train[rng.choice(len(train), self.n_cells, replace=False)].astype(np.float32)
+        for _ in range(n_iter):
+            assign = self._nearest(train)
+            counts = np.bincount(assign, minlength=self.n_cells)
+            sums = np.stack([np.bincount(assign, weights=train[:, j], minlength=self.n_cells)
+                             for j in range(train.shape[1])], axis=1)
+            filled = counts > 0
+            self.centroids[filled] = sums[filled] / counts[filled, None]
+        self.assign = self._nearest(vectors)
+        self._cells = None
+
+    def _nearest(self, vectors):
+        # Nearest centroid in L2, i.e. the highest x.c - |c|^2 / 2
+        half_norms = 0.5 * np.einsum("ij,ij->i", self.centroids, self.centroids)
+        assign = np.empty(len(vectors), dtype=np.int64)
+        for start, stop in row_tiles(len(vectors), self.n_cells):
+            assign[start:stop] = np.argmax(vectors[start:stop] @ self.centroids.T - half_norms, axis=1)
+        return assign
+
+    def __len__(self):
+        return len(self.assign)
+
+    def update(self, ids, vectors):
+        """
+        Move the rows `ids` of `vectors` (all the embeddings, rows past the indexed ones being
+        new nodes, which `ids` must include) to their cells
+        """
+        ids = np.asarray(ids, dtype=np.int64)
+        if len(vectors) > len(self.assign):
+            self.assign = np.concatenate([self.assign, np.zeros(len(vectors) - len(self.assign), dtype=np.int64)])
+        self.assign[ids] = self._nearest(vectors[ids])
+        self._cells = None
+
+    @property
+    def cells(self):
+        # (order, offsets): the ids of cell c are order[offsets[c]:offsets[c + 1]]
+        if self._cells is None:
+            order = np.argsort(self.assign, kind="stable")
+            offsets = np.concatenate([[0], np.cumsum(np.bincount(self.assign, minlength=self.n_cells))])
+            self._cells = order, offsets
+        return self._cells
+
+    def candidates(self, query, n_probe=ANN_PROBES):
+        """Ids of the nodes of the `n_probe` cells whose centroids score highest against `query`"""
+        n_probe = max(1, min(n_probe, self.n_cells))
+        probed = np.argpartition(-(self.centroids @ query), n_probe - 1)[:n_probe]
+        order, offsets = self.cells
+        return np.sort(np.concatenate([order[offsets[c]:offsets[c + 1]] for c in probed]))
+
+
+if __name__ == "__main__":
+    # Usage: python -m src.models.ann_index [n_nodes] [n_queries] [top_k]
+    # Top-k edge candidates of new nodes over clustered embeddings, scored exactly and through
+    # the index for several numbers of probed cells (recall against the exact top-k).
+    import sys
+    import time
+
+    from src.models.inference import score_edges
+
+    n_nodes = int(sys.argv[1]) if len(sys.argv) > 1 else 200000
+    n_queries = int(sys.argv[2]) if len(sys.argv) > 2 else 200
+    top_k = int(sys.argv[3]) if len(sys.argv) > 3 else 20
+    rng = np.random.RandomState(42)
+    # Embeddings of animals in groups, as the GAE gives for social groups
+    centers = rng.randn(300, 16).astype(np.float32) * 2
+    mu = (centers[rng.randint(len(centers), size=n_nodes)] + rng.randn(n_nodes, 16)).astype(np.float32)
+    query_ids = rng.choice(n_nodes, n_queries, replace=False)
+
+    start = time.perf_counter()
+    exact = score_edges(mu, query_ids, top_k=top_k)
+    t_exact = time.perf_counter() - start
+    start = time.perf_counter()
+    index = IVFIndex(mu)
+    t_build = time.perf_counter() - start
+
+    print(f"{n_nodes} nodes, {n_queries} queries, top {top_k}, {index.n_cells} cells")
+    print(f"index build        {t_build * 1e3:8.1f}ms")
+    print(f"exact              {t_exact * 1e3:8.1f}ms")
+    for n_probe in [1, 4, ANN_PROBES, 32, 128]:
+        start = time.perf_counter()
+        approx = score_edges(mu, query_ids, top_k=top_k, index=index, n_probe=n_probe)
+        elapsed = time.perf_counter() - start
+        recall = np.mean([len(np.intersect1d(a[0], e[0])) / max(1, len(e[0])) for a, e in zip(approx, exact)])
+        print(f"n_probe={n_probe:<4}       {elapsed * 1e3:8.1f}ms  recall {recall:.3f}")
@@ -0,0 +1,244 @@
+import logging
+from collections import OrderedDict
+
+import numpy as np
+import scipy.sparse as sp
+import torch
+
+from src.utils.gae_utils import preprocess_graph
+from src.models.ann_index import IVFIndex
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger('embedding_cache')
+
+# Number of versions whose embeddings are kept
+EMBEDDING_CACHE_SIZE = 4
+# Above this share of affected nodes, the whole graph is encoded again
+FULL_REFRESH_SHARE = 0.5
+
+
+class _Embeddings:
+    # Encoder outputs of one graph, with the inputs they were computed from
+
+    def __init__(self, model, names, features, adj, directed, hidden1, mu):
+        self.model = model
+        self.names = names
+        self.features = features
+        self.adj = adj
+        self.directed = directed
+        self.hidden1 = hidden1
+        self.mu = mu
+        self.index = None
+
+
+class EmbeddingCache:
+    """
+    Node embeddings (mu) and first layer activations (gc1) of the graphs predicted on, per
+    (animal, version), and the IVF index of the embeddings once asked for.
+
+    The encoder is a two-layer GCN, so an edit only changes the embeddings of the nodes within
+    two hops of it. When the next graph of a version is the cached one with nodes appended and
+    edges or features changed (as the array store builds them after AddNode / AddEdge), only
+    those rows are computed again, from the rows of the normalized adjacency they read.
+
+    Past `full_refresh_share` of the nodes the whole graph is encoded again instead. On small
+    dense graphs, like most ASNR networks, two hops reach most nodes, so these nearly always
+    get full passes; the partial refresh pays off on large sparse graphs.
+    """
+
+    def __init__(self, maxsize=EMBEDDING_CACHE_SIZE, full_refresh_share=FULL_REFRESH_SHARE):
+        self.maxsize = maxsize
+        self.full_refresh_share = full_refresh_share
+        self._entries = OrderedDict()
+        self.full = 0
+        self.incremental = 0
+
+    def embed(self, key, model, arrays) -> np.ndarray:
+        """mu of the nodes of `arrays` (GraphArrays) under `model`, the encoder of version `key`"""
+        entry = self._entries.get(key)
+        mu = None
+        if entry is not None and entry.model is model and entry.directed == arrays.directed:
+            mu = self._refresh(entry, arrays)
+        if mu is None:
+            mu = self._encode(key, model, arrays)
+        self._entries.move_to_end(key)
+        while len(self._entries) > max(self.maxsize, 0):
+            self._entries.popitem(last=False)
+        return mu
+
+    def index(self, key) -> IVFIndex:
+        """IVF index of the last embeddings of `key`, built on first use for each model"""
+        entry = self._entries[key]
+        if entry.index is None:
+            entry.index = IVFIndex(entry.mu)
+            logger.info(f"Indexed {len(entry.mu)} embeddings of {key[0]} {key[1]}")
+        return entry.index
+
+    def invalidate(self, animal, version=None):
+        for key in [key for key in self._entries if key[0] == animal and version in (None, key[1])]:
+            del self._entries[key]
+
+    # =====================================================
+    # Full and partial passes
+    # =====================================================
+
+    def _encode(self, key, model, arrays):
+        # Whole graph, as Encoder.mu computes it
+        self.full += 1
+        device = next(model.parameters()).device
+        features = torch.from_numpy(np.ascontiguousarray(arrays.features)).to(device)
+        adj_norm = preprocess_graph(arrays.adj).to(device)
+        with torch.no_grad():
+            hidden1 = model.encoder.gc1(features, adj_norm)
+            mu = model.encoder.gc2(hidden1, adj_norm)
+        hidden1, mu = hidden1.cpu().numpy(), mu.cpu().numpy()
+        self._entries[key] = _Embeddings(model, arrays.names, arrays.features, arrays.adj, arrays.directed,
+                                         hidden1, mu)
+        return mu
+
+    def _refresh(self, entry, arrays):
+        # Embeddings of `arrays` from those of the cached graph, None if it is not an edit of it
+        n0, n = len(entry.names), arrays.n_nodes
+        if n < n0 or not np.array_equal(arrays.names[:n0], entry.names):
+            return None
+        features, adj = arrays.features, sp.csr_array(arrays.adj)
+
+        # Nodes whose row of the normalized adjacency D^-1/2 (A + I)^T D^-1/2 changes (their
+        # edges) and nodes whose degree or features change, which the rows reading them see
+        delta = (adj - _padded(entry.adj, n)).tocoo()
+        changed = delta.row[delta.data != 0], delta.col[delta.data != 0]
+        direct = np.zeros(n, dtype=bool)
+        direct[n0:] = True
+        direct[changed[0]] = direct[changed[1]] = True
+        inputs = np.zeros(n, dtype=bool)
+        inputs[n0:] = True
+        inputs[changed[0]] = True
+        inputs[:n0] |= np.any(features[:n0] != entry.features, axis=1)
+        if not direct.any() and not inputs.any():
+            return entry.mu
+
+        # gc1 rows read the changed inputs, mu rows read the changed gc1 rows
+        rows1 = direct | _readers(adj, inputs)
+        rows2 = direct | _readers(adj, rows1)
+        if rows2.sum() > self.full_refresh_share * n:
+            return None
+        self.incremental += 1
+
+        encoder = entry.model.encoder
+        w1 = encoder.gc1.weight.detach().cpu().numpy()
+        w2 = encoder.gc2.weight.detach().cpu().numpy()
+        transposed = sp.csr_array(adj.T) if arrays.directed else adj
+        d_inv_sqrt = np.power(np.asarray(adj.sum(axis=1), dtype=np.float64).ravel() + 1, -0.5)
+
+        hidden1 = np.empty((n, entry.hidden1.shape[1]), dtype=entry.hidden1.dtype)
+        hidden1[:n0] = entry.hidden1
+        ids = np.flatnonzero(rows1)
+        block, cols = _normalized_rows(transposed, d_inv_sqrt, ids)
+        hidden1[ids] = np.maximum(block @ (features[cols] @ w1), 0)
+
+        mu = np.empty((n, entry.mu.shape[1]), dtype=entry.mu.dtype)
+        mu[:n0] = entry.mu
+        ids = np.flatnonzero(rows2)
+        block, cols = _normalized_rows(transposed, d_inv_sqrt, ids)
+        mu[ids] = block @ (hidden1[cols] @ w2)
+
+        entry.names, entry.features, entry.adj = arrays.names, features, adj
+        entry.hidden1, entry.mu = hidden1, mu
+        if entry.index is not None:
+            entry.index.update(ids, mu)
+        return mu
+
+    @property
+    def stats(self):
+        return {"full": self.full, "incremental": self.incremental, "resident": len(self._entries)}
+
+
+def _padded(adj, n):
+    # adj with empty rows and columns up to n nodes
+    adj = sp.csr_array(adj)
+    indptr = np.concatenate([adj.indptr, np.full(n - adj.shape[0], adj.indptr[-1], dtype=adj.indptr.dtype)])
+    return sp.csr_array((adj.data, adj.indices, indptr), shape=(n, n))
+
+
+def _readers(adj, mask):
+    # Nodes whose normalized adjacency row reads a node of `mask`: row i of (A + I)^T holds j
+    # where A[j, i] is set, i.e. i is j itself or one of its out-neighbours
+    readers = mask.copy()
+    readers[adj[np.flatnonzero(mask)].indices] = True
+    return readers
+
+
+def _normalized_rows(transposed, d_inv_sqrt, ids):
+    """
+    Rows `ids` of the normalized adjacency, as preprocess_graph builds it, restricted to the
+    columns they use: (block, cols) with block[:, k] the entries of column cols[k]
+    """
+    block = sp.csr_array(transposed[ids] + sp.csr_array((np.ones(len(ids)), (np.arange(len(ids)), ids)),
+                                                        shape=(len(ids), transposed.shape[1])))
+    block.sum_duplicates()
+    rows = np.repeat(np.arange(len(ids)), np.diff(block.indptr))
+    data = (block.data * d_inv_sqrt[ids][rows] * d_inv_sqrt[block.indices]).astype(np.float32)
+    cols = np.unique(block.indices)
+    return sp.csr_array((data, np.searchsorted(cols, block.indices), block.indptr),
+                        shape=(len(ids), len(cols))), cols
+
+
+embedding_cache = EmbeddingCache()
+
+
+if __name__ == "__main__":
+    # Usage: python -m src.models.embedding_cache [n_nodes] [n_edges]
+    # Encodes a graph, adds animals with a few edges and removes an edge (as Predict sees the
+    # graph after AddNode / AddEdge), then checks the refreshed embeddings against a full pass,
+    # both with the default fallback (which small dense graphs take) and forced partial refreshes.
+    import sys
+    import time
+    import networkx as nx
+
+    from src.models.gae import Encoder, Decoder, GraphAutoEncoder
+    from src.loaders.array_store import build_arrays
+
+    n_nodes = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    n_edges = int(sys.argv[2]) if len(sys.argv) > 2 else 200000
+    rng = np.random.RandomState(42)
+    for directed in [False, True]:
+        graph = nx.gnm_random_graph(n_nodes, n_edges, seed=42, directed=directed)
+        graph = nx.relabel_nodes(graph, {i: f"animal{i}" for i in graph})
+        for node in graph:
+            graph.nodes[node].update(sex=str(rng.choice(["f", "m"])), group=f"g{rng.randint(30)}",
+                                     age=float(rng.randint(1, 20)))
+        arrays = build_arrays(graph)
+        schema = arrays.schema
+        model = GraphAutoEncoder(Encoder(schema.n_features, hidden_dim1=32, hidden_dim2=16), Decoder())
+        model.eval()
+        cache, forced = EmbeddingCache(), EmbeddingCache(full_refresh_share=1.)
+        cache.embed(("colony", "v0"), model, arrays)
+        forced.embed(("colony", "v0"), model, arrays)
+
+        for i in range(3):
+            graph.add_node(f"new{i}", sex="f", group="g1", age=1.)
+            for other in rng.choice(n_nodes, 3, replace=False):
+                graph.add_edge(f"new{i}", f"animal{other}", weight=1.)
+        graph.remove_edge(*next(iter(graph.edges("animal4"))))
+        graph.nodes["animal5"]["age"] = 30.
+        arrays = build_arrays(graph, schema)
+
+        start = time.perf_counter()
+        mu = cache.embed(("colony", "v0"), model, arrays)
+        t_incremental = time.perf_counter() - start
+        start = time.perf_counter()
+        expected = EmbeddingCache().embed(("colony", "v0"), model, arrays)
+        t_full = time.perf_counter() - start
+        start = time.perf_counter()
+        mu_forced = forced.embed(("colony", "v0"), model, arrays)
+        t_forced = time.perf_counter() - start
+
+        assert np.allclose(mu, expected, rtol=1e-4, atol=1e-5), np.abs(mu - expected).max()
+        assert forced.stats["incremental"] == 1
+        assert np.allclose(mu_forced, expected, rtol=1e-4, atol=1e-5), np.abs(mu_forced - expected).max()
+        refresh = "k-hop refresh" if cache.stats["incremental"] else "fallback to a full pass"
+        print(f"{'directed' if directed else 'undirected'}: {n_nodes} nodes / {n_edges} edges")
+        print(f"full forward pass   {t_full * 1e3:7.1f}ms")
+        print(f"after the edits     {t_incremental * 1e3:7.1f}ms ({refresh}; "
+              f"full {cache.stats['full']}, incremental {cache.stats['incremental']})")
+        print(f"forced k-hop        {t_forced * 1e3:7.1f}ms")
@@ -8,6 +8,7 @@ import torch.nn as nn
 import torch.nn.functional as F
 from torch.nn.modules.module import Module
 from torch.nn.parameter import Parameter
+from torch.utils.checkpoint import checkpoint
 import torch.nn.modules.loss
 from torch import optim
 
@@ -18,12 +19,20 @@ from pathlib import Path
 
 import logging
 import json
-from src.utils.gae_utils import get_roc_score
+
+from src.utils.common import seed_torch
+from src.utils.gae_utils import get_roc_score, row_tiles, DECODER_MEMORY_BUDGET
+
+# torch is imported on the first model use, so it is seeded here rather than at startup
+seed_torch()
 
 
 def loss_function(preds, labels, mu, logvar, n_nodes, norm, pos_weight):
     cost = norm * F.binary_cross_entropy_with_logits(preds, labels, pos_weight=pos_weight)
+    return cost + kl_divergence(mu, logvar, n_nodes)
+
 
+def kl_divergence(mu, logvar, n_nodes):
     # see Appendix B from VAE paper:
     # Kingma and Welling. Auto-Encoding Variational Bayes. ICLR, 2014
     # https://arxiv.org/abs/1312.6114
@@ -31,7 +40,36 @@ def loss_function(preds, labels, mu, logvar, n_nodes, norm, pos_weight):
     logvar = torch.nn.functional.normalize(logvar, dim=1)
     KLD = (-0.5 / n_nodes *
            torch.mean(torch.sum(1 + 2 * logvar - mu.pow(2) - logvar.exp().pow(2), 1)))
-    return cost + KLD
+    return KLD
+
+
+def reconstruction_cost(decoder, z, labels, norm, pos_weight, budget=DECODER_MEMORY_BUDGET):
+    """
+    The reconstruction term of loss_function, computed one tile of decoder rows at a time.
+    `labels` is the (n_nodes, n_nodes) target, a scipy sparse matrix or a dense tensor. When
+    the scores do not fit in `budget` bytes, tiles are recomputed in the backward pass rather
+    than kept, so memory stays within a few tiles.
+    """
+    z = F.dropout(z, decoder.dropout, training=decoder.training)
+    n_nodes = z.shape[0]
+    tiles = row_tiles(n_nodes, n_nodes, budget, z.element_size())
+    cost = 0
+    for start, stop in tiles:
+        if torch.is_tensor(labels):
+            tile_labels = labels[start:stop].to(z.device)
+        else:
+            tile_labels = torch.from_numpy(labels[start:stop].toarray().astype(np.float32)).to(z.device)
+        if len(tiles) == 1:
+            cost = cost + _tile_cost(z, tile_labels, start, stop, decoder.act, pos_weight)
+        else:
+            cost = cost + checkpoint(_tile_cost, z, tile_labels, start, stop, decoder.act, pos_weight,
+                                     use_reentrant=False)
+    return norm * cost / (n_nodes * n_nodes)
+
+
+def _tile_cost(z, labels, start, stop, act, pos_weight):
+    preds = act(torch.mm(z[start:stop], z.t()))
+    return F.binary_cross_entropy_with_logits(preds, labels, pos_weight=pos_weight, reduction="sum")
 
 
 class GraphConvolution(Module):
@@ -89,11 +127,20 @@ class Decoder(nn.Module):
         self.dropout = dropout
         self.act = act
 
-    def forward(self, z):
+    def forward(self, z, pairs=None):
+        """Scores of every pair of nodes, or of the (i, j) rows of `pairs` only"""
         z = F.dropout(z, self.dropout, training=self.training)
+        if pairs is not None:
+            return self.act((z[pairs[:, 0]] * z[pairs[:, 1]]).sum(dim=1))
         adj = self.act(torch.mm(z, z.t()))
         return adj
 
+    def tiles(self, z, budget=DECODER_MEMORY_BUDGET):
+        """Scores of every pair of nodes, yielded as (start, stop, scores of rows start:stop)"""
+        z = F.dropout(z, self.dropout, training=self.training)
+        for start, stop in row_tiles(z.shape[0], z.shape[0], budget, z.element_size()):
+            yield start, stop, self.act(torch.mm(z[start:stop], z.t()))
+
 
 class GraphAutoEncoder(nn.Module):
 
@@ -163,20 +210,14 @@ class GraphAutoEncoder(nn.Module):
     ) -> np.ndarray:
         train_loader_feats = train_loader_feats.to(device)
         train_loader_adj_norm = train_loader_adj_norm.to(device)
-        adj_label = adj_label.to(device)
         pos_weight = pos_weight.to(device)
         self.train()
         optimizer.zero_grad()
-        recovered, mu, logvar = self.forward(train_loader_feats, train_loader_adj_norm)
-        loss = loss_function(
-            preds=recovered,
-            labels=adj_label,
-            mu=mu,
-            logvar=logvar,
-            n_nodes=n_nodes,
-            norm=norm,
-            pos_weight=pos_weight,
-        )
+        # As forward + loss_function, with the decoder scores computed tile by tile
+        mu, logvar = self.encoder(train_loader_feats, train_loader_adj_norm)
+        z = self.reparameterize(mu, logvar)
+        loss = (reconstruction_cost(self.decoder, z, adj_label, norm, pos_weight)
+                + kl_divergence(mu, logvar, n_nodes))
         loss.backward()
         cur_loss = loss.item()
         optimizer.step()
@@ -271,3 +312,48 @@ class GraphAutoEncoder(nn.Module):
         file_name = "{}_{}_{}.pt".format(model_name, animal, version)
         path_to_model = os.path.join(directory, file_name)
         torch.save(self.state_dict(), path_to_model)
+
+
+if __name__ == "__main__":
+    # Usage: python -m src.models.gae [n_nodes] [n_edges]
+    # Checks that the tiled reconstruction loss (with tiles recomputed in the backward pass)
+    # gives the loss and gradients of the dense decoder, and the pair scores its entries.
+    import sys
+    import time
+    import scipy.sparse as sp
+
+    n_nodes = int(sys.argv[1]) if len(sys.argv) > 1 else 3000
+    n_edges = int(sys.argv[2]) if len(sys.argv) > 2 else 30000
+    rng = np.random.RandomState(42)
+    rows, cols = rng.randint(n_nodes, size=(2, n_edges))
+    adj = sp.csr_matrix((np.ones(n_edges), (rows, cols)), shape=(n_nodes, n_nodes))
+    adj = ((adj + adj.T) > 0).astype(np.float32)
+    labels = sp.csr_matrix(adj + sp.eye(n_nodes))
+    pos_weight = torch.Tensor([(n_nodes * n_nodes - adj.sum()) / adj.sum()])
+    norm = n_nodes * n_nodes / float((n_nodes * n_nodes - adj.sum()) * 2)
+    decoder = Decoder()
+
+    results = {}
+    for mode, budget in [("dense", None), ("tiled", 4 * n_nodes * 64)]:
+        z = torch.randn(n_nodes, 16, generator=torch.Generator().manual_seed(0), requires_grad=True)
+        start = time.perf_counter()
+        if budget is None:
+            cost = norm * F.binary_cross_entropy_with_logits(
+                decoder(z), torch.FloatTensor(labels.toarray()), pos_weight=pos_weight)
+        else:
+            cost = reconstruction_cost(decoder, z, labels, norm, pos_weight, budget)
+        cost.backward()
+        results[mode] = (cost.item(), z.grad.clone(), time.perf_counter() - start)
+
+    (dense_cost, dense_grad, t_dense), (tiled_cost, tiled_grad, t_tiled) = results["dense"], results["tiled"]
+    assert np.isclose(dense_cost, tiled_cost, rtol=1e-5), (dense_cost, tiled_cost)
+    assert torch.allclose(dense_grad, tiled_grad, rtol=1e-4, atol=1e-8)
+    with torch.no_grad():
+        z = torch.randn(n_nodes, 16)
+        pairs = torch.from_numpy(np.stack([rows, cols], axis=1))
+        assert torch.allclose(decoder(z, pairs), decoder(z)[pairs[:, 0], pairs[:, 1]], atol=1e-6)
+        assert all(torch.allclose(scores, decoder(z)[start:stop], atol=1e-6)
+                   for start, stop, scores in decoder.tiles(z, 2 ** 20))
+    print(f"{n_nodes} nodes / {n_edges} edges")
+    print(f"dense loss + backward  {t_dense * 1e3:7.1f}ms, {n_nodes * n_nodes * 4 / 2 ** 20:.0f}MB of scores")
+    print(f"tiled loss + backward  {t_tiled * 1e3:7.1f}ms, tiles of 64 rows")
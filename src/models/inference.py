@@ -2,9 +2,13 @@ import os
 import torch
 import numpy as np
 from src.models.gae import Encoder, Decoder, GraphAutoEncoder
-from src.utils.gae_utils import preprocess_graph
+from src.utils.gae_utils import decode_rows, sigmoid, DECODER_MEMORY_BUDGET
+from src.models.ann_index import ANN_PROBES
 
-from src.loaders.asnr_dataloader import ASNRGraph
+from src.loaders.array_store import array_store
+from src.models.registry import model_registry
+from src.models.embedding_cache import embedding_cache
+from src.loaders.feature_schema import FeatureSchema, schema_path
 
 
 def load_model(path, feat_dim):
@@ -22,49 +26,95 @@ def load_model(path, feat_dim):
     return model
 
 
-def sigmoid(x):
-    return 1 / (1 + np.exp(-x))
-
-
-def get_pred_edges(graph, animal, version, new_name):
+# Probability from which a predicted edge is kept
+PRED_THRESHOLD = 0.5
+
+
+def score_edges(mu, query_ids, threshold=PRED_THRESHOLD, top_k=None, budget=DECODER_MEMORY_BUDGET,
+                index=None, n_probe=ANN_PROBES):
+    """
+    Edge candidates of the nodes `query_ids` from the node embeddings `mu`: per query node, the
+    ids of the other nodes with a probability of at least `threshold` (the `top_k` most likely
+    only, if given) and their probabilities, most likely first. Only the query rows of
+    mu @ mu.T are computed, `budget` bytes of them at a time; with an IVFIndex of `mu`, only
+    the nodes of the `n_probe` cells nearest to each query are scored.
+    """
+    candidates = []
+    for query_id, ids, logits in _scored_rows(mu, query_ids, budget, index, n_probe):
+        # Ranked on the inner products, the probabilities of the best ones all round to 1
+        probs = sigmoid(logits)
+        keep = (probs >= threshold) & (ids != query_id)  # no edge to the node itself
+        ids, logits, probs = ids[keep], logits[keep], probs[keep]
+        if top_k is not None and len(ids) > top_k:
+            best = np.argpartition(-logits, top_k - 1)[:top_k]
+            ids, logits, probs = ids[best], logits[best], probs[best]
+        order = np.argsort(-logits, kind="stable")
+        candidates.append((ids[order], probs[order]))
+    return candidates
+
+
+def _scored_rows(mu, query_ids, budget, index, n_probe):
+    # (query id, candidate ids, inner products) of each query node
+    if index is None:
+        all_ids = np.arange(len(mu))
+        for tile_ids, logits in decode_rows(mu, query_ids, budget, logits=True):
+            for query_id, row in zip(tile_ids, logits):
+                yield query_id, all_ids, row
+    else:
+        for query_id in query_ids:
+            ids = index.candidates(mu[query_id], n_probe)
+            yield query_id, ids, mu[ids] @ mu[query_id]
+
+
+def predict_edges(graph, animal, version, new_names, source=None, changes=None,
+                  threshold=PRED_THRESHOLD, top_k=None, n_probe=None):
+    """
+    Predicted edges of each node of `new_names`, as {name: (edges, probabilities)} with the
+    most likely edges first (see score_edges for `threshold` and `top_k`). The graph is embedded
+    once for all of them. `source` identifies the file the version was read from and `changes`
+    the edits made to it since (see Graph.changes_since_load): with them the model inputs come
+    from the array store instead of being encoded again. With `n_probe`, candidates are only
+    looked for in that many cells of the version's IVF index: faster on large graphs, at the
+    cost of missing some edges.
+
+    On undirected graphs an edge between two of the nodes is only listed for the first of
+    them; on directed graphs (X, Y) and (Y, X) are distinct edges and both are kept, as when
+    predicting for one node at a time.
+    """
     save_dir = os.getcwd().split("src")[0] + "/results/models/"
     file_name = "model_{}_{}.pt".format(animal, version)
     path_to_model = os.path.join(save_dir, file_name)
 
-    features, edgelist, adj, node_dict, _ = ASNRGraph(graph_obj=graph).preprocess()
-    n_nodes, feat_dim = features.shape
-    adj_norm = preprocess_graph(adj)
-    model = load_model(path_to_model, feat_dim)
+    # Models saved without a schema predate it; their features were fitted on the graph itself
+    schema = FeatureSchema.load(schema_path(save_dir, animal, version))
+    arrays = array_store.load(graph, animal, version, source, changes, schema)
+    n_nodes, feat_dim = arrays.features.shape
+    model = model_registry.get(animal, version, schema, feat_dim, path_to_model,
+                               lambda: load_model(path_to_model, feat_dim))
     model.eval()
 
-    device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
-    features = features.to(device)
-    adj_norm = adj_norm.to(device)
-    model.to(device)
-
-    _, mu, logvar = model(features, adj_norm)
-    mu = mu.data.cpu().numpy()
-    adj_rec = np.dot(mu, mu.T)
-
-    preds = torch.zeros(adj_rec.shape)
-    for i, row_val in enumerate(adj_rec):
-        for j, col_val in enumerate(adj_rec[i]):
-            preds[i][j] = sigmoid(adj_rec[i][j])
-
-    new_idx = 0
-    for node, data in graph.nodes(data=True):
-        if node == new_name:
-            new_idx = node_dict[node]
-            break
-
-    src_name = [name for name, node_id in node_dict.items() if node_id == new_idx][0]
-    new_edges = []
-    for i, (pred, true) in enumerate(zip(preds[new_idx], adj_norm[new_idx])):
-        if pred >= 0.5:
-            name = [name for name, node_id in node_dict.items() if node_id == i][0]
-
-            if name != src_name:
-                new_edges.append((src_name, name))
-        else:
-            pass
-    return new_edges
+    # Only the embeddings, refreshed around the edits since the last prediction on this version
+    mu = embedding_cache.embed((animal, version), model, arrays)
+
+    node_dict = arrays.node_dict
+    names = arrays.names
+    query_ids = [node_dict[new_name] for new_name in new_names]
+    index = embedding_cache.index((animal, version)) if n_probe is not None else None
+    candidates = score_edges(mu, query_ids, threshold, top_k, index=index, n_probe=n_probe)
+
+    # Scores are symmetric: an undirected edge between two of the nodes is kept for the first one only
+    queried = {}
+    pred_edges = {}
+    for new_name, query_id, (ids, probs) in zip(new_names, query_ids, candidates):
+        keep = np.array([queried.get(i, new_name) == new_name for i in ids.tolist()], dtype=bool)
+        pred_edges[new_name] = ([(new_name, name) for name in names[ids[keep]].tolist()],
+                                probs[keep].tolist())
+        if not arrays.directed:
+            queried.setdefault(query_id, new_name)
+    return pred_edges
+
+
+def get_pred_edges(graph, animal, version, new_name, source=None, changes=None):
+    """Predicted edges of node `new_name`, see predict_edges"""
+    edges, _ = predict_edges(graph, animal, version, [new_name], source, changes)[new_name]
+    return edges
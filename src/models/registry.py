@@ -0,0 +1,72 @@
+import os
+import logging
+from collections import OrderedDict
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger('model_registry')
+
+# Number of link prediction models kept loaded
+MODEL_CACHE_SIZE = 4
+
+
+class ModelRegistry:
+    """
+    Loaded link prediction models, least recently used evicted first.
+
+    Models are keyed by (animal, version, feature schema, feature count), the inputs a
+    checkpoint can serve, and are only reused while the checkpoint file keeps its mtime and
+    size. Training a version invalidates its entries.
+    """
+
+    def __init__(self, maxsize=MODEL_CACHE_SIZE):
+        self.maxsize = maxsize
+        self._models = OrderedDict()  # key -> (checkpoint token, model)
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, animal, version, schema, feat_dim, path, load):
+        """The model of `path` for these inputs, loaded with `load()` when not resident"""
+        key = (animal, version, schema.key if schema is not None else None, feat_dim)
+        token = _token(path)
+        cached = self._models.get(key)
+        if cached is not None and cached[0] == token:
+            self._models.move_to_end(key)
+            self.hits += 1
+            return cached[1]
+
+        self.misses += 1
+        model = load()
+        self._models[key] = (token, model)
+        self._models.move_to_end(key)
+        self._evict()
+        return model
+
+    def invalidate(self, animal, version=None):
+        """Forget the models of `animal` (of one version only if given)"""
+        for key in [key for key in self._models if key[0] == animal and version in (None, key[1])]:
+            del self._models[key]
+            logger.info(f"Dropped model {key[0]} {key[1]} from the registry")
+
+    def resize(self, maxsize):
+        self.maxsize = maxsize
+        self._evict()
+
+    def _evict(self):
+        while len(self._models) > max(self.maxsize, 0):
+            key, _ = self._models.popitem(last=False)
+            logger.info(f"Evicted model {key[0]} {key[1]} from the registry")
+
+    def __len__(self):
+        return len(self._models)
+
+    @property
+    def stats(self):
+        return {"hits": self.hits, "misses": self.misses, "resident": len(self._models)}
+
+
+def _token(path):
+    stat = os.stat(path)
+    return stat.st_mtime_ns, stat.st_size
+
+
+model_registry = ModelRegistry()
@@ -24,6 +24,9 @@ import scipy.sparse as sp
 
 from src.utils.gae_utils import mask_test_edges, preprocess_graph
 from src.models.gae import Encoder, Decoder, GraphAutoEncoder
+from src.loaders.feature_schema import schema_path
+from src.models.registry import model_registry
+from src.models.embedding_cache import embedding_cache
 
 device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
 n_epochs = 100
@@ -50,8 +53,8 @@ def get_preprocessed_adj(adj, features):
 
     # Some preprocessing
     adj_norm = preprocess_graph(adj)
-    adj_label = adj_train + sp.eye(adj_train.shape[0])
-    adj_label = torch.FloatTensor(adj_label.toarray())
+    # Kept sparse, the decoder loss densifies it one tile of rows at a time
+    adj_label = sp.csr_matrix(adj_train + sp.eye(adj_train.shape[0]))
     pos_weight = torch.Tensor([(adj.shape[0] * adj.shape[0] - adj.sum()) / adj.sum()])
     norm = (
         adj.shape[0]
@@ -72,7 +75,7 @@ def get_preprocessed_adj(adj, features):
     )
 
 
-def train_model(animal, version, features, edgelist, adj):
+def train_model(animal, version, features, edgelist, adj, schema=None):
     (
         adj_norm,
         adj_label,
@@ -112,11 +115,18 @@ def train_model(animal, version, features, edgelist, adj):
         save_dir,
         n_epochs,
     )
+    if schema is not None:
+        # Inference encodes nodes with the schema the model was trained on
+        schema.save(schema_path(save_dir, animal, version))
+    # The checkpoint of this version was just written, loaded models of it are outdated
+    model_registry.invalidate(animal, version)
+    embedding_cache.invalidate(animal, version)
 
 
 if __name__ == "__main__":
     from glob import glob
     from src.loaders.asnr_dataloader import ASNRGraph
+    from src.loaders.array_store import array_store, file_token
 
     argp = ArgumentParser()
     argp.add_argument("--seed", default=42, type=int)
@@ -130,8 +140,10 @@ if __name__ == "__main__":
           lines = f.readlines()
     for path in lines:
         path = path.replace("\n", "")       
-        features, edgelist, adj, _, _ = ASNRGraph(path=path).preprocess()
+        asnr = ASNRGraph(path=path)
         animal = path.split("/")[-2] #.split(".")[0]
-        train_model(animal, "default", features, edgelist, adj)
+        arrays = array_store.load(asnr.graph, animal, "default", file_token(path))
+        features, edgelist, adj, _, _ = asnr.preprocess(arrays=arrays)
+        train_model(animal, "default", features, edgelist, adj, asnr.schema)
         print("Animal trained for: ", animal)
    
@@ -0,0 +1,92 @@
+"""
+Usage :  python -m src.startup_benchmark [--top 15]
+
+Imports the app in the order a user reaches its parts and reports, per stage, the wall time
+and the import cost of every package (from `python -X importtime`). The landing page stage
+should not load any of the ML or analytics libraries.
+"""
+import os
+import sys
+import subprocess
+from argparse import ArgumentParser
+from collections import defaultdict
+
+# Libraries that must stay out of the landing page
+HEAVY = ["torch", "sklearn", "scipy", "pandas", "netgraph", "matplotlib", "networkx"]
+
+STAGES = [
+    ("landing page", ["src.gui.landing_page"]),
+    ("dashboard", ["src.gui.main_window"]),
+    ("analytics tab", ["src.gui.graph_analytics.graph_analytics"]),
+    ("prediction and training", ["src.models.inference", "src.models.train"]),
+]
+
+_CHILD = """
+import sys, time, importlib
+from PyQt6.QtWidgets import QApplication
+app = QApplication(sys.argv)
+for name, modules in {stages!r}:
+    print(f"#stage {{name}}", file=sys.stderr, flush=True)
+    start = time.perf_counter()
+    for module in modules:
+        importlib.import_module(module)
+    if name == "landing page":
+        from src.gui.landing_page import LandingPage
+        page = LandingPage()
+        page.show()
+        app.processEvents()
+    print(f"#time {{time.perf_counter() - start}}", file=sys.stderr, flush=True)
+"""
+
+
+def run_stages():
+    env = dict(os.environ)
+    if not env.get("DISPLAY") and sys.platform.startswith("linux"):
+        env.setdefault("QT_QPA_PLATFORM", "offscreen")
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", _CHILD.format(stages=STAGES)],
+                            env=env, capture_output=True, text=True)
+    if result.returncode != 0:
+        raise RuntimeError(result.stderr[-2000:])
+    return parse(result.stderr)
+
+
+def parse(stderr):
+    """[(stage, seconds, {module: (self us, cumulative us)})] from the importtime log"""
+    stages, current = [], None
+    for line in stderr.splitlines():
+        if line.startswith("#stage "):
+            current = [line[len("#stage "):], 0., {}]
+            stages.append(current)
+        elif line.startswith("#time ") and current is not None:
+            current[1] = float(line[len("#time "):])
+        elif line.startswith("import time:") and current is not None and "|" in line:
+            own, cumulative, module = line[len("import time:"):].split("|")
+            if own.strip().isdigit():
+                current[2][module.strip()] = (int(own), int(cumulative))
+    return stages
+
+
+def report(stages, top=15):
+    for name, seconds, modules in stages:
+        packages = defaultdict(int)
+        for module, (own, _) in modules.items():
+            packages[module.split(".")[0]] += own
+        loaded = [lib for lib in HEAVY if lib in packages]
+        print(f"\n=== {name}: {seconds * 1e3:.0f}ms, {len(modules)} modules imported")
+        print(f"    heavy libraries loaded: {', '.join(loaded) if loaded else 'none'}")
+        print(f"    {'package':<28} {'import time':>11}")
+        for package, own in sorted(packages.items(), key=lambda x: -x[1])[:top]:
+            print(f"    {package:<28} {own / 1e3:>9.1f}ms")
+    return stages
+
+
+if __name__ == "__main__":
+    argp = ArgumentParser()
+    argp.add_argument("--top", default=15, type=int)
+    args = argp.parse_args()
+
+    stages = report(run_stages(), args.top)
+    landing = [lib for lib in HEAVY if any(m.split(".")[0] == lib for m in stages[0][2])]
+    if landing:
+        print(f"\nThe landing page imports {', '.join(landing)}")
+        sys.exit(1)
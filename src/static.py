@@ -1,23 +1,7 @@
 import os
-import glob
-import pickle
-from collections import defaultdict
 
-import sys
-
-
-def parse_readme(path):
-    metadata = defaultdict(lambda: "n/a")
-    with open(path, "r") as file:
-        # Skip first 2 lines
-        for _ in range(2):
-            next(file)
-        for line in file:
-            data = line.split("|")
-            if len(data) == 2:
-                k, v = data
-                metadata[k.strip()] = v.strip()
-    return metadata
+from src.loaders.dataset_catalog import DatasetCatalog, parse_readme
+from src.loaders.version_manifest import version_manifest
 
 
 # ==================================================
@@ -32,33 +16,14 @@ MAIN_WINDOW_HEIGHT = 800
 MAIN_WINDOW_WIDTH = 1040
 
 GRAPH_VERSION_FOLDER = "./results/graphs/"
+CACHE_FOLDER = "./results/cache/"
 
-with open("datasets/final_datasets.txt") as f:
-    paths = [x.strip() for x in f.readlines()]
-
-GRAPH_DATA = defaultdict(dict)
-
-for path in paths:
-    category, name, _ = path.split("/")[3:]
-    metadata = parse_readme(glob.glob(os.path.join(*path.split("/")[:-1], "*.md"))[0])
-    GRAPH_DATA[category][name] = {
-        "path": path,
-        "title": "Placeholder " + name,
-        "metadata": metadata,
-    }
-
-GRAPH_DATA = dict(GRAPH_DATA)
-
-# Generated version table
-VERSIONS = {}
-for category in GRAPH_DATA.keys():
-    for animal in GRAPH_DATA[category].keys():
-        animal_folder = os.path.join(GRAPH_VERSION_FOLDER, animal)
-        VERSIONS[animal] = ["default"]
-        if os.path.isdir(animal_folder):
-            filenames = [x for x in os.listdir(animal_folder) if x.endswith(".pkl")]
-            filenames.sort()
-            VERSIONS[animal].extend([x[:-4] for x in filenames])  # removing .pkl
+# Datasets, their metadata and saved versions are resolved lazily, see DatasetCatalog
+CATALOG = DatasetCatalog("datasets/final_datasets.txt",
+                         GRAPH_VERSION_FOLDER,
+                         os.path.join(CACHE_FOLDER, "datasets_manifest.pkl"))
+GRAPH_DATA = CATALOG.graph_data  # category -> animal -> {"path", "title", "metadata"}
+VERSIONS = CATALOG.versions  # animal -> versions, "default" first
 
 # ==================================================
 # Variables
@@ -94,11 +59,11 @@ class PageState:
     def select_version(version):
         PageState.version = version
         PageState.version_path = os.path.join(GRAPH_VERSION_FOLDER, PageState.id, version + ".pkl")
-        if os.path.isfile(PageState.version_path):
-            with open(PageState.version_path, "rb") as f:
-                data = pickle.load(f)
-                PageState.prev_version = data['prev_version']
-                PageState.prev_path = data['prev_path']
+        # Lineage comes from the manifest of the animal, the version file is not read
+        entry = version_manifest(os.path.join(GRAPH_VERSION_FOLDER, PageState.id)).entry(version)
+        if entry is not None:
+            PageState.prev_version = entry['prev_version']
+            PageState.prev_path = entry['prev_path']
         else:
             PageState.prev_version = None
             PageState.prev_path = None
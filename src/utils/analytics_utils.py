@@ -68,3 +68,28 @@ def get_correlations_att_edge(graph, features):
 
 def get_correlation_att_att(graph, features):
     pass
+
+
+# Graph-level summary metrics, slow enough on larger graphs to be computed in the background
+
+def get_path_lengths(graph):
+    # Diameter and average shortest path length
+    try:
+        return nx.diameter(graph), round(nx.average_shortest_path_length(graph), 3)
+    except nx.NetworkXException:
+        return 'N/A', 'N/A'  # graph disconnected
+
+
+def get_average_eigenvector_centrality(graph):
+    try:
+        return round(sum(nx.eigenvector_centrality(graph).values()) / graph.number_of_nodes(), 3)
+    except nx.NetworkXException:
+        return 'Did not converge'
+
+
+def get_average_clustering(graph):
+    return round(nx.average_clustering(graph), 3)
+
+
+def get_average_pagerank(graph):
+    return round(sum(nx.pagerank(graph).values()) / graph.number_of_nodes(), 3)
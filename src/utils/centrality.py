@@ -0,0 +1,449 @@
+import logging
+import math
+import random
+import threading
+from collections import deque
+
+import networkx as nx
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger("centrality")
+
+# Above this many changed edges a full recompute is cheaper than patching
+MAX_INCREMENTAL_DELTA = 50
+# Fraction of sources whose shortest-path DAG may change before we give up patching
+MAX_AFFECTED_FRACTION = 0.5
+
+# Above this many nodes betweenness and closeness are estimated from sampled pivots
+APPROX_NODE_THRESHOLD = 1000
+APPROX_PIVOTS = 256
+APPROX_SEED = 42
+
+# Centralities shown per node, in display order
+CENTRALITY_METRICS = ["betweeness", "closeness", "degree"]
+
+
+def _bfs_distances(adj, source):
+    dist = {source: 0}
+    queue = deque([source])
+    while queue:
+        v = queue.popleft()
+        d = dist[v] + 1
+        for w in adj[v]:
+            if w not in dist:
+                dist[w] = d
+                queue.append(w)
+    return dist
+
+
+def _single_source_dependency(adj, source):
+    """Brandes' single-source pass: returns the dependency of every node on `source` and the distances."""
+    stack = []
+    pred = {source: []}
+    sigma = {source: 1.0}
+    dist = {source: 0}
+    queue = deque([source])
+    while queue:
+        v = queue.popleft()
+        stack.append(v)
+        d = dist[v] + 1
+        sigma_v = sigma[v]
+        for w in adj[v]:
+            if w not in dist:
+                dist[w] = d
+                sigma[w] = sigma_v
+                pred[w] = [v]
+                queue.append(w)
+            elif dist[w] == d:
+                sigma[w] += sigma_v
+                pred[w].append(v)
+
+    delta = dict.fromkeys(stack, 0.0)
+    while stack:
+        w = stack.pop()
+        coeff = (1.0 + delta[w]) / sigma[w]
+        for v in pred[w]:
+            delta[v] += sigma[v] * coeff
+    del delta[source]
+    return delta, dist
+
+
+def use_approximation(graph, approximate=None):
+    """`approximate` forces the mode; None picks it from the graph size."""
+    if approximate is None:
+        return graph.number_of_nodes() > APPROX_NODE_THRESHOLD
+    return approximate
+
+
+def approximate_centrality(graph, k=APPROX_PIVOTS, seed=APPROX_SEED):
+    """
+    Betweenness (Brandes & Pich) and closeness (Eppstein & Wang) estimated from k sampled pivots.
+    Returns the estimates and, per metric, the widest 95% confidence half-width over all nodes.
+    """
+    nodes = list(graph.nodes)
+    n = len(nodes)
+    k = min(k, n)
+    if graph.is_directed():
+        adj = {node: set(graph.successors(node)) - {node} for node in nodes}
+    else:
+        adj = {node: set(graph[node]) - {node} for node in nodes}
+    pivots = random.Random(seed).sample(nodes, k)
+    pivot_set = set(pivots)
+
+    bc_sum, bc_sq = dict.fromkeys(nodes, 0.0), dict.fromkeys(nodes, 0.0)
+    dist_sum, dist_sq, hits = dict.fromkeys(nodes, 0), dict.fromkeys(nodes, 0), dict.fromkeys(nodes, 0)
+    for source in pivots:
+        delta, dist = _single_source_dependency(adj, source)
+        for node, value in delta.items():
+            bc_sum[node] += value
+            bc_sq[node] += value * value
+        for node, d in dist.items():
+            if node != source:
+                dist_sum[node] += d
+                dist_sq[node] += d * d
+                hits[node] += 1
+
+    # Finite population correction, so sampling every node reports no error
+    fpc = math.sqrt((n - k) / (n - 1)) if n > 1 else 0.
+    z = 1.96
+
+    scale = 1 / ((n - 1) * (n - 2)) if n > 2 else 0.
+    betweenness, bc_error = {}, 0.
+    for node in nodes:
+        mean = bc_sum[node] / k
+        std = math.sqrt(max(bc_sq[node] / k - mean * mean, 0.))
+        betweenness[node] = n * mean * scale
+        bc_error = max(bc_error, z * n * std / math.sqrt(k) * fpc * scale)
+
+    closeness, cl_error = {}, 0.
+    for node in nodes:
+        if hits[node] == 0:
+            # No pivot reaches this node (tiny component): cheap to do exactly, with the
+            # incoming distances networkx uses on directed graphs, like the pivots measure
+            closeness[node] = nx.closeness_centrality(graph, u=node) if n > 1 else 0.
+            continue
+        n_pivots = k - (node in pivot_set)
+        mean = dist_sum[node] / hits[node]
+        std = math.sqrt(max(dist_sq[node] / hits[node] - mean * mean, 0.))
+        closeness[node] = hits[node] / n_pivots / mean
+        cl_error = max(cl_error, z * closeness[node] * std / mean / math.sqrt(hits[node]) * fpc)
+
+    return {"betweeness": betweenness, "closeness": closeness}, {"betweeness": bc_error, "closeness": cl_error}
+
+
+def compute_centrality(graph, approximate=None):
+    """
+    Node centralities shown across the app, exact or sampled depending on `approximate`.
+    Returns the centralities and the error estimates (None when exact).
+    """
+    if use_approximation(graph, approximate):
+        centrality, error = approximate_centrality(graph)
+    else:
+        centrality = {
+            "betweeness": nx.betweenness_centrality(graph),
+            "closeness": nx.closeness_centrality(graph),
+            # "eigenvector": nx.eigenvector_centrality(g), # NOTE: Some graphs in the dataset don't converge and cause an error
+        }
+        error = None
+    centrality["degree"] = nx.degree_centrality(graph)
+    return centrality, error
+
+
+class DynamicCentrality:
+    """
+    Betweenness and closeness centrality of an undirected graph, kept up to date
+    by re-running only the sources whose shortest-path DAG is touched by an edge change.
+
+    Values are kept unnormalised (betweenness sums, reachable counts and distance sums)
+    and normalised on read, exactly like networkx does.
+    """
+
+    def __init__(self, graph: nx.Graph = None, max_delta=MAX_INCREMENTAL_DELTA, max_affected=MAX_AFFECTED_FRACTION):
+        self.max_delta = max_delta
+        self.max_affected = max_affected
+        self.lock = threading.Lock()
+        self.version = None  # Graph version the state reflects, see sync()
+        self.n_full = 0
+        self.n_incremental = 0
+        if graph is not None:
+            self.recompute(graph)
+
+    # =====================================================
+    # Results
+    # =====================================================
+
+    @property
+    def betweenness(self) -> dict:
+        if self.directed:
+            return self._nx_betweenness
+        n = len(self.adj)
+        scale = 1 / ((n - 1) * (n - 2)) if n > 2 else 1.
+        return {node: value * scale for node, value in self._betweenness.items()}
+
+    @property
+    def closeness(self) -> dict:
+        if self.directed:
+            return self._nx_closeness
+        n = len(self.adj)
+        closeness = {}
+        for node, (reach, total) in self._closeness.items():
+            value = 0.0
+            if total > 0 and n > 1:
+                value = (reach - 1.0) / total * (reach - 1.0) / (n - 1)
+            closeness[node] = value
+        return closeness
+
+    # =====================================================
+    # Full and incremental computation
+    # =====================================================
+
+    def sync(self, graph: nx.Graph, version, changelog: list):
+        """
+        Bring the state to `version` of `graph` and return (betweenness, closeness).
+        `changelog` holds the (version, change) pairs of the most recent mutations; the state is
+        patched with the ones it has not seen yet, or recomputed if the log does not reach back.
+        Safe to call from worker threads.
+        """
+        with self.lock:
+            if self.version != version:
+                pending = [(v, change) for v, change in changelog
+                           if self.version is not None and self.version < v <= version]
+                covered = (len(pending) > 0 and pending[0][0] == self.version + 1 and
+                           pending[-1][0] == version)
+                if covered:
+                    self.update(graph, [change for _, change in pending])
+                else:
+                    self.recompute(graph)
+                self.version = version
+            return self.betweenness, self.closeness
+
+    def recompute(self, graph: nx.Graph):
+        self.directed = graph.is_directed()
+        self.n_full += 1
+        if self.directed:
+            # Incremental updates are only implemented for undirected graphs
+            self.adj = None
+            self._nx_betweenness = nx.betweenness_centrality(graph)
+            self._nx_closeness = nx.closeness_centrality(graph)
+            return
+
+        self.adj = {node: set(graph[node]) - {node} for node in graph.nodes}
+        self._betweenness = dict.fromkeys(self.adj, 0.0)
+        self._closeness = {}
+        for source in self.adj:
+            self._add_source(source)
+
+    def update(self, graph: nx.Graph, changes: list):
+        """
+        Bring the centralities in line with `graph`, given the list of changes applied
+        to it since the last update. Each change is a dict with (optional) keys
+        'added_nodes', 'removed_nodes', 'added_edges' and 'removed_edges'.
+        """
+        n_edges = sum(len(c.get("added_edges", ())) + len(c.get("removed_edges", ())) for c in changes)
+        if self.directed or n_edges > self.max_delta:
+            self.recompute(graph)
+            return
+
+        try:
+            for change in changes:
+                for node in change.get("added_nodes", ()):
+                    self._add_node(node)
+                for u, v in change.get("added_edges", ()):
+                    self._add_node(u)
+                    self._add_node(v)
+                    self._change_edge(u, v, add=True)
+                for u, v in change.get("removed_edges", ()):
+                    self._change_edge(u, v, add=False)
+                for node in change.get("removed_nodes", ()):
+                    self._remove_node(node)
+        except (_TooManyAffected, KeyError):
+            logger.info("Edge delta cannot be applied incrementally, recomputing centralities.")
+            self.recompute(graph)
+            return
+
+        # Self-loops are not kept in self.adj, they change no shortest path
+        n_edges = graph.number_of_edges() - nx.number_of_selfloops(graph)
+        if len(self.adj) != graph.number_of_nodes() or self._n_edges() != n_edges:
+            logger.warning("Centrality state went out of sync with the graph, recomputing.")
+            self.recompute(graph)
+
+    def _n_edges(self):
+        return sum(len(nbrs) for nbrs in self.adj.values()) // 2
+
+    def _add_source(self, source):
+        delta, dist = _single_source_dependency(self.adj, source)
+        for node, value in delta.items():
+            self._betweenness[node] += value
+        self._closeness[source] = (len(dist), sum(dist.values()))
+
+    def _remove_source(self, source):
+        delta, _ = _single_source_dependency(self.adj, source)
+        for node, value in delta.items():
+            self._betweenness[node] -= value
+
+    def _add_node(self, node):
+        if node not in self.adj:
+            self.adj[node] = set()
+            self._betweenness[node] = 0.0
+            self._closeness[node] = (1, 0)
+
+    def _remove_node(self, node):
+        if node in self.adj:
+            # Incident edges are listed in 'removed_edges', so the node is isolated by now
+            for nbr in list(self.adj[node]):
+                self._change_edge(node, nbr, add=False)
+            del self.adj[node]
+            del self._betweenness[node]
+            del self._closeness[node]
+
+    def _change_edge(self, u, v, add):
+        if u == v or (v in self.adj[u]) == add:
+            return
+
+        # Attaching or detaching a leaf only adds or drops the paths that run through its neighbour
+        if len(self.adj[v] - {u}) == 0:
+            self._change_pendant(v, u, add)
+            return
+        if len(self.adj[u] - {v}) == 0:
+            self._change_pendant(u, v, add)
+            return
+
+        # A source is affected iff the edge lies on one of its shortest paths,
+        # i.e. iff its endpoints are at different distances without the edge.
+        if not add:
+            self.adj[u].discard(v)
+            self.adj[v].discard(u)
+        dist_u = _bfs_distances(self.adj, u)
+        dist_v = _bfs_distances(self.adj, v)
+        if not add:
+            self.adj[u].add(v)
+            self.adj[v].add(u)
+        affected = [s for s in self.adj if dist_u.get(s) != dist_v.get(s)]
+        if len(affected) > self.max_affected * len(self.adj):
+            raise _TooManyAffected()
+
+        for source in affected:
+            self._remove_source(source)
+        if add:
+            self.adj[u].add(v)
+            self.adj[v].add(u)
+        else:
+            self.adj[u].discard(v)
+            self.adj[v].discard(u)
+        for source in affected:
+            self._add_source(source)
+        self.n_incremental += 1
+
+    def _change_pendant(self, leaf, anchor, add):
+        if not add:
+            self.adj[leaf].discard(anchor)
+            self.adj[anchor].discard(leaf)
+
+        # Every new (s, leaf) pair follows the s -> anchor paths, so the betweenness gain
+        # is twice the single-source dependency of the anchor's component on the anchor.
+        sign = 1 if add else -1
+        delta, dist = _single_source_dependency(self.adj, anchor)
+        for node, value in delta.items():
+            self._betweenness[node] += sign * 2 * value
+        self._betweenness[anchor] += sign * 2 * (len(dist) - 1)
+        for node, d in dist.items():
+            reach, total = self._closeness[node]
+            self._closeness[node] = (reach + sign, total + sign * (d + 1))
+        self._closeness[leaf] = (len(dist) + 1, sum(dist.values()) + len(dist)) if add else (1, 0)
+
+        if add:
+            self.adj[leaf].add(anchor)
+            self.adj[anchor].add(leaf)
+        self.n_incremental += 1
+
+
+class _TooManyAffected(Exception):
+    pass
+
+
+if __name__ == "__main__":
+    # Usage: python -m src.utils.centrality
+    # Checks incremental updates against a full networkx recompute and times both, then the
+    # sampled estimates with every node as a pivot against networkx.
+    import random
+    import time
+
+    rng = random.Random(42)
+    graph = nx.connected_watts_strogatz_graph(1000, 6, 0.05, seed=42)
+    engine = DynamicCentrality(graph)
+
+    for step in range(6):
+        if step % 2 == 0:
+            # New animal attached to the network, as done by AddNode + AddEdge
+            node, anchor = f"new_node#{step}", rng.choice(list(graph.nodes))
+            graph.add_edge(node, anchor)
+            changes = [{"added_nodes": [node]}, {"added_edges": [(node, anchor)]}]
+        else:
+            u, v = rng.sample(list(graph.nodes), 2)
+            if graph.has_edge(u, v):
+                graph.remove_edge(u, v)
+                changes = [{"removed_edges": [(u, v)]}]
+            else:
+                graph.add_edge(u, v)
+                changes = [{"added_edges": [(u, v)]}]
+
+        start = time.perf_counter()
+        engine.update(graph, changes)
+        incremental = engine.betweenness, engine.closeness
+        t_incremental = time.perf_counter() - start
+
+        start = time.perf_counter()
+        full = nx.betweenness_centrality(graph), nx.closeness_centrality(graph)
+        t_full = time.perf_counter() - start
+
+        for ours, theirs in zip(incremental, full):
+            assert max(abs(ours[node] - theirs[node]) for node in graph) < 1e-9
+        print(f"step {step}: incremental {t_incremental:.3f}s, full {t_full:.3f}s")
+
+    # A graph with a self-loop stays on the incremental path
+    recomputed = []
+    engine.recompute = recomputed.append
+    graph.add_edge(anchor, anchor)
+    engine.update(graph, [{"added_edges": [(anchor, anchor)]}])
+    graph.add_edge("new_node#leaf", anchor)
+    engine.update(graph, [{"added_nodes": ["new_node#leaf"]}, {"added_edges": [("new_node#leaf", anchor)]}])
+    assert not recomputed
+    assert max(abs(engine.betweenness[node] - value)
+               for node, value in nx.betweenness_centrality(graph).items()) < 1e-9
+
+    # Edits between inner nodes of a sparse forest, patched through the affected sources'
+    # shortest-path DAGs, which the default max_affected mostly leaves to recompute()
+    forest = nx.Graph([(i, rng.randrange(i)) for i in range(1, 150)] +
+                      [(150 + i, 150 + rng.randrange(i)) for i in range(1, 100)])
+    engine = DynamicCentrality(forest, max_affected=1.0)
+    recomputed = []
+    engine.recompute = recomputed.append
+    for step in range(20):
+        inner = [node for node in forest if forest.degree(node) > 1]
+        if step % 2 == 0:
+            u, v = rng.sample(inner, 2)
+            while forest.has_edge(u, v):
+                u, v = rng.sample(inner, 2)
+            forest.add_edge(u, v)
+            change = {"added_edges": [(u, v)]}
+        else:
+            u, v = rng.choice([(u, v) for u, v in forest.edges if forest.degree(u) > 1 and forest.degree(v) > 1])
+            forest.remove_edge(u, v)
+            change = {"removed_edges": [(u, v)]}
+        n_incremental = engine.n_incremental
+        engine.update(forest, [change])
+        assert engine.n_incremental == n_incremental + 1
+        for ours, theirs in [(engine.betweenness, nx.betweenness_centrality(forest)),
+                             (engine.closeness, nx.closeness_centrality(forest))]:
+            assert max(abs(ours[node] - theirs[node]) for node in forest) < 1e-9, step
+    assert not recomputed
+
+    # Every node a pivot: the estimates are exact, on directed graphs too (sources nothing
+    # reaches have no incoming distance, so a closeness of 0)
+    star = nx.DiGraph([(f"s{i}", "h") for i in range(50)] + [("h", "a"), ("a", "b"), ("b", "c")])
+    for g in [star, nx.gnp_random_graph(200, 0.02, seed=42, directed=True), graph]:
+        estimates, errors = approximate_centrality(g, k=len(g))
+        exact = {"betweeness": nx.betweenness_centrality(g), "closeness": nx.closeness_centrality(g)}
+        for metric, values in exact.items():
+            assert errors[metric] == 0.
+            assert max(abs(estimates[metric][node] - value) for node, value in values.items()) < 1e-9, metric
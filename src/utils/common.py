@@ -1,8 +1,9 @@
-import random, os
+import random, os, sys
 import numpy as np
-import torch
 import pickle
 
+_seed = None
+
 
 def swap_dict_keys(dict_sample):
     d = {}
@@ -17,9 +18,21 @@ def swap_dict_keys(dict_sample):
 
 
 def seed_everything(seed: int):
+    global _seed
+    _seed = seed
     random.seed(seed)
     os.environ['PYTHONHASHSEED'] = str(seed)
     np.random.seed(seed)
+    # torch is only imported once a model is used (src.models.gae seeds it then)
+    if "torch" in sys.modules:
+        seed_torch()
+
+
+def seed_torch():
+    if _seed is None:
+        return
+    import torch
+    seed = _seed
     torch.manual_seed(seed)
     torch.cuda.manual_seed(seed)
     torch.backends.cudnn.deterministic = True
@@ -0,0 +1,155 @@
+import numpy as np
+import networkx as nx
+
+
+class CSRGraph:
+    """
+    Compact, read-only compressed sparse row view of a networkx graph.
+
+    Nodes are numbered 0..n-1 in the order of `graph.nodes`. Undirected graphs store
+    every edge in both rows, directed graphs store out-edges only. Rows are sorted,
+    which makes (row * n + col) a sorted key array for vectorized membership tests.
+    """
+
+    def __init__(self, names, indptr, indices, weights, directed=False, self_loops=None):
+        self.names = list(names)
+        self.name_to_id = {name: i for i, name in enumerate(self.names)}
+        self.indptr = indptr
+        self.indices = indices
+        self.weights = weights
+        self.directed = directed
+        self.self_loops = self_loops if self_loops is not None else np.zeros(len(self.names), dtype=np.int32)
+        self._keys = None
+
+    @classmethod
+    def from_networkx(cls, graph: nx.Graph, weight="weight"):
+        names = list(graph.nodes)
+        name_to_id = {name: i for i, name in enumerate(names)}
+        n = len(names)
+
+        edges = list(graph.edges(data=weight, default=1.))
+        src = np.fromiter((name_to_id[u] for u, _, _ in edges), dtype=np.int32, count=len(edges))
+        dst = np.fromiter((name_to_id[v] for _, v, _ in edges), dtype=np.int32, count=len(edges))
+        wgt = np.fromiter((_as_float(w) for _, _, w in edges), dtype=np.float32, count=len(edges))
+
+        self_loops = np.zeros(n, dtype=np.int32)
+        directed = graph.is_directed()
+        if not directed:
+            loops = src == dst
+            np.add.at(self_loops, src[loops], 1)
+            back = ~loops
+            src, dst, wgt = (np.concatenate([src, dst[back]]),
+                             np.concatenate([dst, src[back]]),
+                             np.concatenate([wgt, wgt[back]]))
+
+        order = np.lexsort((dst, src))
+        src, dst, wgt = src[order], dst[order], wgt[order]
+        indptr = np.zeros(n + 1, dtype=np.int32)
+        np.cumsum(np.bincount(src, minlength=n), out=indptr[1:])
+        return cls(names, indptr, dst, wgt, directed=directed, self_loops=self_loops)
+
+    # =====================================================
+    # Sizes
+    # =====================================================
+
+    @property
+    def n_nodes(self):
+        return len(self.names)
+
+    @property
+    def n_edges(self):
+        n_entries = len(self.indices)
+        if self.directed:
+            return n_entries
+        return (n_entries + int(self.self_loops.sum())) // 2
+
+    @property
+    def nbytes(self):
+        return self.indptr.nbytes + self.indices.nbytes + self.weights.nbytes + self.self_loops.nbytes
+
+    # =====================================================
+    # Queries
+    # =====================================================
+
+    def ids(self, names):
+        """Vectorized name -> id lookup, -1 for unknown names"""
+        return np.fromiter((self.name_to_id.get(name, -1) for name in names), dtype=np.int32)
+
+    @property
+    def degrees(self):
+        """Degrees in node order, counted like networkx (self-loops twice, in + out when directed)"""
+        degrees = np.diff(self.indptr)
+        if self.directed:
+            return degrees + np.bincount(self.indices, minlength=self.n_nodes).astype(np.int32)
+        return degrees + self.self_loops
+
+    def neighbors(self, node_id):
+        return self.indices[self.indptr[node_id]:self.indptr[node_id + 1]]
+
+    def edge_weights(self, node_id):
+        return self.weights[self.indptr[node_id]:self.indptr[node_id + 1]]
+
+    @property
+    def rows(self):
+        """Row id of every stored entry, aligned with `indices`"""
+        return np.repeat(np.arange(self.n_nodes, dtype=np.int32), np.diff(self.indptr))
+
+    @property
+    def keys(self):
+        if self._keys is None:
+            self._keys = self.rows.astype(np.int64) * self.n_nodes + self.indices
+        return self._keys
+
+    def has_edges(self, src_ids, dst_ids):
+        """Vectorized edge membership for id arrays; unknown ids (-1) are never edges"""
+        src_ids = np.asarray(src_ids, dtype=np.int64)
+        dst_ids = np.asarray(dst_ids, dtype=np.int64)
+        valid = (src_ids >= 0) & (dst_ids >= 0)
+        if len(self.keys) == 0:
+            return np.zeros(len(valid), dtype=bool)
+        query = np.where(valid, src_ids * self.n_nodes + dst_ids, -1)
+        pos = np.minimum(np.searchsorted(self.keys, query), len(self.keys) - 1)
+        return valid & (self.keys[pos] == query)
+
+    def edge_array(self):
+        """(m, 2) array of edges, each undirected edge once with the lower id first"""
+        rows, cols = self.rows, self.indices
+        if not self.directed:
+            keep = rows <= cols
+            rows, cols = rows[keep], cols[keep]
+        return np.stack([rows, cols], axis=1)
+
+
+def _as_float(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return 1.
+
+
+if __name__ == "__main__":
+    # Usage: python -m src.utils.csr_graph
+    # Compares the memory held per edge by networkx and by the CSR arrays.
+    import sys
+    import time
+
+    def deep_size(obj, seen=None):
+        seen = set() if seen is None else seen
+        if id(obj) in seen:
+            return 0
+        seen.add(id(obj))
+        size = sys.getsizeof(obj)
+        if isinstance(obj, dict):
+            size += sum(deep_size(k, seen) + deep_size(v, seen) for k, v in obj.items())
+        return size
+
+    graph = nx.gnm_random_graph(20000, 100000, seed=42)
+    nx.set_edge_attributes(graph, 1., "weight")
+
+    start = time.perf_counter()
+    csr = CSRGraph.from_networkx(graph)
+    print(f"Built CSR in {time.perf_counter() - start:.3f}s")
+
+    nx_bytes = deep_size(graph._adj)
+    print(f"networkx adjacency: {nx_bytes / graph.number_of_edges():.1f} bytes/edge")
+    print(f"CSR arrays:         {csr.nbytes / csr.n_edges:.1f} bytes/edge")
@@ -0,0 +1,226 @@
+import networkx as nx
+
+
+class DegreeIndex:
+    """
+    Degree of every node and a histogram of how many nodes have each degree, updated in
+    O(1) per edge or node change. Min, max, mean and median are read in O(1): the sum of
+    degrees is kept, and min, max and the median bucket are pointers into the histogram.
+    Every edge change moves a degree by one, so each pointer moves by about one bucket.
+
+    Degrees are counted like networkx: self-loops twice, in + out for directed graphs.
+    """
+
+    def __init__(self, graph: nx.Graph = None, directed=None):
+        self.directed = graph.is_directed() if directed is None and graph is not None else bool(directed)
+        self.degree = {}
+        self.counts = [0]  # counts[d]: number of nodes with degree d
+        self.n = 0
+        self.total = 0
+        self._min = 0
+        self._max = 0
+        self._median = 0  # degree bucket holding the lower median
+        self._below = 0  # number of nodes with a degree below self._median
+        if graph is not None:
+            for node, degree in graph.degree():
+                self.degree[node] = degree
+                self._insert(degree)
+
+    # =====================================================
+    # Statistics
+    # =====================================================
+
+    @property
+    def min(self):
+        return self._min
+
+    @property
+    def max(self):
+        return self._max
+
+    @property
+    def mean(self):
+        return self.total / self.n if self.n else 0.
+
+    @property
+    def median(self):
+        if self.n == 0:
+            return 0.
+        upper = self._median
+        if self.n % 2 == 0 and self.n // 2 >= self._below + self.counts[upper]:
+            upper += 1
+            while self.counts[upper] == 0:
+                upper += 1
+        return (self._median + upper) / 2
+
+    def __getitem__(self, node):
+        return self.degree[node]
+
+    # =====================================================
+    # Updates
+    # =====================================================
+
+    def apply(self, change: dict):
+        """
+        Apply a change dict as recorded by Graph (added/removed nodes and edges). An edge listed
+        twice in a change, or in both orientations for an undirected graph, changed once.
+        """
+        for node in change.get("added_nodes", ()):
+            self.add_node(node)
+        for u, v in self._distinct(change.get("added_edges", ())):
+            self.add_edge(u, v)
+        for u, v in self._distinct(change.get("removed_edges", ())):
+            self.remove_edge(u, v)
+        for node in change.get("removed_nodes", ()):
+            self.remove_node(node)
+
+    def _distinct(self, edges):
+        seen = set()
+        for u, v in edges:
+            key = (u, v) if self.directed else frozenset((u, v))
+            if key not in seen:
+                seen.add(key)
+                yield u, v
+
+    def add_node(self, node):
+        if node not in self.degree:
+            self.degree[node] = 0
+            self._insert(0)
+
+    def remove_node(self, node):
+        # Its edges are expected to be removed first, like Graph records them
+        self._remove(self.degree.pop(node))
+
+    def add_edge(self, u, v):
+        self.add_node(u)
+        self.add_node(v)
+        self._shift(u, 1)
+        self._shift(v, 1)
+
+    def remove_edge(self, u, v):
+        self._shift(u, -1)
+        self._shift(v, -1)
+
+    def _shift(self, node, delta):
+        degree = self.degree[node]
+        self.degree[node] = degree + delta
+        self._remove(degree)
+        self._insert(degree + delta)
+
+    def _insert(self, degree):
+        if degree >= len(self.counts):
+            self.counts.extend([0] * (degree + 1 - len(self.counts)))
+        self.counts[degree] += 1
+        self.n += 1
+        self.total += degree
+        if self.n == 1:
+            self._min = self._max = degree
+        else:
+            self._min = min(self._min, degree)
+            self._max = max(self._max, degree)
+        if degree < self._median:
+            self._below += 1
+        self._rebalance()
+
+    def _remove(self, degree):
+        self.counts[degree] -= 1
+        self.n -= 1
+        self.total -= degree
+        if degree < self._median:
+            self._below -= 1
+        if self.n == 0:
+            self._min = self._max = 0
+        else:
+            while self.counts[self._min] == 0:
+                self._min += 1
+            while self.counts[self._max] == 0:
+                self._max -= 1
+        self._rebalance()
+
+    def _rebalance(self):
+        # Move the median pointer until it holds the node of rank (n - 1) // 2
+        if self.n == 0:
+            self._median = self._below = 0
+            return
+        rank = (self.n - 1) // 2
+        while rank < self._below:
+            self._median -= 1
+            self._below -= self.counts[self._median]
+        while rank >= self._below + self.counts[self._median]:
+            self._below += self.counts[self._median]
+            self._median += 1
+
+
+if __name__ == "__main__":
+    # Usage: python -m src.utils.degree_index
+    # Checks the index against networkx under random edits and times the degree statistics
+    # as read on every page refresh (min, max, mean, median) against rebuilding them.
+    import random
+    import time
+
+    import numpy as np
+
+    rng = random.Random(42)
+    graph = nx.gnm_random_graph(20000, 100000, seed=42)
+    index = DegreeIndex(graph)
+
+    for step in range(20000):
+        op = rng.random()
+        u, v = rng.randrange(20000), rng.randrange(20000)
+        if op < 0.4:
+            if u in graph and v in graph and not graph.has_edge(u, v):
+                graph.add_edge(u, v)
+                index.add_edge(u, v)
+        elif op < 0.8:
+            if u in graph and len(graph[u]) > 0:
+                v = next(iter(graph[u]))
+                graph.remove_edge(u, v)
+                index.remove_edge(u, v)
+        elif op < 0.9:
+            graph.add_node(f"new_node#{step}")
+            index.add_node(f"new_node#{step}")
+        elif u in graph:
+            for edge in list(graph.edges(u)):
+                index.remove_edge(*edge)
+            graph.remove_node(u)
+            index.remove_node(u)
+
+    # A batch of edges listed twice and in both orientations, as Graph records it, and undone
+    from src.graph import Graph
+    wrapper = Graph(nx.gnm_random_graph(100, 300, seed=1))
+    wrapper.add_nodes([("new1", {})])
+    batch = [("new1", 7), (7, "new1"), ("new1", 8), ("new1", 8)]
+    wrapper.add_edges(batch)
+    assert wrapper._degree_index.degree == dict(wrapper.graph.degree())
+    wrapper.selected_directed_edges = batch
+    wrapper.remove_edges(batch)
+    assert wrapper._degree_index.degree == dict(wrapper.graph.degree())
+    assert len(list(index._distinct([(1, 2), (2, 1), (1, 2)]))) == 1
+    assert len(list(DegreeIndex(directed=True)._distinct([(1, 2), (2, 1), (1, 2)]))) == 2
+
+    degrees = np.array([d for _, d in graph.degree()])
+    assert index.degree == dict(graph.degree())
+    assert (index.min, index.max) == (degrees.min(), degrees.max())
+    assert abs(index.mean - degrees.mean()) < 1e-9 and index.median == np.median(degrees)
+
+    start = time.perf_counter()
+    for _ in range(100):
+        degrees = dict(graph.degree())
+        values = list(degrees.values())
+        min(values), max(values), sum(values) / len(values), np.median(values)
+    t_rebuild = (time.perf_counter() - start) / 100
+
+    start = time.perf_counter()
+    for _ in range(100):
+        index.min, index.max, index.mean, index.median
+    t_index = (time.perf_counter() - start) / 100
+
+    start = time.perf_counter()
+    for u, v in list(graph.edges)[:10000]:
+        index.remove_edge(u, v)
+        index.add_edge(u, v)
+    t_update = (time.perf_counter() - start) / 20000
+
+    print(f"Statistics from dict(graph.degree()): {t_rebuild * 1e3:.2f}ms")
+    print(f"Statistics from the index:            {t_index * 1e6:.2f}us")
+    print(f"Index update per edge change:         {t_update * 1e6:.2f}us")
@@ -11,7 +11,7 @@ def mask_test_edges(adj):
     adj = adj - sp.dia_matrix((adj.diagonal()[np.newaxis, :], [0]), shape=adj.shape)
     adj.eliminate_zeros()
     # Check that diag is zero:
-    assert np.diag(adj.todense()).sum() == 0
+    assert adj.diagonal().sum() == 0
 
     adj_triu = sp.triu(adj)
     adj_tuple = sparse_to_tuple(adj_triu)
@@ -113,24 +113,42 @@ def sparse_mx_to_torch_sparse_tensor(sparse_mx):
     return torch.sparse.FloatTensor(indices, values, shape)
 
 
-def get_roc_score(emb, adj_orig, edges_pos, edges_neg):
+# Bytes of decoder scores held at once: z @ z.T is computed one tile of rows at a time
+DECODER_MEMORY_BUDGET = 64 * 2 ** 20
+
+
+def row_tiles(n_rows, n_cols, budget=DECODER_MEMORY_BUDGET, itemsize=4):
+    """(start, stop) ranges of rows whose scores against `n_cols` columns fit in `budget` bytes"""
+    step = max(1, budget // max(1, n_cols * itemsize))
+    return [(start, min(start + step, n_rows)) for start in range(0, n_rows, step)]
 
-    def sigmoid(x):
+
+def sigmoid(x):
+    with np.errstate(over="ignore"):
         return 1 / (1 + np.exp(-x))
 
-    # Predict on test set of edges
-    adj_rec = np.dot(emb, emb.T)
-    preds = []
-    pos = []
-    for e in edges_pos:
-        preds.append(sigmoid(adj_rec[e[0], e[1]]))
-        pos.append(adj_orig[e[0], e[1]])
-
-    preds_neg = []
-    neg = []
-    for e in edges_neg:
-        preds_neg.append(sigmoid(adj_rec[e[0], e[1]]))
-        neg.append(adj_orig[e[0], e[1]])
+
+def decode_rows(emb, rows=None, budget=DECODER_MEMORY_BUDGET, logits=False):
+    """
+    Decoder scores sigmoid(emb[rows] @ emb.T) of the nodes `rows` (all by default), yielded as
+    (ids, scores) tiles of at most `budget` bytes; the inner products themselves if `logits`
+    """
+    rows = np.arange(len(emb)) if rows is None else np.asarray(rows, dtype=np.int64)
+    for start, stop in row_tiles(len(rows), len(emb), budget, emb.itemsize):
+        scores = emb[rows[start:stop]] @ emb.T
+        yield rows[start:stop], scores if logits else sigmoid(scores)
+
+
+def decode_pairs(emb, pairs):
+    """Decoder scores of the (i, j) node pairs only"""
+    pairs = np.asarray(pairs, dtype=np.int64).reshape(-1, 2)
+    return sigmoid(np.einsum("ij,ij->i", emb[pairs[:, 0]], emb[pairs[:, 1]]))
+
+
+def get_roc_score(emb, adj_orig, edges_pos, edges_neg):
+    # Predict on test set of edges, scoring the listed pairs only
+    preds = decode_pairs(emb, edges_pos)
+    preds_neg = decode_pairs(emb, edges_neg)
 
     preds_all = np.hstack([preds, preds_neg])
     labels_all = np.hstack([np.ones(len(preds)), np.zeros(len(preds_neg))])